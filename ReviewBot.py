@@ -21,15 +21,22 @@
 
 from pprint import pprint
 import os, sys, re
+import copy
+import hashlib
 import logging
+from multiprocessing.pool import ThreadPool
+import threading
 from optparse import OptionParser
 import cmdln
 from collections import namedtuple
 from collections import OrderedDict
 from osclib.comments import CommentAPI
 from osclib.memoize import memoize
+from osclib.memoize import MemoStore
+from osclib.request_events import event_source
 import signal
 import datetime
+import time
 
 try:
     from xml.etree import cElementTree as ET
@@ -54,6 +61,16 @@ class ReviewBot(object):
 
     COMMENT_MARKER_REGEX = re.compile(r'<!-- (?P<bot>[^ ]+) state=(?P<state>[^ ]+)(?: result=(?P<result>[^ ]+))? -->')
 
+    # With jobs > 1 the requests are checked concurrently, each one by a
+    # copy of the bot (see clone()). Bots that keep per request state in
+    # objects shared by the copies must disable it.
+    CONCURRENT = True
+
+    # Namespace and size of the review results in the MemoStore
+    RESULT_CACHE = 'review_result'
+    RESULT_CACHE_SLOTS = 4096
+    RESULT_CACHE_NCLEAN = 1024
+
     # map of default config entries
     config_defaults = {
             # list of tuples (prefix, apiurl, submitrequestprefix)
@@ -78,6 +95,13 @@ class ReviewBot(object):
         self.fallback_group = None
         self.comment_api = CommentAPI(self.apiurl)
         self.bot_name = self.__class__.__name__
+        self.jobs = 1
+        # Serialize the calls that change requests when checking
+        # concurrently.
+        self.lock = threading.RLock()
+        # Reuse the result of unchanged requests for this many seconds.
+        self.result_cache_ttl = 0
+        self.result_cache_stats = {'hit': 0, 'miss': 0}
 
         self.load_config()
 
@@ -121,11 +145,14 @@ class ReviewBot(object):
 
         # give implementations a chance to do something before single requests
         self.prepare_review()
-        for req in self.requests:
-            self.logger.info("checking %s"%req.reqid)
-            self.request = req
-            good = self.check_one_request(req)
+        if self.jobs > 1 and self.CONCURRENT and len(self.requests) > 1:
+            results = self._check_requests_concurrent()
+        else:
+            results = self._check_requests_sequential()
 
+        # The reviews are always set from this thread in the order of
+        # the requests.
+        for req, good, bot in results:
             if self.review_mode == 'no':
                 good = None
             elif self.review_mode == 'accept':
@@ -134,9 +161,56 @@ class ReviewBot(object):
             if good is None:
                 self.logger.info("%s ignored"%req.reqid)
             elif good:
-                self._set_review(req, 'accepted')
+                bot._set_review(req, 'accepted')
             elif self.review_mode != 'accept-onpass':
-                self._set_review(req, 'declined')
+                bot._set_review(req, 'declined')
+
+        if self.result_cache_ttl:
+            self.logger.debug("result cache: %(hit)d hits, %(miss)d misses"%self.result_cache_stats)
+
+    def _check_requests_sequential(self):
+        for req in self.requests:
+            self.logger.info("checking %s"%req.reqid)
+            self.request = req
+            yield req, self.check_one_request_cached(req), self
+
+    def _check_requests_concurrent(self):
+        pool = ThreadPool(min(self.jobs, len(self.requests)))
+        try:
+            for req, good, bot, records, exc_info in pool.imap(self._check_one_request_worker, self.requests):
+                # Log as if the requests were checked one after another.
+                for record in records:
+                    self.logger.handle(record)
+                if exc_info:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                bot.logger = self.logger
+                yield req, good, bot
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _check_one_request_worker(self, req):
+        logger = logging.Logger(self.logger.name, self.logger.getEffectiveLevel())
+        handler = RecordLogHandler()
+        logger.addHandler(handler)
+
+        bot = self.clone(logger)
+        good, exc_info = None, None
+        try:
+            bot.logger.info("checking %s"%req.reqid)
+            bot.request = req
+            good = bot.check_one_request_cached(req)
+        except Exception:
+            exc_info = sys.exc_info()
+        return req, good, bot, handler.records, exc_info
+
+    def clone(self, logger):
+        """Return a copy of the bot to check a request concurrently,
+        logging to logger. Reimplement it to copy helper bots too."""
+        bot = copy.copy(self)
+        bot.logger = logger
+        bot.review_messages = self.review_messages.copy()
+        return bot
 
     def _set_review(self, req, state):
         doit = self.can_accept_review(req.reqid)
@@ -192,7 +266,8 @@ class ReviewBot(object):
             return True
 
         try:
-            r = osc.core.http_POST(u, data=msg)
+            with self.lock:
+                r = osc.core.http_POST(u, data=msg)
         except urllib2.HTTPError, e:
             self.logger.error(e)
             return False
@@ -204,6 +279,76 @@ class ReviewBot(object):
 
         return True
 
+    def check_one_request_cached(self, req):
+        """
+        check_one_request() unless the result of a previous run is stored
+        for the same request, sources, targets and bot configuration.
+        Only decisions are stored, an undecided request may depend on
+        things outside of the key (builds, other reviews) and is always
+        checked again.
+        """
+        if not self.result_cache_ttl:
+            return self.check_one_request(req)
+
+        key = self.result_cache_key(req)
+        store = MemoStore.instance()
+        now = time.time()
+        entry = store.get(self.RESULT_CACHE, key)
+        if entry and now - entry[0] < self.result_cache_ttl:
+            with self.lock:
+                self.result_cache_stats['hit'] += 1
+            good, self.review_messages = entry[1]
+            self.logger.debug("%s unchanged, reusing previous result %s"%(req.reqid, good))
+            return good
+
+        with self.lock:
+            self.result_cache_stats['miss'] += 1
+        good = self.check_one_request(req)
+        if good is not None:
+            store.set(self.RESULT_CACHE, key, now, (good, self.review_messages),
+                      self.RESULT_CACHE_SLOTS, self.RESULT_CACHE_NCLEAN)
+        return good
+
+    def result_cache_config(self):
+        """Settings that change the result of check_one_request().
+        Reimplement it to add the options of the bot."""
+        return (self.config, self.review_mode, self.fallback_user, self.fallback_group,
+                self.review_user, self.review_group)
+
+    def result_cache_key(self, req):
+        """Key of the stored result of a request, from the state of the
+        request, the source and target of its actions and the
+        configuration of the bot."""
+        inputs = [self.bot_name, req.reqid, self.apiurl,
+                  req.state.name if req.state is not None else None,
+                  sorted((r.by_user, r.by_group, r.by_project, r.by_package, r.state)
+                         for r in req.reviews)]
+        for a in req.actions:
+            src_project = getattr(a, 'src_project', None)
+            src_package = getattr(a, 'src_package', None)
+            tgt_project = getattr(a, 'tgt_project', None)
+            tgt_package = getattr(a, 'tgt_package', None)
+            source = target = None
+            if src_project and src_package:
+                source = self._get_sourceinfo_md5(src_project, src_package, getattr(a, 'src_rev', None))
+            if tgt_project and tgt_package:
+                target = self._get_sourceinfo_md5(tgt_project, tgt_package)
+            inputs.append((a.type, src_project, src_package, source, tgt_project, tgt_package, target))
+        inputs.append(self.result_cache_config())
+        return hashlib.md5(repr(inputs)).digest()
+
+    def _get_sourceinfo_md5(self, project, package, rev=None):
+        # Not memoized, as the target may change between runs.
+        query = { 'view': 'info' }
+        if rev is not None:
+            query['rev'] = rev
+        url = osc.core.makeurl(self.apiurl, ('source', project, package), query=query)
+        try:
+            root = ET.parse(osc.core.http_GET(url)).getroot()
+        except (urllib2.HTTPError, urllib2.URLError):
+            return None
+        return root.get('srcmd5'), root.get('verifymd5')
+
     def check_one_request(self, req):
         """
         check all actions in one request.
@@ -353,33 +498,39 @@ class ReviewBot(object):
             return True
         return False
 
-    def set_request_ids_search_review(self):
-        if self.review_user:
-           review = "@by_user='%s' and @state='new'" % self.review_user
-        else:
-           review = "@by_group='%s' and @state='new'" % self.review_group
-        url = osc.core.makeurl(self.apiurl, ('search', 'request'), { 'match': "state/@name='review' and review[%s]" % review, 'withhistory': 1 } )
-        root = ET.parse(osc.core.http_GET(url)).getroot()
+    # Number of request ids per search when only some requests are
+    # searched.
+    SEARCH_IDS_CHUNK = 50
 
+    def _set_request_ids_search(self, match, ids=None):
+        """Set the requests matching the xpath, only from the given
+        request ids if any."""
         self.requests = []
 
-        for request in root.findall('request'):
-            req = osc.core.Request()
-            req.read(request)
-            self.requests.append(req)
+        matches = [match]
+        if ids is not None:
+            ids = sorted(ids)
+            matches = ["(%s) and (%s)" % (match, ' or '.join("@id='%s'" % i for i in ids[n:n + self.SEARCH_IDS_CHUNK]))
+                       for n in range(0, len(ids), self.SEARCH_IDS_CHUNK)]
 
-    def set_request_ids_project(self, project, typename):
-        url = osc.core.makeurl(self.apiurl, ('search', 'request'),
-                               { 'match': "(state/@name='review' or state/@name='new') and (action/target/@project='%s' and action/@type='%s')" % (project, typename),
-                                 'withhistory': 1 })
-        root = ET.parse(osc.core.http_GET(url)).getroot()
+        for match in matches:
+            url = osc.core.makeurl(self.apiurl, ('search', 'request'), { 'match': match, 'withhistory': 1 } )
+            root = ET.parse(osc.core.http_GET(url)).getroot()
 
-        self.requests = []
+            for request in root.findall('request'):
+                req = osc.core.Request()
+                req.read(request)
+                self.requests.append(req)
 
-        for request in root.findall('request'):
-            req = osc.core.Request()
-            req.read(request)
-            self.requests.append(req)
+    def set_request_ids_search_review(self, ids=None):
+        if self.review_user:
+           review = "@by_user='%s' and @state='new'" % self.review_user
+        else:
+           review = "@by_group='%s' and @state='new'" % self.review_group
+        self._set_request_ids_search("state/@name='review' and review[%s]" % review, ids)
+
+    def set_request_ids_project(self, project, typename, ids=None):
+        self._set_request_ids_search("(state/@name='review' or state/@name='new') and (action/target/@project='%s' and action/@type='%s')" % (project, typename), ids)
 
     def comment_handler_add(self, level=logging.INFO):
         """Add handler to start recording log messages for comment."""
@@ -425,9 +576,10 @@ class ReviewBot(object):
         self.logger.debug('adding comment to {}: {}'.format(request.reqid, message))
 
         if not self.dryrun:
-            if comment_id is not None:
-                self.comment_api.delete(comment_id)
-            self.comment_api.add_comment(request_id=request.reqid, comment=str(message))
+            with self.lock:
+                if comment_id is not None:
+                    self.comment_api.delete(comment_id)
+                self.comment_api.add_comment(request_id=request.reqid, comment=str(message))
 
         self.comment_handler_remove()
 
@@ -441,6 +593,16 @@ class CommentFromLogHandler(logging.Handler):
         self.lines.append(record.getMessage())
 
 
+class RecordLogHandler(logging.Handler):
+    """Keep the log records of a request checked concurrently."""
+    def __init__(self, level=logging.NOTSET):
+        super(RecordLogHandler, self).__init__(level)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
 class CommandLineInterface(cmdln.Cmdln):
     def __init__(self, *args, **kwargs):
         cmdln.Cmdln.__init__(self, args, kwargs)
@@ -459,6 +621,9 @@ class CommandLineInterface(cmdln.Cmdln):
         parser.add_option("--fallback-user", dest='fallback_user', metavar='USER', help="fallback review user")
         parser.add_option("--fallback-group", dest='fallback_group', metavar='GROUP', help="fallback review group")
         parser.add_option('-c', '--config', dest='config', metavar='FILE', help='read config file FILE')
+        parser.add_option('-j', '--jobs', type='int', metavar='N', help='number of requests checked concurrently')
+        parser.add_option('--result-cache', type='int', metavar='minutes', help='reuse the result of unchanged requests for the given minutes')
+        parser.add_option('--events', metavar='URL', help='check the requests as they change, from file://, unix://, tcp:// or amqp(s):// events')
 
         return parser
 
@@ -490,6 +655,12 @@ class CommandLineInterface(cmdln.Cmdln):
         if self.options.fallback_group:
             self.checker.fallback_group = self.options.fallback_group
 
+        if self.options.jobs:
+            self.checker.jobs = self.options.jobs
+
+        if self.options.result_cache:
+            self.checker.result_cache_ttl = self.options.result_cache * 60
+
     def setup_checker(self):
         """ reimplement this """
         apiurl = osc.conf.config['apiurl']
@@ -526,8 +697,8 @@ class CommandLineInterface(cmdln.Cmdln):
         if self.checker.review_user is None and self.checker.review_group is None:
             raise osc.oscerr.WrongArgs("missing reviewer (user or group)")
 
-        def work():
-            self.checker.set_request_ids_search_review()
+        def work(ids=None):
+            self.checker.set_request_ids_search_review(ids)
             self.checker.check_requests()
 
         self.runner(work, opts.interval)
@@ -540,16 +711,50 @@ class CommandLineInterface(cmdln.Cmdln):
         ${cmd_option_list}
         """
 
-        def work():
-            self.checker.set_request_ids_project(project, typename)
+        def work(ids=None):
+            self.checker.set_request_ids_project(project, typename, ids)
             self.checker.check_requests()
 
         self.runner(work, opts.interval)
 
+    # Minutes between full checks when following events without interval
+    RECONCILE_INTERVAL = 60
+
+    def event_runner(self, workfunc, interval):
+        """ runs the specified callback for the requests that changed
+        as soon as there are events, and for all the requests every
+        <interval> minutes to catch lost events
+        """
+        source = event_source(self.options.events)
+        interval = (interval or self.RECONCILE_INTERVAL) * 60
+        try:
+            reconciled = 0
+            while True:
+                ids = None
+                remaining = reconciled + interval - time.time()
+                if remaining > 0:
+                    ids = source.wait(remaining)
+                    if not ids:
+                        continue
+                    self.logger.info("requests changed: %s" % ', '.join(sorted(ids)))
+                else:
+                    reconciled = time.time()
+                    self.logger.info("checking all requests")
+
+                try:
+                    workfunc(ids)
+                except Exception, e:
+                    self.logger.exception(e)
+        finally:
+            source.close()
+
     def runner(self, workfunc, interval):
         """ runs the specified callback every <interval> minutes or
         once if interval is None or 0
         """
+        if self.options.events:
+            return self.event_runner(workfunc, interval)
+
         class ExTimeout(Exception):
             """raised on timeout"""
 
@@ -31,9 +31,9 @@ import urllib2
 
 import osc.conf
 import osc.core
-from urllib import quote_plus
 
 from osclib.memoize import memoize
+from osclib.sourceinfo import SourceInfoFetcher
 
 logger = logging.getLogger()
 
@@ -43,19 +43,13 @@ http_GET = osc.core.http_GET
 http_DELETE = osc.core.http_DELETE
 http_POST = osc.core.http_POST
 
-# http://stackoverflow.com/questions/312443/how-do-you-split-a-list-into-evenly-sized-chunks-in-python
-def chunks(l, n):
-    """ Yield successive n-sized chunks from l.
-    """
-    for i in xrange(0, len(l), n):
-        yield l[i:i+n]
-
 class ToolBase(object):
     def __init__(self):
         self.apiurl = osc.conf.config['apiurl']
         self.debug = osc.conf.config['debug']
         self.caching = False
         self.dryrun = False
+        self.sourceinfo = SourceInfoFetcher(self.apiurl)
 
     @memoize(add_invalidate=True)
     def _cached_GET(self, url):
@@ -101,6 +95,12 @@ class ToolBase(object):
         root = ET.fromstring(self._meta_get_packagelist(prj, deleted, expand))
         return [ node.get('name') for node in root.findall('entry') if not node.get('name') == '_product' and not node.get('name').startswith('_product:') and not node.get('name').startswith('patchinfo.') ]
 
+    def get_source_infos(self, project, packages):
+        """Return the SourceInfo records of the packages of a project."""
+        if self.caching:
+            return self.sourceinfo.get(project, packages)
+        return self.sourceinfo.fetch(project, packages)
+
     # FIXME: duplicated from manager_42
     def latest_packages(self, project):
         data = self.cached_GET(makeurl(self.apiurl,
@@ -22,12 +22,12 @@
 from optparse import OptionParser
 from pprint import pformat, pprint
 from stat import S_ISREG, S_ISLNK
-from tempfile import NamedTemporaryFile
 import cmdln
 import logging
 import os
 import re
 import shutil
+import struct
 import subprocess
 import sys
 import time
@@ -41,12 +41,14 @@ except ImportError:
 
 import osc.conf
 import osc.core
-from osc.util.cpio import CpioRead
 
 import urllib2
 import rpm
 from collections import namedtuple
+from osclib.cpio import Cpio, CpioError
+from osclib.download import BinaryDownloader
 from osclib.pkgcache import PkgCache
+from osclib.rpmheader import header_blob
 from osclib.comments import CommentAPI
 
 from abichecker_common import CACHEDIR
@@ -170,16 +172,18 @@ class ABIChecker(ReviewBot.ReviewBot):
     """ check ABI of library packages
     """
 
+    # The database session and the request id of the log filter are
+    # shared by all the requests.
+    CONCURRENT = False
+
     def __init__(self, *args, **kwargs):
         ReviewBot.ReviewBot.__init__(self, *args, **kwargs)
 
         self.no_review = False
         self.force = False
 
-        self.ts = rpm.TransactionSet()
-        self.ts.setVSFlags(rpm._RPMVSF_NOSIGNATURES)
-
         self.pkgcache = PkgCache(BINCACHE)
+        self.downloader = BinaryDownloader(self.apiurl, self.pkgcache)
 
         # reports of source submission
         self.reports = []
@@ -697,48 +701,45 @@ class ABIChecker(ReviewBot.ReviewBot):
             # fetch binary rpms
             downloaded = self.download_files(project, package, repo, arch, fetchlist, mtimes)
 
-            # extract binary rpms
-            tmpfile = os.path.join(CACHEDIR, "cpio")
+            # extract binary rpms, the cpio archive is read from the pipe
             for fn in fetchlist:
                 self.logger.debug("extract %s"%fn)
-                with open(tmpfile, 'wb') as tmpfd:
-                    if not fn in downloaded:
-                        raise FetchError("%s was not downloaded!"%fn)
-                    self.logger.debug(downloaded[fn])
-                    r = subprocess.call(['rpm2cpio', downloaded[fn]], stdout=tmpfd, close_fds=True)
-                    if r != 0:
-                        raise FetchError("failed to extract %s!"%fn)
-                    tmpfd.close()
-                    cpio = CpioRead(tmpfile)
-                    cpio.read()
-                    for ch in cpio:
-                        fn = ch.filename
-                        if fn.startswith('./'): # rpm payload is relative
-                            fn = fn[1:]
-                        self.logger.debug("cpio fn %s", fn)
-                        if not fn in liblist and not fn in debugfiles:
+                if not fn in downloaded:
+                    raise FetchError("%s was not downloaded!"%fn)
+                self.logger.debug(downloaded[fn])
+                p = subprocess.Popen(['rpm2cpio', downloaded[fn]], stdout=subprocess.PIPE, close_fds=True)
+                done = False
+                try:
+                    for ch in Cpio(p.stdout):
+                        name = ch.name
+                        if name.startswith('./'): # rpm payload is relative
+                            name = name[1:]
+                        self.logger.debug("cpio fn %s", name)
+                        if not name in liblist and not name in debugfiles:
                             continue
                         dst = os.path.join(UNPACKDIR, project, package, repo, arch)
-                        dst += fn
+                        dst += name
                         if not os.path.exists(os.path.dirname(dst)):
                             os.makedirs(os.path.dirname(dst))
                         self.logger.debug("dst %s", dst)
-                        # the filehandle in the cpio archive is private so
-                        # open it again
-                        with open(tmpfile, 'rb') as cpiofh:
-                            cpiofh.seek(ch.dataoff, os.SEEK_SET)
-                            with open(dst, 'wb') as fh:
-                                while True:
-                                    buf = cpiofh.read(4096)
-                                    if buf is None or buf == '':
-                                        break
-                                    fh.write(buf)
-            os.unlink(tmpfile)
+                        with open(dst, 'wb') as fh:
+                            ch.copyto(fh)
+                    done = True
+                except CpioError, e:
+                    self.logger.error(str(e))
+                finally:
+                    # never leave rpm2cpio behind, whatever stopped the loop
+                    if not done and p.poll() is None:
+                        p.kill()
+                    # drain the padding after the trailer
+                    p.communicate()
+                if not done or p.returncode != 0:
+                    raise FetchError("failed to extract %s!"%fn)
 
             return liblist
 
     def download_files(self, project, package, repo, arch, filenames, mtimes):
-        downloaded = dict()
+        files = []
         for fn in filenames:
             if not fn in mtimes:
                 raise FetchError("missing mtime information for %s, can't check"% fn)
@@ -746,40 +747,18 @@ class ABIChecker(ReviewBot.ReviewBot):
             if not os.path.exists(repodir):
                 os.makedirs(repodir)
             t = os.path.join(repodir, fn)
-            self._get_binary_file(project, repo, arch, package, fn, t, mtimes[fn])
-            downloaded[fn] = t
-        return downloaded
-
-    # XXX: from repochecker
-    def _get_binary_file(self, project, repository, arch, package, filename, target, mtime):
-        """Get a binary file from OBS."""
-        # Check if the file is already there.
-        key = (project, repository, arch, package, filename, mtime)
-        if key in self.pkgcache:
-            try:
-                os.unlink(target)
-            except:
-                pass
-            self.pkgcache.linkto(key, target)
-        else:
-            osc.core.get_binary_file(self.apiurl, project, repository, arch,
-                            filename, package=package,
-                            target_filename=target)
-            self.pkgcache[key] = target
+            files.append((project, repo, arch, package, fn, t, mtimes[fn]))
+        self.downloader.download(files)
+        self.logger.debug("downloaded %s", self.downloader.format_stats())
+        return dict((f[4], f[5]) for f in files)
 
-    def readRpmHeaderFD(self, fd):
-        h = None
+    def readRpmHeader(self, data):
+        """Load the header of an RPM from a buffer that starts with the lead"""
         try:
-            h = self.ts.hdrFromFdno(fd)
-        except rpm.error, e:
-            if str(e) == "public key not available":
-                print str(e)
-            if str(e) == "public key not trusted":
-                print str(e)
-            if str(e) == "error reading package header":
-                print str(e)
-            h = None
-        return h
+            return rpm.hdr(bytes(header_blob(data)))
+        except (ValueError, struct.error, rpm.error), e:
+            self.logger.error(str(e))
+            return None
 
     def _fetchcpioheaders(self, project, package, repo, arch):
         u = osc.core.makeurl(self.apiurl, [ 'build', project, repo, arch, package ],
@@ -788,28 +767,22 @@ class ABIChecker(ReviewBot.ReviewBot):
             r = osc.core.http_GET(u)
         except urllib2.HTTPError, e:
             raise FetchError('failed to fetch header information: %s'%e)
-        tmpfile = NamedTemporaryFile(prefix="cpio-", delete=False)
-        for chunk in r:
-            tmpfile.write(chunk)
-        tmpfile.close()
-        cpio = CpioRead(tmpfile.name)
-        cpio.read()
         rpm_re = re.compile('(.+\.rpm)-[0-9A-Fa-f]{32}$')
-        for ch in cpio:
-            # ignore errors
-            if ch.filename == '.errors':
-                continue
-            # the filehandle in the cpio archive is private so
-            # open it again
-            with open(tmpfile.name, 'rb') as fh:
-                fh.seek(ch.dataoff, os.SEEK_SET)
-                h = self.readRpmHeaderFD(fh)
+        # the archive is read from the response, each payload is the
+        # beginning of an rpm up to the end of its header
+        try:
+            for ch in Cpio(r):
+                # ignore errors
+                if ch.name == '.errors':
+                    continue
+                h = self.readRpmHeader(ch.header())
                 if h is None:
-                    raise FetchError("failed to read rpm header for %s"%ch.filename)
-                m = rpm_re.match(ch.filename)
+                    raise FetchError("failed to read rpm header for %s"%ch.name)
+                m = rpm_re.match(ch.name)
                 if m:
                     yield m.group(1), h
-        os.unlink(tmpfile.name)
+        except CpioError, e:
+            raise FetchError('failed to read header information: %s'%e)
 
     def _getmtimes(self, prj, pkg, repo, arch):
         """ returns a dict of filename: mtime """
@@ -1060,6 +1033,7 @@ class CommandLineInterface(ReviewBot.CommandLineInterface):
         parser.add_option("--force", action="store_true", help="recheck requests that are already considered done")
         parser.add_option("--no-review", action="store_true", help="don't actually accept or decline, just comment")
         parser.add_option("--web-url", metavar="URL", help="URL of web service")
+        parser.add_option("--download-jobs", metavar="N", type="int", help="number of concurrent binary downloads")
         return parser
 
     def postoptparse(self):
@@ -1079,6 +1053,8 @@ class CommandLineInterface(ReviewBot.CommandLineInterface):
             bot.no_review = True
         if self.options.force:
             bot.force = True
+        if self.options.download_jobs:
+            bot.downloader.workers = self.options.download_jobs
 
         return bot
 
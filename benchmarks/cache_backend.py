@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# Copyright (C) 2017 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Compare the osclib.cache backends for put, get and project expiry."""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from osclib.cache import BACKENDS
+
+
+APIURL = 'https://api.example.com'
+
+
+def bench(name, entries, projects, size):
+    root = tempfile.mkdtemp(prefix='cache-bench-')
+    backend = BACKENDS[name](root)
+    body = 'x' * size
+    urls = [('{}/source/project-{}/package-{}/_meta'.format(APIURL, i % projects, i),
+             'project-{}'.format(i % projects)) for i in xrange(entries)]
+    results = []
+    try:
+        start = time()
+        for url, project in urls:
+            backend.put(url, project, body)
+        results.append(time() - start)
+
+        start = time()
+        for url, project in urls:
+            if backend.mtime(url, project) is not None:
+                backend.open(url, project).read()
+        results.append(time() - start)
+
+        start = time()
+        for i in xrange(projects):
+            backend.delete_project(APIURL, 'project-{}'.format(i))
+        results.append(time() - start)
+    finally:
+        backend.close()
+        shutil.rmtree(root)
+
+    return results
+
+
+def main(args):
+    print('{:<10} {:>8} {:>10} {:>10} {:>10}'.format('backend', 'entries', 'put', 'get', 'expire'))
+    for entries in args.entries:
+        for name in args.backend:
+            put, get, expire = bench(name, entries, args.projects, args.size)
+            print('{:<10} {:>8} {:>9.2f}s {:>9.2f}s {:>9.2f}s'.format(name, entries, put, get, expire))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-b', '--backend', action='append', choices=sorted(BACKENDS),
+                        help='backend to benchmark (default: all)')
+    parser.add_argument('-n', '--entries', type=int, action='append',
+                        help='number of cache entries (default: 10000 and 100000)')
+    parser.add_argument('-p', '--projects', type=int, default=100,
+                        help='number of projects entries are spread over')
+    parser.add_argument('-s', '--size', type=int, default=1024,
+                        help='size of each cached response in bytes')
+    args = parser.parse_args()
+    args.backend = args.backend or sorted(BACKENDS)
+    args.entries = args.entries or [10000, 100000]
+
+    sys.exit(main(args))
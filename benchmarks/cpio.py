@@ -0,0 +1,155 @@
+#!/usr/bin/python
+# Copyright (C) 2017 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+"""Time and peak memory of reading the rpm headers of a view=cpioheaders
+archive with osclib.cpio, compared to the temporary file and CpioRead
+approach previously used by the abichecker."""
+
+from __future__ import print_function
+
+import argparse
+import hashlib
+import mmap
+from multiprocessing import Pool
+import os
+import resource
+import shutil
+import struct
+import sys
+import tempfile
+from time import time
+
+from osc.util.cpio import CpioRead
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from osclib.cpio import Cpio
+from osclib.rpmheader import header_blob
+
+
+def entry(name, payload):
+    fields = (1, 0100644, 0, 0, 1, 0, len(payload), 0, 0, 0, 0, len(name) + 1, 0)
+    header = '070701' + ''.join('%08X' % f for f in fields) + name + '\0'
+    header += '\0' * ((4 - len(header) % 4) % 4)
+    return header + payload + '\0' * ((4 - len(payload) % 4) % 4)
+
+
+def rpm_header(il, dl):
+    return struct.pack('>4s4xII', '\x8e\xad\xe8\x01', il, dl) + '\1' * (il * 16 + dl)
+
+
+def archive(directory, entries, size):
+    """Write a cpioheaders archive of entries rpm headers of about size
+    bytes each."""
+    filename = os.path.join(directory, 'cpioheaders')
+    signature = rpm_header(7, 1000)
+    with open(filename, 'wb') as f:
+        for i in xrange(entries):
+            name = 'package%d-1.0-1.1.x86_64.rpm-%s' % (i, hashlib.md5(str(i)).hexdigest())
+            header = rpm_header(100, size - 1000 - (i % 7))
+            lead = '\xed\xab\xee\xdb' + '\0' * 92
+            pad = '\0' * ((8 - len(signature)) & 7)
+            f.write(entry(name, lead + signature + pad + header))
+        f.write(entry('TRAILER!!!', ''))
+    return filename
+
+
+def tempfile_cpioread(filename):
+    # copy the response to a temporary file and open it again per entry
+    tmp = tempfile.NamedTemporaryFile(prefix='cpio-')
+    with open(filename, 'rb') as r:
+        for chunk in iter(lambda: r.read(8192), ''):
+            tmp.write(chunk)
+    tmp.flush()
+    cpio = CpioRead(tmp.name)
+    cpio.read()
+    for ch in cpio:
+        with open(tmp.name, 'rb') as fh:
+            fh.seek(ch.dataoff, os.SEEK_SET)
+            yield len(header_blob(fh.read(ch.filesize)))
+    tmp.close()
+
+
+def stream(filename):
+    with open(filename, 'rb') as f:
+        for ch in Cpio(f):
+            yield len(header_blob(ch.header()))
+
+
+def buffer(filename):
+    with open(filename, 'rb') as f:
+        data = f.read()
+    for ch in Cpio(data):
+        yield len(header_blob(ch.header()))
+
+
+def mmapped(filename):
+    with open(filename, 'rb') as f:
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    for ch in Cpio(m):
+        yield len(header_blob(ch.header()))
+
+
+METHODS = (
+    ('cpioread', tempfile_cpioread),
+    ('buffer', buffer),
+    ('mmap', mmapped),
+    ('stream', stream),
+)
+
+
+def run(args):
+    method, filename = args
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time()
+    count = 0
+    total = 0
+    for size in dict(METHODS)[method](filename):
+        count += 1
+        total += size
+    seconds = time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    return count, total, seconds, peak / 1024.0
+
+
+def main(args):
+    directory = tempfile.mkdtemp(prefix='cpio-bench-')
+    try:
+        filename = archive(directory, args.entries, args.size)
+        print('archive of {} entries, {:.1f} MiB'.format(
+            args.entries, os.path.getsize(filename) / 1048576.0))
+        print('{:<10} {:>9} {:>10} {:>10}'.format('method', 'headers', 'total (s)', 'peak (MiB)'))
+        for method, _ in METHODS:
+            # A new process for each run, so the peak is not shared.
+            pool = Pool(1)
+            count, total, seconds, peak = pool.apply(run, ((method, filename),))
+            pool.close()
+            pool.join()
+            print('{:<10} {:>9} {:>10.3f} {:>10.1f}'.format(method, count, seconds, peak))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-e', '--entries', type=int, default=3000,
+                        help='rpm headers in the archive')
+    parser.add_argument('-s', '--size', type=int, default=100000,
+                        help='approximate size of each rpm header')
+    args = parser.parse_args()
+
+    sys.exit(main(args))
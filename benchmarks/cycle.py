@@ -0,0 +1,135 @@
+#!/usr/bin/python
+# Copyright (C) 2017 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Cycle detection time of osclib.cycle.Graph compared to the recursive
+implementation, on a synthetic graph of the size of Factory."""
+
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import sys
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from osclib.cycle import Graph
+
+
+def recursive_cycles(adj):
+    """The previous implementation: recursive Tarjan over name sets."""
+    index_counter = [0]
+    stack = []
+    index = {}
+    lowlink = {}
+    on_stack = set()
+    cycles = []
+
+    def strongly_connected(v):
+        index[v] = lowlink[v] = index_counter[0]
+        index_counter[0] += 1
+        stack.append(v)
+        on_stack.add(v)
+        for w in adj.get(v, ()):
+            if w not in adj:
+                continue
+            if w not in index:
+                strongly_connected(w)
+                lowlink[v] = min(lowlink[v], lowlink[w])
+            elif w in on_stack:
+                lowlink[v] = min(lowlink[v], index[w])
+        if lowlink[v] == index[v]:
+            cycle = []
+            while True:
+                w = stack.pop()
+                on_stack.discard(w)
+                cycle.append(w)
+                if w == v:
+                    break
+            if len(cycle) > 1:
+                cycles.append(frozenset(cycle))
+
+    for v in sorted(adj):
+        if v not in index:
+            strongly_connected(v)
+    return frozenset(cycles)
+
+
+def synthetic(nodes, degree, back_edges, seed):
+    """Dependencies point to lower numbered packages, except a few back
+    edges that create the cycles."""
+    rnd = random.Random(seed)
+    adj = {}
+    for i in range(nodes):
+        deps = set(rnd.randrange(i) for _ in range(min(i, degree)))
+        adj['package-%05d' % i] = set('package-%05d' % d for d in deps)
+    for _ in range(back_edges):
+        u, v = sorted(rnd.sample(range(nodes), 2))
+        adj['package-%05d' % u].add('package-%05d' % v)
+    return adj
+
+
+def _graph(adj):
+    graph = Graph()
+    graph.add_nodes_from((v, None) for v in adj)
+    for v in adj:
+        graph.add_edges_from((v, w) for w in adj[v])
+    return graph
+
+
+def timeit(fn, *args):
+    start = time()
+    result = fn(*args)
+    return time() - start, result
+
+
+def main(args):
+    adj = synthetic(args.nodes, args.degree, args.back_edges, args.seed)
+    print('{} nodes, {} edges'.format(len(adj), sum(len(e) for e in adj.values())))
+
+    elapsed, graph = timeit(lambda: _graph(adj))
+    print('{:<30} {:>8.3f}s'.format('build Graph', elapsed))
+
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10 * args.nodes))
+    elapsed, expected = timeit(recursive_cycles, adj)
+    print('{:<30} {:>8.3f}s'.format('recursive cycles', elapsed))
+
+    elapsed, cycles = timeit(graph.cycles)
+    print('{:<30} {:>8.3f}s'.format('Graph.cycles', elapsed))
+    assert cycles == expected
+
+    # A staging usually changes a handful of leaf packages.
+    sources = sorted(adj)[-args.changed:]
+    elapsed, _ = timeit(graph.cycles, sources)
+    print('{:<30} {:>8.3f}s'.format('Graph.cycles (%d sources)' % args.changed, elapsed))
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--nodes', type=int, default=13000,
+                        help='number of packages')
+    parser.add_argument('-d', '--degree', type=int, default=15,
+                        help='build dependencies per package')
+    parser.add_argument('-b', '--back-edges', type=int, default=200,
+                        help='edges that create cycles')
+    parser.add_argument('-c', '--changed', type=int, default=10,
+                        help='changed packages for the partial run')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    sys.exit(main(args))
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+# Copyright (C) 2017 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Calls per second of osclib.memoize compared to the shelve based store."""
+
+from __future__ import print_function
+
+import argparse
+import cPickle as pickle
+from datetime import datetime
+import fcntl
+from multiprocessing import Pool
+import os
+import shelve
+import shutil
+import sys
+import tempfile
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import osclib.memoize
+from osclib.memoize import MemoStore
+
+
+def shelve_memoize(cache_name, slots=4096, nclean=1024, ttl=60*60*2):
+    """The previous implementation: a flock and a shelve open per call."""
+    def _memoize(fn):
+        def _key(obj):
+            key = pickle.dumps(obj, protocol=-1)
+            return pickle.dumps(pickle.loads(key), protocol=-1)
+
+        def _fn(*args, **kwargs):
+            now = datetime.now()
+            key = _key((args[1:], kwargs))
+            lckfile = open(cache_name + '.lck', 'w')
+            fcntl.flock(lckfile.fileno(), fcntl.LOCK_EX)
+            cache = shelve.open(cache_name, protocol=-1)
+            value, updated = None, False
+            if key in cache:
+                timestamp, value = cache[key]
+                updated = (now - timestamp).total_seconds() < ttl
+            if not updated:
+                value = fn(*args, **kwargs)
+                cache[key] = (now, value)
+            if len(cache) >= slots:
+                for k in sorted(cache, key=lambda k: cache[k][0])[:nclean + len(cache) - slots]:
+                    del cache[k]
+            cache.close()
+            fcntl.flock(lckfile.fileno(), fcntl.LOCK_UN)
+            lckfile.close()
+            return value
+        return _fn
+    return _memoize
+
+
+def payload(self, i):
+    return {'package': 'package-{}'.format(i), 'deps': ['dep-{}'.format(d) for d in range(20)]}
+
+
+def run(args):
+    implementation, directory, calls, keys = args
+    if implementation == 'shelve':
+        fn = shelve_memoize(os.path.join(directory, 'payload'))(payload)
+    else:
+        MemoStore._instance = MemoStore(os.path.join(directory, MemoStore.FILENAME))
+        fn = osclib.memoize.memoize()(payload)
+
+    start = time()
+    for i in xrange(calls):
+        fn(None, i % keys)
+    return calls / (time() - start)
+
+
+def main(args):
+    print('{:<8} {:>9} {:>15}'.format('store', 'processes', 'calls/s'))
+    for implementation in ('shelve', 'sqlite'):
+        for processes in args.processes:
+            directory = tempfile.mkdtemp(prefix='memoize-bench-')
+            try:
+                # Populate the store so the measured calls are mostly hits.
+                run((implementation, directory, args.keys, args.keys))
+                pool = Pool(processes)
+                rates = pool.map(run, [(implementation, directory, args.calls, args.keys)] * processes)
+                pool.close()
+                print('{:<8} {:>9} {:>15.0f}'.format(implementation, processes, sum(rates)))
+            finally:
+                shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-c', '--calls', type=int, default=1000,
+                        help='calls per process')
+    parser.add_argument('-k', '--keys', type=int, default=1000,
+                        help='number of distinct arguments')
+    parser.add_argument('-p', '--processes', type=int, action='append',
+                        help='concurrent processes (default: 1 and 4)')
+    args = parser.parse_args()
+    args.processes = args.processes or [1, 4]
+
+    sys.exit(main(args))
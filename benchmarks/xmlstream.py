@@ -0,0 +1,114 @@
+#!/usr/bin/python
+# Copyright (C) 2017 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+"""Peak memory and time to the first element of osclib.xmlstream compared
+to parsing the whole tree, on documents built from the recorded fixtures."""
+
+from __future__ import print_function
+
+import argparse
+from multiprocessing import Pool
+import os
+import resource
+import shutil
+import string
+import sys
+import tempfile
+from time import time
+
+from lxml import etree as ET
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from osclib.xmlstream import iterchildren
+
+FIXTURES = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'tests', 'fixtures')
+
+
+def fixture(*path):
+    with open(os.path.join(FIXTURES, *path)) as f:
+        return f.read()
+
+
+def children(xml):
+    return [ET.tostring(child) for child in ET.fromstring(xml)]
+
+
+def documents(directory, count):
+    """Write the documents of count elements, return (name, filename, tag)."""
+    request = string.Template(fixture('request', 'template_request.xml'))
+    templates = {
+        'sourceinfo': ('sourceinfolist', children(fixture('source', 'openSUSE:Factory:Rings:0-Bootstrap'))),
+        'request': ('collection', [request.substitute(id=1, package='package', request='review',
+                                                      review='new', who='factory-auto',
+                                                      by='group', by_who='factory-staging')]),
+        'package': ('latest_updated', children(fixture('statistics', 'latest_updated'))),
+    }
+    for tag, (root, elements) in sorted(templates.items()):
+        filename = os.path.join(directory, tag + '.xml')
+        with open(filename, 'w') as f:
+            f.write('<{}>\n'.format(root))
+            for i in xrange(count):
+                f.write(elements[i % len(elements)])
+            f.write('</{}>\n'.format(root))
+        yield tag, filename
+
+
+def run(args):
+    method, filename, tag = args
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time()
+    first = None
+    count = 0
+    if method == 'tree':
+        elements = ET.parse(filename).getroot().findall(tag)
+    else:
+        elements = iterchildren(filename, tag)
+    for element in elements:
+        if first is None:
+            first = time() - start
+        count += 1
+    total = time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    return count, first, total, peak / 1024.0
+
+
+def main(args):
+    directory = tempfile.mkdtemp(prefix='xmlstream-bench-')
+    try:
+        print('{:<12} {:<8} {:>9} {:>10} {:>10} {:>10}'.format(
+            'document', 'parser', 'elements', 'first (s)', 'total (s)', 'peak (MiB)'))
+        for tag, filename in documents(directory, args.elements):
+            for method in ('tree', 'stream'):
+                # A new process for each run, so the peak is not shared.
+                pool = Pool(1)
+                count, first, total, peak = pool.apply(run, ((method, filename, tag),))
+                pool.close()
+                pool.join()
+                print('{:<12} {:<8} {:>9} {:>10.3f} {:>10.3f} {:>10.1f}'.format(
+                    tag, method, count, first, total, peak))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-e', '--elements', type=int, default=100000,
+                        help='elements in each document')
+    args = parser.parse_args()
+
+    sys.exit(main(args))
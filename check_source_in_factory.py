@@ -35,7 +35,7 @@ import osc.core
 import urllib2
 import yaml
 import ReviewBot
-from itertools import count
+from osclib.provenance import ProvenanceIndex
 
 
 class FactorySourceChecker(ReviewBot.ReviewBot):
@@ -50,6 +50,7 @@ class FactorySourceChecker(ReviewBot.ReviewBot):
         self.review_messages = { 'accepted' : 'ok', 'declined': 'the package needs to be accepted in Factory first' }
         self.lookup = {}
         self.history_limit = 5
+        self.provenance = ProvenanceIndex(self.apiurl, history_limit=self.history_limit)
 
     def reset_lookup(self):
         self.lookup = {}
@@ -120,27 +121,15 @@ class FactorySourceChecker(ReviewBot.ReviewBot):
                 return True
 
         self.logger.debug("%s not the latest version, checking history", rev)
-        u = osc.core.makeurl(self.apiurl, [ 'source', project, package, '_history' ], { 'limit': self.history_limit })
         try:
-            r = osc.core.http_GET(u)
-        except urllib2.HTTPError, e:
+            found = self.provenance.lookup(project, package, rev)
+        except (urllib2.HTTPError, urllib2.URLError):
             self.logger.debug("package has no history!?")
             return None
 
-        root = ET.parse(r).getroot()
-        # we need this complicated construct as obs doesn't honor
-        # the 'limit' parameter use above for obs interconnect:
-        # https://github.com/openSUSE/open-build-service/issues/2545
-        for revision, i in zip(reversed(root.findall('revision')), count()):
-            node = revision.find('srcmd5')
-            if node is None:
-                continue
-            self.logger.debug("checking %s"%node.text)
-            if node.text == rev:
-                self.logger.debug("got it, rev %s"%revision.get('rev'))
-                return True
-            if i == self.history_limit:
-                break
+        if found:
+            self.logger.debug("got it, rev %s"%found[1])
+            return True
 
         self.logger.debug("srcmd5 not found in history either")
         return False
@@ -227,7 +216,8 @@ class CommandLineInterface(ReviewBot.CommandLineInterface):
         if self.options.lookup:
             bot.parse_lookup(self.options.lookup)
         if self.options.limit:
-            bot.history_limit = self.options.limit
+            bot.history_limit = int(self.options.limit)
+            bot.provenance.history_limit = bot.history_limit
 
         return bot
 
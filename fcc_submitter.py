@@ -32,7 +32,11 @@ import osc.conf
 import osc.core
 
 from osc import oscerr
+from osclib.devel_projects import DevelProjects
 from osclib.memoize import memoize
+from osclib.sourceinfo import SourceInfoFetcher
+from osclib.sourceinfo import source_packages
+from osclib.xmlstream import iterchildren
 
 OPENSUSE = 'openSUSE:Leap:42.3'
 OPENSUSE_PREVERSION = 'openSUSE:Leap:42.2'
@@ -43,6 +47,13 @@ http_GET = osc.core.http_GET
 http_POST = osc.core.http_POST
 http_PUT = osc.core.http_PUT
 
+def compile_patterns(patterns):
+    """Combine regular expressions into one that matches where any of
+    them does, or None when there are none."""
+    if not patterns:
+        return None
+    return re.compile('|'.join('(?:{})'.format(p) for p in patterns))
+
 class FccFreezer(object):
     def __init__(self):
         self.factory = 'openSUSE:Factory'
@@ -139,40 +150,32 @@ class FccSubmitter(object):
         self.submit_limit = int(submit_limit)
         self.apiurl = osc.conf.config['apiurl']
         self.debug = osc.conf.config['debug']
-        self.sle_base_prjs = [
-                'SUSE:SLE-12-SP2:Update',
-                'SUSE:SLE-12-SP2:GA',
-                'SUSE:SLE-12-SP1:Update',
-                'SUSE:SLE-12-SP1:GA',
-                'SUSE:SLE-12:Update',
-                'SUSE:SLE-12:GA',
-                ]
         # the skip list against devel project
         self.skip_devel_project_list = [
                 'mobile:synchronization:FACTORY'
                 ]
         # put the except packages from skip_devel_project_list, use regex in this list, eg. "^golang-x-(\w+)", "^nodejs$"
         self.except_pkgs_list = []
+        self.sourceinfo = SourceInfoFetcher(self.apiurl)
+        self.devel_projects = DevelProjects(self.apiurl)
 
     def get_source_packages(self, project, expand=False):
         """Return the list of packages in a project."""
-        query = {'expand': 1} if expand else {}
-        root = ET.parse(http_GET(makeurl(self.apiurl,['source', project],
-                                 query=query))).getroot()
-        packages = [i.get('name') for i in root.findall('entry')]
-        
+        return source_packages(self.apiurl, project, expand)
+
+    def get_requested_packages(self):
+        """Return the packages of `to_prj` in new or review requests,
+        as target or source, with a single search."""
+        xpath = "(state/@name='new' or state/@name='review') and " \
+                "(action/target/@project='{0}' or action/source/@project='{0}')".format(self.to_prj)
+        url = makeurl(self.apiurl, ['search', 'request'], {'match': xpath})
+        packages = set()
+        for request in iterchildren(http_GET(url), 'request'):
+            for node in request.findall('action/target') + request.findall('action/source'):
+                if node.get('project') == self.to_prj:
+                    packages.add(node.get('package'))
         return packages
 
-    def get_request_list(self, package):
-        return osc.core.get_request_list(self.apiurl, self.to_prj, package, req_state=('new', 'review'))
-
-    def get_link(self, project, package):
-        try:
-            link = http_GET(makeurl(self.apiurl,['source', project, package, '_link'])).read()
-        except (urllib2.HTTPError, urllib2.URLError):
-            return None
-        return ET.fromstring(link)
-
     def get_build_succeeded_packages(self, project):
         """Get the build succeeded packages from `from_prj` project.
         """
@@ -192,22 +195,6 @@ class FccSubmitter(object):
 
         return pacs
 
-    def is_new_package(self, tgt_project, tgt_package):
-        try:
-            logging.debug("Gathering package_meta %s/%s" % (tgt_project, tgt_package))
-            osc.core.show_package_meta(self.apiurl, tgt_project, tgt_package)
-        except (urllib2.HTTPError, urllib2.URLError):
-            return True
-        return False
-
-    def get_devel_project(self, package):
-        m = osc.core.show_package_meta(self.apiurl, self.factory, package)
-        node = ET.fromstring(''.join(m)).find('devel')
-        if node is None:
-            return None, None
-        else:
-            return node.get('project'), node.get('package', None)
-
     def add_review(self, requestid, by_project=None, by_package=None, msg=None):
         query = {}
         query['by_project'] = by_project
@@ -237,28 +224,6 @@ class FccSubmitter(object):
                                              message=msg)
         return res
 
-    def check_multiple_specfiles(self, project, package):
-        try:
-            url = makeurl(self.apiurl, ['source', project, package], { 'expand': '1' } )
-        except urllib2.HTTPError, e:
-            if e.code == 404:
-                return None
-            raise e
-        root = ET.fromstring(http_GET(url).read())
-        linkinfo = root.find('linkinfo')
-        files = [ entry.get('name').replace('.spec', '') for entry in root.findall('entry') if entry.get('name').endswith('.spec') ]
-        if linkinfo is not None and len(files) > 1:
-            return linkinfo.attrib['package']
-        else:
-            return False
-
-    def is_sle_base_pkgs(self, package):
-        link = self.get_link(self.to_prj, package)
-        if link is None or link.get('project') not in self.sle_base_prjs:
-            logging.debug("%s not from SLE base"%package)
-            return False
-        return True
-
     def list_pkgs(self):
         """List build succeeded packages"""
         succeeded_packages = []
@@ -296,99 +261,102 @@ class FccSubmitter(object):
         except urllib2.HTTPError:
             return ''
 
-    def crawl(self):
-        """Main method"""
-        succeeded_packages = []
-        succeeded_packages = self.get_build_succeeded_packages(self.from_prj)
-        if not len(succeeded_packages) > 0:
-            logging.info('No build succeeded package in %s'%self.from_prj)
-            return
-
-        # randomize the list
-        random.shuffle(succeeded_packages)
-        # get souce packages from target
-        target_packages = self.get_source_packages(self.to_prj)
-        deleted_packages = self.get_deleted_packages(self.to_prj)
-
-        skip_pkgs_list = self.load_skip_pkgs_list('openSUSE:Factory:Staging', 'dashboard').splitlines()
+    def prefilter(self, packages):
+        """Select the packages to submit.
 
-        ms_packages = [] # collect multi specs packages
+        The checks are done for all the packages at once with a few bulk
+        queries (package lists, view=info of the packages in Factory, one
+        request search and the devel projects) instead of
+        several requests per package.  Return the packages to submit and
+        the ones with multiple spec files.
 
-        for i in range(0, min(int(self.submit_limit), len(succeeded_packages))):
-            package = succeeded_packages[i]
+        """
+        # the expanded list has everything show_package_meta would find
+        target_packages = set(self.get_source_packages(self.to_prj, expand=True))
+        deleted_packages = set(self.get_deleted_packages(self.to_prj))
 
+        new_packages = []
+        for package in packages:
             if package in deleted_packages:
                 logging.info('%s has been dropped from %s, ignore it!'%(package, self.to_prj))
-                continue
+            elif package in target_packages:
+                logging.info('%s is not a new package, do not submit.' % package)
+            else:
+                new_packages.append(package)
 
-            if self.is_sle_base_pkgs(package) is True:
-                logging.info('%s origin from SLE base, skip for now!'%package)
+        ms_packages = [] # collect multi specs packages
+        candidates = []
+        sources = self.sourceinfo.fetch(self.factory, new_packages)
+        for package in new_packages:
+            if package not in sources:
+                logging.info('%s does not exist in %s'%(package, 'openSUSE:Factory'))
                 continue
 
-            # make sure it is new package
-            new_pkg = self.is_new_package(self.to_prj, package)
-            if new_pkg is not True:
-                logging.info('%s is not a new package, do not submit.' % package)
+            sourceinfo = sources[package]
+            specs = [f for f in sourceinfo.filenames if f.endswith('.spec')]
+            if sourceinfo.linked and len(specs) > 1:
+                logging.info('%s in %s have multiple specs, it is linked to %s, skip it!'%(package, 'openSUSE:Factory', sourceinfo.linked[0][1]))
+                ms_packages.append(package)
                 continue
 
-            multi_specs = self.check_multiple_specfiles(self.factory, package)
-            if multi_specs is None:
-                logging.info('%s does not exist in %s'%(package, 'openSUSE:Factory'))
+            candidates.append(package)
+
+        if not candidates:
+            return [], ms_packages
+
+        requested = self.get_requested_packages()
+        devel_projects = {}
+        if self.skip_devel_project_list:
+            devel_projects = self.devel_projects.load(self.factory, candidates)
+        except_pkgs = compile_patterns(self.except_pkgs_list)
+        skip_pkgs = compile_patterns(self.load_skip_pkgs_list('openSUSE:Factory:Staging', 'dashboard').splitlines())
+
+        submit = []
+        for package in candidates:
+            # make sure there is no request against same package
+            if package in requested:
+                logging.debug("There is a request to %s / %s already, skip!"%(package, self.to_prj))
                 continue
 
-            if multi_specs:
-                logging.info('%s in %s have multiple specs, it is linked to %s, skip it!'%(package, 'openSUSE:Factory', multi_specs))
-                ms_packages.append(package)
+            # check devel project does not in the skip list, unless
+            # the package is in the except packages list
+            devel_prj = devel_projects.get(package)
+            if devel_prj in self.skip_devel_project_list:
+                if except_pkgs is None or except_pkgs.search(package) is None:
+                    logging.info('%s/%s is in the skip list, do not submit.' % (devel_prj, package))
+                    continue
+
+            # check package does not in the skip list
+            if skip_pkgs is not None and skip_pkgs.search(package) is not None:
+                logging.info('%s is in the skip list, do not submit.' % package)
                 continue
 
-            # make sure the package non-exist in target yet ie. expand=False
-            if package not in target_packages:
-                # make sure there is no request against same package
-                request = self.get_request_list(package)
-                if request:
-                    logging.debug("There is a request to %s / %s already, skip!"%(package, self.to_prj))
-                else:
-                    logging.info("%d - Preparing submit %s to %s"%(i, package, self.to_prj))
-                    # get devel project
-                    devel_prj, devel_pkg = self.get_devel_project(package)
-                    # check devel project does not in the skip list
-                    if devel_prj in self.skip_devel_project_list:
-                        # check the except packages list
-                        match = None
-                        for elem in self.except_pkgs_list:
-                            m = re.search(elem, package)
-                            if m is not None:
-                                match = True
-
-                        if match is not True:
-                            logging.info('%s/%s is in the skip list, do not submit.' % (devel_prj, package))
-                            continue
-                        else:
-                            pass
-
-                    # check package does not in the skip list
-                    match = None
-                    for elem in skip_pkgs_list:
-                        m = re.search(elem, package)
-                        if m is not None:
-                            match = True
-
-                    if match is True:
-                        logging.info('%s is in the skip list, do not submit.' % package)
-                        continue
-                    else:
-                        pass
-
-                    res = self.create_submitrequest(package)
-                    if res and res is not None:
-                        logging.info('Created request %s for %s' % (res, package))
-                        # add review by package
-                        #logging.info("Adding review by %s/%s"%(devel_prj, devel_pkg))
-                        #self.add_review(res, devel_prj, devel_pkg)
-                    else:
-                        logging.error('Error occurred when creating submit request')
+            submit.append(package)
+
+        return submit, ms_packages
+
+    def crawl(self):
+        """Main method"""
+        succeeded_packages = []
+        succeeded_packages = self.get_build_succeeded_packages(self.from_prj)
+        if not len(succeeded_packages) > 0:
+            logging.info('No build succeeded package in %s'%self.from_prj)
+            return
+
+        # randomize the list
+        random.shuffle(succeeded_packages)
+        submit, ms_packages = self.prefilter(succeeded_packages[:self.submit_limit])
+
+        for i, package in enumerate(submit):
+            logging.info("%d - Preparing submit %s to %s"%(i, package, self.to_prj))
+            res = self.create_submitrequest(package)
+            if res and res is not None:
+                logging.info('Created request %s for %s' % (res, package))
+                # add review by package
+                #logging.info("Adding review by %s/%s"%(devel_prj, devel_pkg))
+                #self.add_review(res, devel_prj, devel_pkg)
             else:
-                logging.debug('%s is exist in %s, skip!'%(package, self.to_prj))
+                logging.error('Error occurred when creating submit request')
 
         # dump multi specs packages
         print("Multi-specfile packages:")
@@ -40,6 +40,7 @@ import yaml
 import ReviewBot
 from check_maintenance_incidents import MaintenanceChecker
 from check_source_in_factory import FactorySourceChecker
+from osclib.sourceinfo import source_packages
 
 class Leaper(ReviewBot.ReviewBot):
 
@@ -66,6 +67,18 @@ class Leaper(ReviewBot.ReviewBot):
         # project => package list
         self.packages = {}
 
+    def clone(self, logger):
+        bot = ReviewBot.ReviewBot.clone(self, logger)
+        bot.maintbot = self.maintbot.clone(logger)
+        bot.factory = self.factory.clone(logger)
+        return bot
+
+    def result_cache_config(self):
+        return ReviewBot.ReviewBot.result_cache_config(self) + (
+            self.do_comments, self.must_approve_version_updates,
+            self.must_approve_maintenance_updates, self.check_source_group,
+            self.automatic_submission)
+
     def prepare_review(self):
         # update lookup information on every run
 
@@ -88,12 +101,7 @@ class Leaper(ReviewBot.ReviewBot):
 
     def get_source_packages(self, project, expand=False):
         """Return the list of packages in a project."""
-        query = {'expand': 1} if expand else {}
-        root = ET.parse(osc.core.http_GET(osc.core.makeurl(self.apiurl,['source', project],
-                                 query=query))).getroot()
-        packages = [i.get('name') for i in root.findall('entry')]
-
-        return packages
+        return source_packages(self.apiurl, project, expand)
 
     def is_package_in_project(self, project, package):
         if not project in self.packages:
@@ -23,7 +23,9 @@
 import argparse
 import itertools
 import logging
+from multiprocessing.pool import ThreadPool
 import sys
+import threading
 from xml.etree import cElementTree as ET
 
 import osc.conf
@@ -35,6 +37,8 @@ import yaml
 from collections import namedtuple
 
 from osclib.memoize import memoize
+from osclib.provenance import ProvenanceIndex
+from osclib.sourceinfo import source_packages
 
 logger = logging.getLogger()
 
@@ -52,10 +56,18 @@ class Manager42(object):
         'factory' : 'openSUSE:Factory',
         }
 
+    # lookup.yml is stored after this many changes or seconds
+    STORE_CHANGES = 50
+    STORE_INTERVAL = 600
+
     def __init__(self, caching = True, configfh = None):
         self.caching = caching
         self.apiurl = osc.conf.config['apiurl']
+        self.lock = threading.RLock()
+        self.api_calls = 0
+        self.last_store = time.time()
         self.config = self._load_config(configfh)
+        self.provenance = ProvenanceIndex(self.apiurl)
 
         self.parse_lookup(self.config.from_prj)
         self.fill_package_meta()
@@ -82,7 +94,8 @@ class Manager42(object):
         return sorted(packages)
 
     def parse_lookup(self, project):
-        self.lookup_changes = 0
+        with self.lock:
+            self.lookup_changes = 0
         self.lookup = {}
         try:
             self.lookup = yaml.safe_load(self._load_lookup_file(project))
@@ -98,13 +111,26 @@ class Manager42(object):
         return http_PUT(makeurl(self.apiurl,
                                 ['source', prj, '00Meta', 'lookup.yml']), data=data)
 
+    def set_lookup(self, package, value):
+        """Change the lookup of a package, None removes it."""
+        with self.lock:
+            if value is None:
+                del self.lookup[package]
+            else:
+                self.lookup[package] = value
+            self.lookup_changes += 1
+
     def store_lookup(self):
-        if self.lookup_changes == 0:
-            logger.info('no change to lookup.yml')
-            return
-        data = yaml.dump(self.lookup, default_flow_style=False, explicit_start=True)
+        # only a consistent snapshot of the lookup is uploaded, workers
+        # may go on changing it meanwhile
+        with self.lock:
+            if self.lookup_changes == 0:
+                logger.info('no change to lookup.yml')
+                return
+            data = yaml.dump(self.lookup, default_flow_style=False, explicit_start=True)
+            self.lookup_changes = 0
         self._put_lookup_file(self.config.from_prj, data)
-        self.lookup_changes = 0
+        self.last_store = time.time()
 
     @memoize()
     def _cached_GET(self, url):
@@ -116,6 +142,8 @@ class Manager42(object):
         return self.retried_GET(url).read()
 
     def retried_GET(self, url):
+        with self.lock:
+            self.api_calls += 1
         try:
             return http_GET(url)
         except urllib2.HTTPError, e:
@@ -127,18 +155,13 @@ class Manager42(object):
 
     def get_source_packages(self, project, expand=False):
         """Return the list of packages in a project."""
-        query = {'expand': 1} if expand else {}
         try:
-            root = ET.fromstring(
-                self.cached_GET(makeurl(self.apiurl,
-                                 ['source', project],
-                                 query=query)))
-            packages = [i.get('name') for i in root.findall('entry')]
-
+            packages = source_packages(self.apiurl, project, expand)
         except urllib2.HTTPError, e:
-            if e.code == 404:
-                logger.error("{}: {}".format(project, e))
-                packages = []
+            if e.code != 404:
+                raise
+            logger.error("{}: {}".format(project, e))
+            packages = []
 
         return packages
 
@@ -150,25 +173,54 @@ class Manager42(object):
                                 ['source', project, package], opts))
 
 
-    def crawl(self, given_packages = None):
-        """Main method of the class that runs the crawler."""
+    def _check_one_package_worker(self, package):
+        try:
+            self.check_one_package(package)
+        except urllib2.HTTPError, e:
+            return package, e
+        return package, None
+
+    def crawl(self, given_packages = None, jobs = 1):
+        """Main method of the class that runs the crawler.
+
+        With more than one job the packages are checked by a pool of
+        threads, while the lookup changes are only stored from here.
+
+        """
 
-        packages = given_packages or self.packages[self.config.from_prj]
+        packages = sorted(given_packages or self.packages[self.config.from_prj])
+        start = time.time()
+        calls = self.api_calls + self.provenance.requests
 
-        for package in sorted(packages):
-            try:
-                self.check_one_package(package)
-            except urllib2.HTTPError, e:
-                logger.error("Failed to check {}: {}".format(package, e))
-                pass
+        pool = None
+        if jobs > 1:
+            pool = ThreadPool(jobs)
+            results = pool.imap_unordered(self._check_one_package_worker, packages)
+        else:
+            results = itertools.imap(self._check_one_package_worker, packages)
 
-            # avoid loosing too much work
-            if self.lookup_changes > 50:
-                self.store_lookup()
+        try:
+            for package, e in results:
+                if e is not None:
+                    logger.error("Failed to check {}: {}".format(package, e))
+
+                # avoid loosing too much work
+                if self.lookup_changes > self.STORE_CHANGES or \
+                        (self.lookup_changes and time.time() - self.last_store > self.STORE_INTERVAL):
+                    self.store_lookup()
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
 
         if self.lookup_changes:
             self.store_lookup()
 
+        seconds = max(time.time() - start, 0.001)
+        calls = self.api_calls + self.provenance.requests - calls
+        logger.info('checked {} packages in {:.0f}s with {} jobs, {:.2f} packages/s, {:.1f} API calls per package'.format(
+            len(packages), seconds, jobs, len(packages) / seconds, calls / float(max(len(packages), 1))))
+
     def get_package_history(self, project, package, deleted = False):
         try:
             query = {}
@@ -181,31 +233,16 @@ class Manager42(object):
                 return None
             raise
 
-    def check_source_in_project(self, project, package, verifymd5, deleted=False):
+    def check_source_in_project(self, project, package, verifymd5):
         if project not in self.packages:
             self.packages[project] = self.get_source_packages(project)
 
-        if not deleted and not package in self.packages[project]:
+        if not package in self.packages[project]:
             return None, None
 
-        his = self.get_package_history(project, package, deleted)
-        if his is None:
-            return None, None
-
-        his = ET.fromstring(his)
-        historyrevs = dict()
-        revs = list()
-        for rev in his.findall('revision'):
-            historyrevs[rev.find('srcmd5').text] = rev.get('rev')
-            revs.append(rev.find('srcmd5').text)
-        revs.reverse()
-        for i in range(min(len(revs), 5)): # check last commits
-            srcmd5=revs.pop(0)
-            root = self.cached_GET(makeurl(self.apiurl,
-                                    ['source', project, package], { 'rev': srcmd5, 'view': 'info'}))
-            root = ET.fromstring(root)
-            if root.get('verifymd5') == verifymd5:
-                return srcmd5, historyrevs[srcmd5]
+        found = self.provenance.lookup(project, package, verifymd5)
+        if found:
+            return found
         return None, None
 
 
@@ -216,8 +253,7 @@ class Manager42(object):
         if not package in self.packages[self.config.from_prj]:
             logger.info("{} vanished".format(package))
             if self.lookup.get(package):
-                del self.lookup[package]
-                self.lookup_changes += 1
+                self.set_lookup(package, None)
             return
 
         root = ET.fromstring(self._get_source_package(self.config.from_prj, package, None))
@@ -226,8 +262,7 @@ class Manager42(object):
             lstring = 'subpackage of {}'.format(linked.get('package'))
             if lstring != lproject:
                 logger.warn("{} links to {} (was {})".format(package, linked.get('package'), lproject))
-                self.lookup[package] = lstring
-                self.lookup_changes += 1
+                self.set_lookup(package, lstring)
             else:
                 logger.debug("{} correctly marked as subpackage of {}".format(package, linked.get('package')))
             return
@@ -249,8 +284,7 @@ class Manager42(object):
                 lstring = 'Devel;{};{}'.format(develprj, develpkg)
                 if not package in self.lookup or lstring != self.lookup[package]:
                     logger.debug("{} from devel {}/{} (was {})".format(package, develprj, develpkg, lproject))
-                    self.lookup[package] = lstring
-                    self.lookup_changes += 1
+                    self.set_lookup(package, lstring)
                 else:
                     logger.debug("{} lookup from {}/{} is correct".format(package, develprj, develpkg))
                 return
@@ -277,8 +311,7 @@ class Manager42(object):
                         logger.info('{} is from {} but should come from {}'.format(package, project, lproject))
                     else:
                         logger.info('{} -> {} (was {})'.format(package, project, lproject))
-                        self.lookup[package] = project
-                        self.lookup_changes += 1
+                        self.set_lookup(package, project)
                 else:
                     logger.debug('{} still coming from {}'.format(package, project))
                 foundit = True
@@ -289,8 +322,7 @@ class Manager42(object):
                 logger.debug("{}: lookup is correctly marked as fork".format(package))
             else:
                 logger.info('{} is a fork (was {})'.format(package, lproject))
-                self.lookup[package] = 'FORK'
-                self.lookup_changes += 1
+                self.set_lookup(package, 'FORK')
 
     def get_link(self, project, package):
         try:
@@ -319,7 +351,7 @@ def main(args):
     given_packages = args.packages
     if not args.all and not given_packages:
         given_packages = uc.latest_packages()
-    uc.crawl(given_packages)
+    uc.crawl(given_packages, jobs=args.jobs)
 
 if __name__ == '__main__':
     description = 'maintain 00Meta/lookup.yml'
@@ -336,6 +368,8 @@ if __name__ == '__main__':
                         help='dry run, no POST, PUT, DELETE')
     parser.add_argument('--cache-requests', action='store_true', default=False,
                         help='cache GET requests. Not recommended for daily use.')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of packages checked in parallel')
     parser.add_argument("packages", nargs='*', help="packages to check")
 
     args = parser.parse_args()
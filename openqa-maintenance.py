@@ -25,7 +25,9 @@ from datetime import date
 import md5
 import json
 import logging
+from multiprocessing.pool import ThreadPool
 import requests
+import threading
 from simplejson import JSONDecodeError
 from collections import namedtuple
 from pprint import pformat
@@ -38,6 +40,8 @@ import osc.conf
 import osc.core
 
 from osclib.comments import CommentAPI
+from osclib.memoize import memoize
+from osclib.repomd import RepoMDWatcher
 
 import ReviewBot
 
@@ -564,10 +568,82 @@ PROJECT_OPENQA_SETTINGS = {
 }
 
 
+class OpenQAJobIndex(object):
+    """Jobs of openQA for one check_requests cycle.
+
+    The jobs are fetched once per (distri, version, flavor, arch) and
+    build, or per test for the latest jobs of a target, and shared by
+    all the requests. prefetch() fetches a list of queries concurrently,
+    a query is a tuple (kind, settings, value) where kind is 'build' or
+    'test'.
+    """
+
+    WORKERS = 4
+
+    def __init__(self, openqa):
+        self.openqa = openqa
+        # kind -> (distri, version, flavor, arch) -> BUILD or TEST -> jobs
+        self.index = {'build': {}, 'test': {}}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(settings):
+        return (settings['DISTRI'], settings['VERSION'], settings['FLAVOR'], settings['ARCH'])
+
+    def _lookup(self, kind, key, value):
+        with self.lock:
+            return self.index[kind].get(key, {}).get(value)
+
+    def _fetch(self, query):
+        kind, (distri, version, flavor, arch), value = query
+        params = {
+            'distri': distri,
+            'version': version,
+            'arch': arch,
+            'flavor': flavor,
+        }
+        if kind == 'build':
+            params.update({'build': value, 'scope': 'relevant'})
+        else:
+            params.update({'test': value, 'latest': '1'})
+        return self.openqa.openqa_request('GET', 'jobs', params)['jobs']
+
+    def prefetch(self, queries):
+        queries = set((kind, self.key(settings), value) for kind, settings, value in queries)
+        missing = sorted(q for q in queries if self._lookup(*q) is None)
+        if not missing:
+            return
+
+        pool = ThreadPool(min(self.WORKERS, len(missing)))
+        try:
+            results = pool.map(self._fetch, missing)
+        finally:
+            pool.close()
+            pool.join()
+
+        with self.lock:
+            for (kind, key, value), jobs in zip(missing, results):
+                self.index[kind].setdefault(key, {})[value] = jobs
+
+    def jobs(self, kind, settings, value):
+        self.prefetch([(kind, settings, value)])
+        return list(self._lookup(kind, self.key(settings), value))
+
+    def invalidate(self, settings):
+        """Forget the jobs of the settings, after new ones are posted."""
+        key = self.key(settings)
+        with self.lock:
+            self.index['build'].get(key, {}).pop(settings.get('BUILD'), None)
+            self.index['test'].pop(key, None)
+
+
 class OpenQABot(ReviewBot.ReviewBot):
     """ check ABI of library packages
     """
 
+    # Concurrent lookups of the failed steps
+    STEP_WORKERS = 8
+
     def __init__(self, *args, **kwargs):
         ReviewBot.ReviewBot.__init__(self, *args, **kwargs)
 
@@ -575,9 +651,21 @@ class OpenQABot(ReviewBot.ReviewBot):
         self.openqa = None
         self.commentapi = CommentAPI(self.apiurl)
         self.update_test_builds = dict()
+        self.job_index = None
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.STEP_WORKERS)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.repomd = RepoMDWatcher()
+        # primary checksums -> repo hash
+        self.repo_hashes = {}
 
     def gather_test_builds(self):
-        for prj, u in TARGET_REPO_SETTINGS[self.openqa.baseurl].items():
+        targets = TARGET_REPO_SETTINGS[self.openqa.baseurl]
+        self.job_index.prefetch(('test', u['settings'][0], u['test']) for u in targets.values())
+        for prj, u in targets.items():
             buildnr = 0
             for j in self.jobs_for_target(u):
                 buildnr = j['settings']['BUILD']
@@ -585,10 +673,17 @@ class OpenQABot(ReviewBot.ReviewBot):
 
     # reimplemention from baseclass
     def check_requests(self):
+        self.job_index = OpenQAJobIndex(self.openqa)
 
         # first calculate the latest build number for current jobs
         self.gather_test_builds()
 
+        # fetch the jobs of all the requests at once
+        queries = []
+        for req in self.requests:
+            queries += self.request_openqa_queries(req, incident=True, test_repo=True) or []
+        self.job_index.prefetch(queries)
+
         started = []
         all_done = True
         # then check progress on running incidents
@@ -672,6 +767,7 @@ class OpenQABot(ReviewBot.ReviewBot):
                 if not self.dryrun:
                     try:
                         ret = self.openqa.openqa_request('POST', 'isos', data=settings, retries=1)
+                        self.job_index.invalidate(settings)
                         self.logger.info(pformat(ret))
                     except JSONDecodeError, e:
                         self.logger.error(e)
@@ -683,28 +779,18 @@ class OpenQABot(ReviewBot.ReviewBot):
 
     # check a set of repos for their primary checksums
     def calculate_repo_hash(self, repos):
-        m = md5.new()
-        # if you want to force it, increase this number
-        m.update('b')
-        for url in repos:
-            url += '/repodata/repomd.xml'
-            root = ET.parse(osc.core.http_GET(url)).getroot()
-            cs = root.find('.//{http://linux.duke.edu/metadata/repo}data[@type="primary"]/{http://linux.duke.edu/metadata/repo}checksum')
-            m.update(cs.text)
-        return m.hexdigest()
+        checksums = tuple(self.repomd.checksums(repos))
+        if checksums not in self.repo_hashes:
+            m = md5.new()
+            # if you want to force it, increase this number
+            m.update('b')
+            for cs in checksums:
+                m.update(cs)
+            self.repo_hashes[checksums] = m.hexdigest()
+        return self.repo_hashes[checksums]
 
     def jobs_for_target(self, u):
-        s = u['settings'][0]
-        return self.openqa.openqa_request(
-            'GET', 'jobs',
-        {
-            'distri': s['DISTRI'],
-            'version': s['VERSION'],
-            'arch': s['ARCH'],
-            'flavor': s['FLAVOR'],
-            'test': u['test'],
-            'latest': '1',
-        })['jobs']
+        return self.job_index.jobs('test', u['settings'][0], u['test'])
 
     # we don't know the current BUILD and querying all jobs is too expensive
     # so we need to check for one known TEST first
@@ -747,12 +833,14 @@ class OpenQABot(ReviewBot.ReviewBot):
             s['BUILD'] = buildnr
             s['REPOHASH'] = repohash
             self.openqa.openqa_request('POST', 'isos', data=s, retries=1)
+            self.job_index.invalidate(s)
         self.update_test_builds[prj] = buildnr
 
     def check_source_submission(self, src_project, src_package, src_rev, dst_project, dst_package):
         ReviewBot.ReviewBot.check_source_submission(self, src_project, src_package, src_rev, dst_project, dst_package)
 
-    def request_get_openqa_jobs(self, req, incident=True, test_repo=False):
+    def request_openqa_queries(self, req, incident=True, test_repo=False):
+        """Return the OpenQAJobIndex queries for the jobs of a request."""
         ret = None
         types = set([a.type for a in req.actions])
         if 'maintenance_release' in types:
@@ -766,30 +854,22 @@ class OpenQABot(ReviewBot.ReviewBot):
                 if incident and prj in PROJECT_OPENQA_SETTINGS:
                     for u in PROJECT_OPENQA_SETTINGS[prj]:
                         s = u.settings(build, prj, [], req=req)
-                        ret += self.openqa.openqa_request(
-                            'GET', 'jobs',
-                            {
-                                'distri': s['DISTRI'],
-                                'version': s['VERSION'],
-                                'arch': s['ARCH'],
-                                'flavor': s['FLAVOR'],
-                                'build': s['BUILD'],
-                                'scope': 'relevant',
-                            })['jobs']
+                        ret.append(('build', s, s['BUILD']))
                 repo_settings = TARGET_REPO_SETTINGS.get(self.openqa.baseurl, {})
                 if test_repo and prj in repo_settings:
                     u = repo_settings[prj]
                     for s in u['settings']:
-                        ret += self.openqa.openqa_request(
-                            'GET', 'jobs',
-                            {
-                                'distri': s['DISTRI'],
-                                'version': s['VERSION'],
-                                'arch': s['ARCH'],
-                                'flavor': s['FLAVOR'],
-                                'build':  self.update_test_builds.get(prj, 'UNKNOWN'),
-                                'scope': 'relevant',
-                            })['jobs']
+                        ret.append(('build', s, self.update_test_builds.get(prj, 'UNKNOWN')))
+        return ret
+
+    def request_get_openqa_jobs(self, req, incident=True, test_repo=False):
+        queries = self.request_openqa_queries(req, incident, test_repo)
+        if queries is None:
+            return None
+        self.job_index.prefetch(queries)
+        ret = []
+        for kind, settings, value in queries:
+            ret += self.job_index.jobs(kind, settings, value)
         return ret
 
     def calculate_qa_status(self, jobs=None):
@@ -857,10 +937,44 @@ class OpenQABot(ReviewBot.ReviewBot):
     def emd(self, str):
         return str.replace('_', '\_')
 
-    def get_step_url(self, testurl, modulename):
+    # the steps of finished jobs never change
+    @memoize(ttl=60*60*24*30)
+    def _first_failed_step(self, testurl, modulename):
         failurl = testurl + '/modules/%s/fails' % modulename
-        fails = requests.get(failurl).json()
-        failed_step = fails.get('first_failed_step', 1)
+        r = self.session.get(failurl)
+        r.raise_for_status()
+        return r.json().get('first_failed_step', 1)
+
+    def first_failed_step(self, testurl, modulename):
+        # a failed lookup links to the first step and is not cached
+        try:
+            return self._first_failed_step(testurl, modulename)
+        except (requests.RequestException, ValueError), e:
+            self.logger.warning("failed step of %s in %s not found: %s", modulename, testurl, e)
+            return 1
+
+    def prefetch_failed_steps(self, jobs):
+        """Look up the failed steps of all the jobs concurrently."""
+        steps = set()
+        for job in jobs:
+            if job['result'] not in ['passed', 'failed', 'softfailed']:
+                continue
+            testurl = osc.core.makeurl(self.openqa.baseurl, ['tests', str(job['id'])])
+            for module in job['modules']:
+                if module['result'] == 'failed':
+                    steps.add((testurl, module['name']))
+        if not steps:
+            return
+
+        pool = ThreadPool(min(self.STEP_WORKERS, len(steps)))
+        try:
+            pool.map(lambda step: self.first_failed_step(*step), steps)
+        finally:
+            pool.close()
+            pool.join()
+
+    def get_step_url(self, testurl, modulename):
+        failed_step = self.first_failed_step(testurl, modulename)
         return "[%s](%s#step/%s/%d)" % (self.emd(modulename), testurl, modulename, failed_step)
 
     def job_test_name(self, job):
@@ -919,6 +1033,7 @@ class OpenQABot(ReviewBot.ReviewBot):
                 if self.calculate_qa_status(jobs) == QA_INPROGRESS:
                     self.logger.debug("incident tests for request %s are done, but need to wait for test repo", req.reqid)
                     return
+                self.prefetch_failed_steps(jobs)
                 groups = dict()
                 for job in jobs:
                     gl = "%s@%s" % (self.emd(job['group']), self.emd(job['settings']['FLAVOR']))
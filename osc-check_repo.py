@@ -464,6 +464,7 @@ def _print_request_and_specs(self, request_and_specs):
 @cmdln.option('-c', '--skipcycle', action='store_true', help='skip cycle check')
 @cmdln.option('-n', '--dry', action='store_true', help='dry run, don\'t change review state')
 @cmdln.option('-v', '--verbose', action='store_true', help='verbose output')
+@cmdln.option('-j', '--jobs', type='int', metavar='N', help='number of concurrent binary downloads')
 def do_check_repo(self, subcmd, opts, *args):
     """${cmd_name}: Checker review of submit requests.
 
@@ -487,7 +488,8 @@ def do_check_repo(self, subcmd, opts, *args):
     self.checkrepo = CheckRepo(self.get_api_url(),
                                'openSUSE:%s' % opts.project,
                                readonly=opts.dry,
-                               debug=opts.verbose)
+                               debug=opts.verbose,
+                               download_workers=opts.jobs)
 
     prjs_or_pkg = [arg for arg in args if not arg.isdigit()]
     ids = [arg for arg in args if arg.isdigit()]
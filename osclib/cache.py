@@ -1,22 +1,24 @@
 from __future__ import print_function
 
+import atexit
+from collections import OrderedDict
 import datetime
 import hashlib
+import json
 import os
 import osc.core
 import re
 import shutil
+import sqlite3
 import sys
+import urllib2
 import urlparse
 from StringIO import StringIO
 from osc import conf
 from osc.core import urlopen
 from time import time
 
-try:
-    from xml.etree import cElementTree as ET
-except ImportError:
-    import cElementTree as ET
+from osclib.xmlstream import latest_updated
 
 
 def http_request(method, url, headers={}, data=None, file=None):
@@ -28,6 +30,20 @@ def http_request(method, url, headers={}, data=None, file=None):
         ret = Cache.get(url)
         if ret:
             return ret
+
+        # Expired entries with validators are revalidated rather than fetched
+        # again in full. A 304 response refreshes the cached entry.
+        conditional = Cache.conditional_headers(url)
+        if conditional:
+            conditional.update(headers)
+            try:
+                ret = osc.core._http_request(method, url, conditional, data, file)
+            except urllib2.HTTPError as e:
+                if e.code != 304:
+                    raise
+                return Cache.revalidated(url)
+
+            return Cache.put(url, ret)
     else:
         # Logically, seems to make more sense after real call, but practically
         # it should not matter and makes the apitests happy when dealing with
@@ -93,12 +109,44 @@ class Cache(object):
 
     last_updated = {}
 
+    # Counters for responses served from the cache (hit), refreshed by a 304
+    # (revalidate) and downloaded (fetch). The bytes counters indicate the
+    # bandwidth saved by hits and revalidations respectively.
+    stats = {
+        'hit': 0,
+        'hit_bytes': 0,
+        'revalidate': 0,
+        'revalidate_bytes': 0,
+        'fetch': 0,
+        'fetch_bytes': 0,
+        'memory_hit': 0,
+    }
+
+    # Storage used for cached responses, see BACKENDS for the choices.
+    BACKEND = 'sqlite'
+    backend = None
+
+    # Upper bound in bytes for the in-process tier in front of the backend.
+    MEMORY_SIZE = 64 * 1024 * 1024
+    memory = None
+
     @staticmethod
-    def init():
+    def init(backend=None):
         Cache.patterns = []
         for pattern in Cache.PATTERNS:
             Cache.patterns.append(re.compile(pattern))
 
+        if backend:
+            Cache.BACKEND = backend
+        if Cache.backend:
+            Cache.backend.close()
+        Cache.backend = BACKENDS[Cache.BACKEND](Cache.CACHE_DIR)
+        Cache.memory = MemoryCache(Cache.MEMORY_SIZE)
+
+        if not hasattr(Cache, '_atexit'):
+            Cache._atexit = True
+            atexit.register(Cache.print_stats)
+
         # Replace http_request with wrapper function which needs a stored
         # version of the original function to call.
         if not hasattr(osc.core, '_http_request'):
@@ -109,7 +157,6 @@ class Cache(object):
     def get(url):
         match, project = Cache.match(url)
         if match:
-            path = Cache.path(url, project, include_file=True)
             ttl = Cache.PATTERNS[match]
 
             if project:
@@ -133,9 +180,9 @@ class Cache(object):
                 # Treat non-existant cache as brand new for the sake of history
                 # span check since it behaves as desired.
                 age = 0
-                directory = Cache.path(url, project)
-                if os.path.exists(directory):
-                    age = time() - os.path.getmtime(directory)
+                mtime = Cache.project_mtime(url, project)
+                if mtime is not None:
+                    age = time() - mtime
 
                 # If history span is shorter than allowed cache life and the age
                 # of the current cache is older than history span with no
@@ -149,11 +196,25 @@ class Cache(object):
                 if history_span < ttl_delta and age_delta > history_span:
                     Cache.delete_project(apiurl, project)
 
-            if os.path.exists(path) and time() - os.path.getmtime(path) <= ttl:
+            # Serve from memory when possible to avoid touching the backend.
+            entry = Cache.memory.get(url)
+            if entry and time() - entry[0] <= ttl:
+                if conf.config['debug']: print('CACHE_GET_MEMORY', url, file=sys.stderr)
+                Cache.stats['hit'] += 1
+                Cache.stats['hit_bytes'] += len(entry[1])
+                Cache.stats['memory_hit'] += 1
+                return StringIO(entry[1])
+
+            mtime = Cache.backend.mtime(url, project)
+            if mtime is not None and time() - mtime <= ttl:
                 if conf.config['debug']: print('CACHE_GET', url, file=sys.stderr)
-                return urlopen('file://' + path)
+                text = Cache.backend.open(url, project).read()
+                Cache.memory.put(url, project, mtime, text)
+                Cache.stats['hit'] += 1
+                Cache.stats['hit_bytes'] += len(text)
+                return StringIO(text)
             else:
-                reason = '(' + ('expired' if os.path.exists(path) else 'does not exist') + ')'
+                reason = '(' + ('expired' if mtime is not None else 'does not exist') + ')'
                 if conf.config['debug']: print('CACHE_MISS', url, reason, file=sys.stderr)
 
         return None
@@ -162,40 +223,117 @@ class Cache(object):
     def put(url, data):
         match, project = Cache.match(url)
         if match:
-            path = Cache.path(url, project, include_file=True, makedirs=True)
-
             # Since urlopen does not return a seekable stream it cannot be reset
             # after writing to cache. As such a wrapper must be used. This could
             # be replaced with urlopen('file://...') to be consistent, but until
             # the need arrises StringIO has less overhead.
+            validators = Cache.validators(data)
             text = data.read()
             data = StringIO(text)
 
             if conf.config['debug']: print('CACHE_PUT', url, project, file=sys.stderr)
-            f = open(path,'w')
-            f.write(text)
-            f.close()
+            Cache.backend.put(url, project, text, validators)
+            Cache.memory.put(url, project, time(), text)
+            Cache.memory.projects[MemoryCache.key(url, project)] = time()
+            Cache.stats['fetch'] += 1
+            Cache.stats['fetch_bytes'] += len(text)
 
         return data
 
     @staticmethod
-    def delete(url):
+    def conditional_headers(url):
+        """
+        Return headers for a conditional request of an expired entry or None if
+        the entry is not cached or the server provided no validators.
+        """
         match, project = Cache.match(url)
         if match:
-            path = Cache.path(url, project, include_file=True)
+            validators = Cache.backend.validators(url, project)
+            if validators:
+                headers = {}
+                if validators.get('etag'):
+                    headers['If-None-Match'] = validators['etag']
+                if validators.get('last-modified'):
+                    headers['If-Modified-Since'] = validators['last-modified']
+                return headers
+
+        return None
+
+    @staticmethod
+    def revalidated(url):
+        """
+        Refresh an entry confirmed unchanged by the server and return it.
+        """
+        _, project = Cache.match(url)
+        if conf.config['debug']: print('CACHE_REVALIDATE', url, file=sys.stderr)
+        Cache.backend.touch(url, project)
+        text = Cache.backend.open(url, project).read()
+        Cache.memory.put(url, project, time(), text)
+        Cache.stats['revalidate'] += 1
+        Cache.stats['revalidate_bytes'] += len(text)
+        return StringIO(text)
+
+    @staticmethod
+    def validators(response):
+        info = response.info() if hasattr(response, 'info') else None
+        if info is None:
+            return None
+
+        validators = {}
+        for header in ('etag', 'last-modified'):
+            value = info.getheader(header)
+            if value:
+                validators[header] = value
+
+        return validators or None
+
+    @staticmethod
+    def project_mtime(url, project):
+        """
+        Time of the last change to the cache of a project, remembered in memory
+        since the age only grows while the process is running.
+        """
+        key = MemoryCache.key(url, project)
+        if key not in Cache.memory.projects:
+            Cache.memory.projects[key] = Cache.backend.project_mtime(url, project)
+        return Cache.memory.projects[key]
+
+    @staticmethod
+    def print_stats():
+        if not conf.config.get('debug'):
+            return
+
+        stats = Cache.stats
+        requests = stats['hit'] + stats['revalidate'] + stats['fetch']
+        if not requests:
+            return
 
+        print('CACHE_STATS', 'hit: {} ({} memory), revalidate: {}, fetch: {}'.format(
+            stats['hit'], stats['memory_hit'], stats['revalidate'], stats['fetch']), file=sys.stderr)
+        print('CACHE_STATS', 'hit rate: {:.1%}, memory hit rate: {:.1%}'.format(
+            float(stats['hit']) / requests, float(stats['memory_hit']) / requests), file=sys.stderr)
+        print('CACHE_STATS', 'bytes saved: {}, fetched: {}, memory: {}/{}'.format(
+            stats['hit_bytes'] + stats['revalidate_bytes'], stats['fetch_bytes'],
+            Cache.memory.used, Cache.memory.size), file=sys.stderr)
+
+    @staticmethod
+    def delete(url):
+        match, project = Cache.match(url)
+        if match:
             # Rather then wait for last updated statistics to expire, remove the
             # project cache if applicable.
             if project:
                 apiurl, _ = Cache.spliturl(url)
+                tgt_project = project
                 if project.isdigit():
                     # Clear target project cache upon request acceptance.
-                    project = osc.core.get_request(apiurl, project).actions[0].tgt_project
-                Cache.delete_project(apiurl, project)
+                    tgt_project = osc.core.get_request(apiurl, project).actions[0].tgt_project
+                Cache.delete_project(apiurl, tgt_project)
 
-            if os.path.exists(path):
+            Cache.memory.delete(url)
+            if Cache.backend.delete(url, project):
                 if conf.config['debug']: print('CACHE_DELETE', url, file=sys.stderr)
-                os.remove(path)
+                Cache.memory.projects[MemoryCache.key(url, project)] = time()
 
         # Also delete version without query. This does not handle other
         # variations using different query strings. Handy for PUT with ?force=1.
@@ -206,14 +344,16 @@ class Cache(object):
 
     @staticmethod
     def delete_project(apiurl, project):
-        path = Cache.path(apiurl, project)
-
-        if os.path.exists(path):
+        Cache.memory.delete_project(apiurl, project)
+        if Cache.backend.delete_project(apiurl, project):
             if conf.config['debug']: print('CACHE_DELETE_PROJECT', apiurl, project, file=sys.stderr)
-            shutil.rmtree(path)
 
     @staticmethod
     def delete_all():
+        if Cache.backend:
+            Cache.backend.close()
+        if Cache.memory:
+            Cache.memory.clear()
         if os.path.exists(Cache.CACHE_DIR):
             shutil.rmtree(Cache.CACHE_DIR)
 
@@ -235,8 +375,97 @@ class Cache(object):
         return (apiurl, path)
 
     @staticmethod
-    def path(url, project, include_file=False, makedirs=False):
-        parts = [Cache.CACHE_DIR]
+    def last_updated_load(apiurl):
+        if apiurl in Cache.last_updated:
+            return
+
+        url = osc.core.makeurl(apiurl, ['statistics', 'latest_updated'], {'limit': 5000})
+        last_updated = {}
+        for project, updated in latest_updated(osc.core.http_GET(url)):
+            if project not in last_updated:
+                last_updated[project] = updated
+
+        # Keep track of the last entry to indicate the covered timespan.
+        last_updated['__oldest'] = updated
+        Cache.last_updated[apiurl] = last_updated
+
+
+class MemoryCache(object):
+    """
+    Bounded in-process LRU of cached responses keyed by url.
+
+    Entries keep the mtime of the backend entry so ttl handling is identical
+    to reading from the backend. The size is the sum of the response lengths.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.used = 0
+        self.entries = OrderedDict()
+        self.urls = {}
+        self.projects = {}
+
+    @staticmethod
+    def key(url, project):
+        return (urlparse.urlsplit(url).hostname, project or '')
+
+    def get(self, url):
+        entry = self.entries.pop(url, None)
+        if entry is None:
+            return None
+
+        # Re-insert to mark as most recently used.
+        self.entries[url] = entry
+        return entry[1:]
+
+    def put(self, url, project, mtime, text):
+        self.delete(url)
+        if len(text) > self.size:
+            return
+
+        key = self.key(url, project)
+        self.entries[url] = (key, mtime, text)
+        self.urls.setdefault(key, set()).add(url)
+        self.used += len(text)
+
+        while self.used > self.size:
+            self.delete(next(iter(self.entries)))
+
+    def delete(self, url):
+        entry = self.entries.pop(url, None)
+        if entry:
+            key, _, text = entry
+            self.urls[key].discard(url)
+            self.used -= len(text)
+
+    def delete_project(self, apiurl, project):
+        key = self.key(apiurl, project)
+        for url in self.urls.pop(key, set()):
+            _, _, text = self.entries.pop(url)
+            self.used -= len(text)
+        self.projects[key] = None
+
+    def clear(self):
+        self.entries.clear()
+        self.urls.clear()
+        self.projects.clear()
+        self.used = 0
+
+
+class DirectoryBackend(object):
+    """
+    Store each response as a file named by the sha1 of the url.
+
+    Files live in a directory per host and project so that all caches related
+    to a project can be expired by removing the directory. The directory mtime
+    indicates the age of the project cache.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, url, project, include_file=False, makedirs=False):
+        parts = [self.root]
 
         o = urlparse.urlsplit(url)
         parts.append(o.hostname)
@@ -254,20 +483,177 @@ class Cache(object):
 
         return directory
 
+    def mtime(self, url, project):
+        path = self.path(url, project, include_file=True)
+        if os.path.exists(path):
+            return os.path.getmtime(path)
+        return None
+
+    def open(self, url, project):
+        return urlopen('file://' + self.path(url, project, include_file=True))
+
+    def validators(self, url, project):
+        path = self.path(url, project, include_file=True) + '.validators'
+        if os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)
+        return None
+
+    def put(self, url, project, text, validators=None):
+        path = self.path(url, project, include_file=True, makedirs=True)
+        with open(path, 'w') as f:
+            f.write(text)
+
+        if validators:
+            with open(path + '.validators', 'w') as f:
+                json.dump(validators, f)
+        elif os.path.exists(path + '.validators'):
+            os.remove(path + '.validators')
+
+    def touch(self, url, project):
+        os.utime(self.path(url, project, include_file=True), None)
+
+    def delete(self, url, project):
+        path = self.path(url, project, include_file=True)
+        if os.path.exists(path + '.validators'):
+            os.remove(path + '.validators')
+        if os.path.exists(path):
+            os.remove(path)
+            return True
+        return False
+
+    def project_mtime(self, url, project):
+        directory = self.path(url, project)
+        if os.path.exists(directory):
+            return os.path.getmtime(directory)
+        return None
+
+    def delete_project(self, apiurl, project):
+        path = self.path(apiurl, project)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+            return True
+        return False
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend(object):
+    """
+    Store all responses in a single SQLite database in WAL mode.
+
+    Entries are indexed by host and project so expiring a project is a single
+    indexed delete instead of a directory walk. The project table keeps the
+    time of the last change to each project cache, mirroring the directory
+    mtime used by DirectoryBackend.
+    """
+
+    FILENAME = 'cache.db'
+    # Bump when the schema changes to discard databases from older versions.
+    SCHEMA_VERSION = 2
+
+    def __init__(self, root):
+        self.root = root
+        self._db = None
+
+    @property
+    def db(self):
+        if self._db is None:
+            if not os.path.exists(self.root):
+                os.makedirs(self.root)
+            self._db = sqlite3.connect(os.path.join(self.root, self.FILENAME), timeout=60)
+            self._db.text_factory = str
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            version = self._db.execute('PRAGMA user_version').fetchone()[0]
+            if version != self.SCHEMA_VERSION:
+                self._db.executescript("""
+                    DROP TABLE IF EXISTS entry;
+                    DROP TABLE IF EXISTS project;
+                    PRAGMA user_version = {};
+                """.format(self.SCHEMA_VERSION))
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS entry (
+                    url TEXT PRIMARY KEY,
+                    host TEXT NOT NULL,
+                    project TEXT NOT NULL,
+                    mtime REAL NOT NULL,
+                    etag TEXT,
+                    modified TEXT,
+                    data BLOB NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS entry_project ON entry (host, project);
+                CREATE TABLE IF NOT EXISTS project (
+                    host TEXT NOT NULL,
+                    project TEXT NOT NULL,
+                    mtime REAL NOT NULL,
+                    PRIMARY KEY (host, project)
+                );
+            """)
+        return self._db
+
     @staticmethod
-    def last_updated_load(apiurl):
-        if apiurl in Cache.last_updated:
-            return
+    def key(url, project):
+        return (urlparse.urlsplit(url).hostname, project or '')
 
-        url = osc.core.makeurl(apiurl, ['statistics', 'latest_updated'], {'limit': 5000})
-        root = ET.parse(osc.core.http_GET(url)).getroot()
-        last_updated = {}
-        for entity in root:
-            # Entities repesent either a project or package.
-            key = 'name' if entity.tag == 'project' else 'project'
-            if entity.attrib[key] not in last_updated:
-                last_updated[entity.attrib[key]] = entity.attrib['updated']
+    def mtime(self, url, project):
+        row = self.db.execute('SELECT mtime FROM entry WHERE url = ?', (url,)).fetchone()
+        return row[0] if row else None
 
-        # Keep track of the last entry to indicate the covered timespan.
-        last_updated['__oldest'] = entity.attrib['updated']
-        Cache.last_updated[apiurl] = last_updated
+    def open(self, url, project):
+        row = self.db.execute('SELECT data FROM entry WHERE url = ?', (url,)).fetchone()
+        return StringIO(str(row[0]))
+
+    def validators(self, url, project):
+        row = self.db.execute('SELECT etag, modified FROM entry WHERE url = ?', (url,)).fetchone()
+        if row and (row[0] or row[1]):
+            return {'etag': row[0], 'last-modified': row[1]}
+        return None
+
+    def put(self, url, project, text, validators=None):
+        host, project = self.key(url, project)
+        validators = validators or {}
+        now = time()
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO entry VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            (url, host, project, now, validators.get('etag'),
+                             validators.get('last-modified'), sqlite3.Binary(text)))
+            self.db.execute('INSERT OR REPLACE INTO project VALUES (?, ?, ?)',
+                            (host, project, now))
+
+    def touch(self, url, project):
+        with self.db:
+            self.db.execute('UPDATE entry SET mtime = ? WHERE url = ?', (time(), url))
+
+    def delete(self, url, project):
+        host, project = self.key(url, project)
+        with self.db:
+            if not self.db.execute('DELETE FROM entry WHERE url = ?', (url,)).rowcount:
+                return False
+            self.db.execute('UPDATE project SET mtime = ? WHERE host = ? AND project = ?',
+                            (time(), host, project))
+        return True
+
+    def project_mtime(self, url, project):
+        row = self.db.execute('SELECT mtime FROM project WHERE host = ? AND project = ?',
+                              self.key(url, project)).fetchone()
+        return row[0] if row else None
+
+    def delete_project(self, apiurl, project):
+        key = self.key(apiurl, project)
+        with self.db:
+            self.db.execute('DELETE FROM entry WHERE host = ? AND project = ?', key)
+            return self.db.execute('DELETE FROM project WHERE host = ? AND project = ?',
+                                   key).rowcount > 0
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+BACKENDS = {
+    'directory': DirectoryBackend,
+    'sqlite': SQLiteBackend,
+}
@@ -16,20 +16,20 @@
 
 import os
 import re
-import subprocess
 from urllib import quote_plus
 import urllib2
 from xml.etree import cElementTree as ET
 from pprint import pformat
 
-from osc.core import get_binary_file
 from osc.core import http_DELETE
 from osc.core import http_GET
 from osc.core import http_POST
 from osc.core import makeurl
 from osclib.stagingapi import StagingAPI
+from osclib.download import BinaryDownloader
 from osclib.memoize import memoize
 from osclib.pkgcache import PkgCache
+from osclib.rpmheader import RPMHeaderReader
 
 
 # Directory where download binary packages.
@@ -138,13 +138,16 @@ class Request(object):
 
 class CheckRepo(object):
 
-    def __init__(self, apiurl, project, readonly=False, force_clean=False, debug=False):
+    def __init__(self, apiurl, project, readonly=False, force_clean=False, debug=False,
+                 download_workers=None):
         """CheckRepo constructor."""
         self.apiurl = apiurl
         self.project = project
         self.staging = StagingAPI(apiurl, self.project)
 
         self.pkgcache = PkgCache(BINCACHE, force_clean=force_clean)
+        self.downloader = BinaryDownloader(apiurl, self.pkgcache, workers=download_workers)
+        self.rpmheader = RPMHeaderReader(self.pkgcache)
 
         # grouped = { id: staging, }
         self.grouped = {}
@@ -601,22 +604,6 @@ class CheckRepo(object):
             return False
         return True
 
-    def _get_binary_file(self, project, repository, arch, package, filename, target, mtime):
-        """Get a binary file from OBS."""
-        # Check if the file is already there.
-        key = (project, repository, arch, package, filename, mtime)
-        if key in self.pkgcache:
-            try:
-                os.unlink(target)
-            except:
-                pass
-            self.pkgcache.linkto(key, target)
-        else:
-            get_binary_file(self.apiurl, project, repository, arch,
-                            filename, package=package,
-                            target_filename=target)
-            self.pkgcache[key] = target
-
     def _download(self, request, todownload):
         """Download the packages referenced in the 'todownload' list."""
         last_disturl = None
@@ -628,48 +615,40 @@ class CheckRepo(object):
         todownload_rpm = [rpm for rpm in todownload if rpm[3].endswith('.rpm')]
         todownload_rest = [rpm for rpm in todownload if not rpm[3].endswith('.rpm')]
 
-        for _project, _repo, arch, fn, mt in todownload_rpm:
-            repodir = os.path.join(DOWNLOADS, request.src_package, _project, _repo)
-            if not os.path.exists(repodir):
-                os.makedirs(repodir)
-            t = os.path.join(repodir, fn)
-            self._get_binary_file(_project, _repo, arch, request.src_package, fn, t, mt)
-
-            # Organize the files into DISTURL directories.
-            disturl = self._md5_disturl(self._disturl(t))
-            disturldir = os.path.join(repodir, disturl)
-            last_disturl, last_disturldir = disturl, disturldir
-            file_in_disturl = os.path.join(disturldir, fn)
-            if not os.path.exists(disturldir):
-                os.makedirs(disturldir)
-            try:
-                os.symlink(t, file_in_disturl)
-            except:
-                pass
-                # print 'Found previous link.'
-
-            request.downloads[(_project, _repo, disturl)].append(file_in_disturl)
-
         # Some subpackage do not have any rpm (e.g. rpmlint)
-        if not last_disturldir:
+        if not todownload_rpm:
             return
 
-        for _project, _repo, arch, fn, mt in todownload_rest:
+        files = []
+        for _project, _repo, arch, fn, mt in todownload_rpm + todownload_rest:
             repodir = os.path.join(DOWNLOADS, request.src_package, _project, _repo)
             if not os.path.exists(repodir):
                 os.makedirs(repodir)
             t = os.path.join(repodir, fn)
-            self._get_binary_file(_project, _repo, arch, request.src_package, fn, t, mt)
+            files.append((_project, _repo, arch, request.src_package, fn, t, mt))
+
+        # The DISTURL is read while the remaining files are downloaded.
+        def _process(t, key):
+            return self._md5_disturl(self._disturl(t, key)) if t.endswith('.rpm') else None
+
+        disturls = self.downloader.download(files, process=_process)
+        self.debug('DOWNLOAD', request.src_package, self.downloader.format_stats())
+
+        for (_project, _repo, arch, _, fn, t, mt), disturl in zip(files, disturls):
+            repodir = os.path.dirname(t)
+            if fn.endswith('.rpm'):
+                # Organize the files into DISTURL directories.
+                disturldir = os.path.join(repodir, disturl)
+                last_disturl, last_disturldir = disturl, disturldir
+                if not os.path.exists(disturldir):
+                    os.makedirs(disturldir)
 
             file_in_disturl = os.path.join(last_disturldir, fn)
-            if last_disturldir:
-                try:
-                    os.symlink(t, file_in_disturl)
-                except:
-                    pass
-                    # print 'Found previous link.'
-            else:
-                print "I don't know where to put", fn
+            try:
+                os.symlink(t, file_in_disturl)
+            except:
+                pass
+                # print 'Found previous link.'
 
             request.downloads[(_project, _repo, last_disturl)].append(file_in_disturl)
 
@@ -688,14 +667,9 @@ class CheckRepo(object):
                 toignore.add(fn[1])
         return toignore
 
-    def _disturl(self, filename):
+    def _disturl(self, filename, key=None):
         """Get the DISTURL from a RPM file."""
-        pid = subprocess.Popen(
-            ('rpm', '--nosignature', '--queryformat', '%{DISTURL}', '-qp', filename),
-            stdout=subprocess.PIPE, close_fds=True)
-        os.waitpid(pid.pid, 0)[1]
-        disturl = pid.stdout.readlines()[0]
-        return disturl
+        return self.rpmheader.disturl(filename, key)
 
     def _md5_disturl(self, disturl):
         """Get the md5 from the DISTURL from a RPM file."""
@@ -718,8 +692,13 @@ class CheckRepo(object):
             print 'ERROR in URL %s [%s]' % (url, e)
         return verifymd5
 
-    def check_disturl(self, request, filename=None, md5_disturl=None):
-        """Try to match the srcmd5 of a request with the one in the RPM package."""
+    def check_disturl(self, request, filename=None, md5_disturl=None, key=None):
+        """Try to match the srcmd5 of a request with the one in the RPM package.
+
+        key is the PkgCache key of the file, to read the DISTURL from the
+        tags stored with the cached file.
+
+        """
         if not filename and not md5_disturl:
             raise ValueError('Please, procide filename or md5_disturl')
 
@@ -728,7 +707,7 @@ class CheckRepo(object):
         if request.src_package == 'glibc.i686':
             return True
 
-        md5_disturl = md5_disturl if md5_disturl else self._md5_disturl(self._disturl(filename))
+        md5_disturl = md5_disturl if md5_disturl else self._md5_disturl(self._disturl(filename, key))
         vrev_local = self._get_verifymd5(request, md5_disturl)
 
         # md5_disturl == request.srcmd5 is true for packages in the devel project.
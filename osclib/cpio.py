@@ -21,66 +21,149 @@
 
 import struct
 
-class Cpio(object):
-    def __init__(self, buf):
-        self.buf = buf
-        self.off = 0
 
-    def __iter__(self):
-        return self
+class CpioError(Exception):
+    """Raised for archives that can not be read."""
 
-    def next(self):
-        f = CpioFile(self.off, self.buf)
-        if f.fin():
-            raise StopIteration
-        self.off = self.off+f.length()
-        return f
 
 class CpioFile(object):
-    def __init__(self, off, buf):
-        self.off = off
-        self.buf = buf
-        
-        if off&3:
-            raise Exception("invalid offset %d"% off)
+    """An entry of a "newc" cpio archive.
 
-        fmt = "6s8s8s8s8s8s8s8s8s8s8s8s8s8s"
-        off = self.off + struct.calcsize(fmt)
+    The payload of an entry read from a buffer is a memoryview into that
+    buffer, so no data is copied.  Entries read from a stream must be
+    consumed, with read(), header() or copyto(), before the archive moves
+    to the next entry, the unread rest of the payload is skipped.
 
-        fields = struct.unpack(fmt, buf[self.off:off])
+    """
 
-	if fields[0] != "070701":
-		raise Exception("invalid cpio header %s"%self.c_magic)
+    FMT = '6s8s8s8s8s8s8s8s8s8s8s8s8s8s'
+    SIZE = struct.calcsize(FMT)
+    NAMES = ('c_ino', 'c_mode', 'c_uid', 'c_gid',
+             'c_nlink', 'c_mtime', 'c_filesize',
+             'c_devmajor', 'c_devminor', 'c_rdevmajor',
+             'c_rdevminor', 'c_namesize', 'c_check')
 
-        names = ("c_ino", "c_mode", "c_uid", "c_gid",
-                "c_nlink", "c_mtime", "c_filesize",
-                "c_devmajor", "c_devminor", "c_rdevmajor",
-                "c_rdevminor", "c_namesize", "c_check")
-        for (n, v) in zip(names, fields[1:]):
+    def __init__(self, off, fields, name, payloadstart, buf=None, stream=None):
+        self.off = off
+        for (n, v) in zip(self.NAMES, fields[1:]):
             setattr(self, n, int(v, 16))
-
-        nlen = self.c_namesize - 1
-        self.name = struct.unpack('%ds'%nlen, buf[off:off+nlen])[0]
-        off = off + nlen + 1
-        if off&3:
-            off = off + 4-(off&3) # padding
-        self.payloadstart = off
+        self.name = name
+        self.payloadstart = payloadstart
+        self.buf = buf
+        self.stream = stream
+        self.remaining = self.c_filesize
 
     def fin(self):
         return self.name == 'TRAILER!!!'
 
     def __str__(self):
-        return "[%s %d]"%(self.name, self.c_filesize)
+        return "[%s %d]" % (self.name, self.c_filesize)
+
+    def read(self, size=-1):
+        """Read up to size bytes of the payload, all of the rest if size
+        is negative."""
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        start = self.payloadstart + self.c_filesize - self.remaining
+        if self.buf is not None:
+            data = self.buf[start:start + size]
+        else:
+            data = self.stream.read(size)
+            if len(data) != size:
+                raise CpioError('truncated payload of %s' % self.name)
+        self.remaining -= size
+        return data
 
     def header(self):
-        return self.buf[self.payloadstart:self.payloadstart+self.c_filesize]
+        """Return the whole payload, a memoryview for buffer archives."""
+        if self.buf is not None:
+            return self.buf[self.payloadstart:self.payloadstart + self.c_filesize]
+        if self.remaining != self.c_filesize:
+            raise CpioError('payload of %s was already read' % self.name)
+        return self.read()
+
+    def copyto(self, fh, bufsize=65536):
+        """Write the rest of the payload to the file object fh."""
+        while self.remaining:
+            fh.write(self.read(bufsize))
 
     def length(self):
-        l = self.payloadstart-self.off + self.c_filesize
-        if self.c_filesize&3:
-            l = l + 4-(self.c_filesize&3)
+        l = self.payloadstart - self.off + self.c_filesize
+        if self.c_filesize & 3:
+            l = l + 4 - (self.c_filesize & 3)
         return l
 
+
+class Cpio(object):
+    """Iterate over the entries of a "newc" cpio archive.
+
+    The archive is either a buffer (a string, bytearray, mmap or
+    memoryview), or a file like object that is only read sequentially,
+    like a pipe or an HTTP response.  off is the offset of the first
+    entry, which allows to resume reading an archive at the offset of a
+    previous entry.
+
+    """
+
+    def __init__(self, source, off=0):
+        if hasattr(source, 'read'):
+            self.buf = None
+            self.stream = source
+        else:
+            self.buf = memoryview(source)
+            self.stream = None
+        self.off = off
+        self.current = None
+
+    def __iter__(self):
+        return self
+
+    def _read(self, size):
+        if self.buf is not None:
+            data = self.buf[self.off:self.off + size]
+        else:
+            data = self.stream.read(size)
+        if len(data) != size:
+            raise CpioError('truncated archive at offset %d' % self.off)
+        self.off += size
+        return data
+
+    def _skip(self):
+        f = self.current
+        if self.stream is not None:
+            while f.remaining:
+                f.read(65536)
+            self.off = f.payloadstart + f.c_filesize
+            self._read(f.off + f.length() - self.off)
+        else:
+            self.off = f.off + f.length()
+
+    def next(self):
+        if self.current is not None:
+            if self.current.fin():
+                raise StopIteration
+            self._skip()
+
+        if self.off & 3:
+            raise CpioError('invalid offset %d' % self.off)
+
+        off = self.off
+        fields = struct.unpack_from(CpioFile.FMT, self._read(CpioFile.SIZE))
+        if fields[0] != '070701':
+            raise CpioError('invalid cpio header at offset %d' % off)
+        namesize = int(fields[12], 16)
+        if namesize < 1:
+            raise CpioError('invalid name size at offset %d' % off)
+        # the name is followed by its NUL and padded to 4 bytes
+        padded = namesize + (4 - ((CpioFile.SIZE + namesize) & 3)) % 4
+        name = struct.unpack_from('%ds' % (namesize - 1), self._read(padded))[0]
+
+        self.current = CpioFile(off, fields, name, self.off, self.buf, self.stream)
+        if self.current.fin():
+            raise StopIteration
+        return self.current
+
+
 if __name__ == '__main__':
     from optparse import OptionParser
 
@@ -91,12 +174,10 @@ if __name__ == '__main__':
     (options, args) = parser.parse_args()
 
     for fn in args:
-        fh = open(fn, 'rb')
-        cpio = Cpio(fh.read())
-        for i in cpio:
-            print i
-            ofh = open(i.name, 'wb')
-            ofh.write(i.header())
-            ofh.close()
+        with open(fn, 'rb') as fh:
+            for i in Cpio(fh):
+                print i
+                with open(i.name, 'wb') as ofh:
+                    i.copyto(ofh)
 
 # vim: sw=4 et
@@ -14,14 +14,24 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+from array import array
 from copy import deepcopy
+import hashlib
+import os
+try:
+    import cPickle as pickle
+except:
+    import pickle
+from StringIO import StringIO
 import urllib2
-from xml.etree import cElementTree as ET
+from lxml import etree as ET
 
 from osc.core import http_GET
 from osc.core import makeurl
 
+from .memoize import CACHEDIR
 from .memoize import memoize
+from .xmlstream import iterchildren
 
 
 class Graph(dict):
@@ -30,14 +40,28 @@ class Graph(dict):
     def __init__(self):
         """Initialize an empty graph."""
         #  The nodes are stored in the Graph dict itself, but the
-        #  adjacent list is stored as an attribute.
-        self.adj = {}
+        #  adjacent lists are stored as attributes, using integer ids
+        #  for the vertices.  Edges can point to names that are not
+        #  nodes, so every name gets an id.
+        self.ids = {}
+        self.names = []
+        self.succ = []
+        self.pred = []
+        self.node = bytearray()
+
+    def _id(self, name):
+        if name not in self.ids:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+            self.succ.append(set())
+            self.pred.append(set())
+            self.node.append(0)
+        return self.ids[name]
 
     def add_node(self, name, value):
         """Add a node in the graph."""
         self[name] = value
-        if name not in self.adj:
-            self.adj[name] = set()
+        self.node[self._id(name)] = 1
 
     def add_nodes_from(self, nodes_and_values):
         """Add multiple nodes"""
@@ -46,9 +70,14 @@ class Graph(dict):
 
     def add_edge(self, u, v, directed=True):
         """Add the edge u -> v, an v -> u if not directed."""
-        self.adj[u].add(v)
+        if u not in self:
+            raise KeyError(u)
+        u, v = self._id(u), self._id(v)
+        self.succ[u].add(v)
+        self.pred[v].add(u)
         if not directed:
-            self.adj[v].add(u)
+            self.succ[v].add(u)
+            self.pred[u].add(v)
 
     def add_edges_from(self, edges, directed=True):
         """Add the edges from an iterator."""
@@ -57,15 +86,14 @@ class Graph(dict):
 
     def remove_edge(self, u, v, directed=True):
         """Remove the edge u -> v, an v -> u if not directed."""
-        try:
-            self.adj[u].remove(v)
-        except KeyError:
-            pass
+        if u not in self.ids or v not in self.ids:
+            return
+        u, v = self.ids[u], self.ids[v]
+        self.succ[u].discard(v)
+        self.pred[v].discard(u)
         if not directed:
-            try:
-                self.adj[v].remove(u)
-            except KeyError:
-                pass
+            self.succ[v].discard(u)
+            self.pred[u].discard(v)
 
     def remove_edges_from(self, edges, directed=True):
         """Remove the edges from an iterator."""
@@ -74,44 +102,73 @@ class Graph(dict):
 
     def edges(self, v):
         """Get the adjancent list for a vertex."""
-        return sorted(self.adj[v]) if v in self else ()
+        return sorted(self.names[w] for w in self.succ[self.ids[v]]) if v in self else ()
 
     def edges_to(self, v):
         """Get the all the vertex that point to v."""
-        return sorted(u for u in self.adj if v in self.adj[u])
+        return sorted(self.names[u] for u in self.pred[self.ids[v]]) if v in self.ids else []
 
-    def cycles(self):
-        """Detect cycles using Tarjan algorithm."""
-        index = [0]
+    def cycles(self, sources=None):
+        """Detect cycles using Tarjan algorithm.
+
+        If sources is given, only the cycles reachable from these
+        nodes are returned.
+
+        """
+        if sources is None:
+            sources = sorted(self)
+        roots = [self.ids[v] for v in sources if v in self]
+
+        succ, node = self.succ, self.node
+        index = [-1] * len(self.names)
+        lowlink = [0] * len(self.names)
+        on_path = bytearray(len(self.names))
         path = []
         cycles = []
+        counter = 0
+
+        for root in roots:
+            if index[root] != -1:
+                continue
+
+            index[root] = lowlink[root] = counter
+            counter += 1
+            path.append(root)
+            on_path[root] = 1
+            stack = [(root, iter(succ[root]))]
+            while stack:
+                v, successors = stack[-1]
+                for w in successors:
+                    if not node[w]:
+                        continue
+                    if index[w] == -1:
+                        # Visit the successor, and continue with the
+                        # remaining ones of v after it is done.
+                        index[w] = lowlink[w] = counter
+                        counter += 1
+                        path.append(w)
+                        on_path[w] = 1
+                        stack.append((w, iter(succ[w])))
+                        break
+                    elif on_path[w]:
+                        lowlink[v] = min(lowlink[v], index[w])
+                else:
+                    stack.pop()
+                    if stack:
+                        u = stack[-1][0]
+                        lowlink[u] = min(lowlink[u], lowlink[v])
+
+                    if index[v] == lowlink[v]:
+                        cycle = []
+                        while True:
+                            w = path.pop()
+                            on_path[w] = 0
+                            cycle.append(self.names[w])
+                            if w == v:
+                                break
+                        if len(cycle) > 1:
+                            cycles.append(frozenset(cycle))
 
-        v_index = {}
-        v_lowlink = {}
-
-        def scc(node, v):
-            v_index[v], v_lowlink[v] = index[0], index[0]
-            index[0] += 1
-            path.append(node)
-
-            for succ in self.adj.get(node, []):
-                w = self[succ]
-                if w not in v_index:
-                    scc(succ, w)
-                    v_lowlink[v] = min(v_lowlink[v], v_lowlink[w])
-                elif succ in path:
-                    v_lowlink[v] = min(v_lowlink[v], v_index[w])
-
-            if v_index[v] == v_lowlink[v]:
-                i = path.index(node)
-                path[:], cycle = path[:i], frozenset(path[i:])
-                if len(cycle) > 1:
-                    cycles.append(cycle)
-
-        for node in sorted(self):
-            v = self[node]
-            if not getattr(v, 'index', 0):
-                scc(node, v)
         return frozenset(cycles)
 
 
@@ -129,12 +186,12 @@ class Package(object):
 
     def load(self, element):
         """Load a node from a ElementTree package XML element"""
-        self.pkg = element.attrib['name']
+        self.pkg = intern(element.attrib['name'])
         self.src = [e.text for e in element.findall('source')]
         assert len(self.src) == 1, 'There are more that one source packages in the graph'
-        self.src = self.src[0]
-        self.deps = set(e.text for e in element.findall('pkgdep'))
-        self.subs = set(e.text for e in element.findall('subpkg'))
+        self.src = intern(self.src[0])
+        self.deps = set(intern(e.text) for e in element.findall('pkgdep'))
+        self.subs = set(intern(e.text) for e in element.findall('subpkg'))
 
     def __repr__(self):
         return 'PKG: %s\nSRC: %s\nDEPS: %s\n SUBS: %s' % (self.pkg,
@@ -143,9 +200,177 @@ class Package(object):
                                                           self.subs)
 
 
+class BuildDepIndex(object):
+    """Compact index of the _builddepinfo of a repository.
+
+    Package names are interned and numbered, and the resolved build
+    dependencies of every package are stored as an array of node ids.
+    When a new _builddepinfo is loaded only the packages whose XML
+    element changed, or that depend on a subpackage that moved to a
+    different package, are processed again.  The index is persisted
+    between runs with save() / load().
+
+    """
+
+    VERSION = 2
+
+    # Packages that are not part of the graph.  We need to ignore
+    # branding packages and preinstall images.
+    @staticmethod
+    def excluded(name):
+        return 'branding' in name or name.startswith('preinstallimage-')
+
+    def __init__(self):
+        # pickle does not keep class attributes, the format of a
+        # persisted index is in the instance
+        self.version = self.VERSION
+        self.digest = None
+        self.names = []         # Node id -> name
+        self.ids = {}           # Name -> node id
+        self.order = []         # Package names in the _builddepinfo order
+        self.packages = {}      # Name -> Package
+        self.digests = {}       # Name -> digest of the package element
+        self.subpkgs = {}       # Given a subpackage, recover the source package
+        self.rdeps = {}         # Dependency -> names of the packages that use it
+        self.adj = {}           # Node id -> array of node ids
+        self.missing = set()    # Packages with missing dependencies
+        self._graph = None
+        self._cycles = None
+
+    @staticmethod
+    def load(filename):
+        """Load a persisted index, or return an empty one."""
+        try:
+            with open(filename, 'rb') as f:
+                index = pickle.load(f)
+            if getattr(index, 'version', None) == BuildDepIndex.VERSION:
+                return index
+        except Exception:
+            pass
+        return BuildDepIndex()
+
+    def save(self, filename):
+        graph, cycles = self._graph, self._cycles
+        self._graph, self._cycles = None, None
+        tmpfile = filename + '.tmp'
+        with open(tmpfile, 'wb') as f:
+            pickle.dump(self, f, protocol=-1)
+        os.rename(tmpfile, filename)
+        self._graph, self._cycles = graph, cycles
+
+    def id(self, name):
+        """Return the node id for a name, numbering it if new."""
+        if name not in self.ids:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+        return self.ids[name]
+
+    def update(self, xml):
+        """Update the index from a _builddepinfo XML document.  Return
+        True if something changed.
+
+        """
+        digest = hashlib.md5(xml).hexdigest()
+        if digest == self.digest:
+            return False
+
+        changed = set()
+        order = []
+        for element in iterchildren(StringIO(xml), 'package'):
+            name = intern(element.attrib['name'])
+            order.append(name)
+            element_digest = hashlib.md5(ET.tostring(element, with_tail=False)).digest()
+            if self.digests.get(name) != element_digest:
+                if name in self.packages:
+                    self._unlink(self.packages[name])
+                package = Package(element=element)
+                self.packages[name] = package
+                self.digests[name] = element_digest
+                for dep in package.deps:
+                    self.rdeps.setdefault(dep, set()).add(name)
+                changed.add(name)
+
+        for name in set(self.packages) - set(order):
+            self._unlink(self.packages.pop(name))
+            del self.digests[name]
+            self.adj.pop(self.ids[name], None)
+            self.missing.discard(name)
+
+        # The first package providing a subpackage wins.
+        subpkgs = {}
+        for name in order:
+            if not self.excluded(name):
+                for subpkg in self.packages[name].subs:
+                    subpkgs.setdefault(subpkg, name)
+        moved = set(sp for sp in set(subpkgs) | set(self.subpkgs)
+                    if subpkgs.get(sp) != self.subpkgs.get(sp))
+        self.subpkgs = subpkgs
+
+        dirty = changed | set(p for sp in moved for p in self.rdeps.get(sp, ()))
+        for name in dirty:
+            if name in self.packages and not self.excluded(name):
+                self._resolve(self.packages[name])
+
+        self.order = order
+        self.digest = digest
+        self._graph, self._cycles = None, None
+        return True
+
+    def _unlink(self, package):
+        for dep in package.deps:
+            self.rdeps[dep].discard(package.pkg)
+
+    def _resolve(self, package):
+        """Calculate the adjacency of a package."""
+        _IGNORE_PREFIX = ('texlive-', 'master-boot-code')
+
+        node = self.id(package.pkg)
+        deps = [d for d in package.deps if 'branding' not in d]
+        missing = [d for d in deps if not d.startswith(_IGNORE_PREFIX) and d not in self.subpkgs]
+        if missing:
+            self.missing.add(package.pkg)
+            self.adj[node] = array('i')
+            return
+        self.missing.discard(package.pkg)
+
+        # XXX - Ugly Hack. Subpagackes for texlive are not correctly
+        # generated. If the dependency starts with texlive- prefix,
+        # assume that the correct source package is texlive.
+        self.adj[node] = array('i', sorted(set(
+            self.id(self.subpkgs[d] if not d.startswith('texlive-') else 'texlive')
+            for d in deps if not d.startswith('master-boot-code'))))
+
+    def graph(self):
+        """Return the Graph of the repository.  The graph is shared, so
+        copy it before doing any change.
+
+        """
+        if self._graph is None:
+            graph = Graph()
+            nodes = [name for name in self.order if not self.excluded(name)]
+            graph.add_nodes_from((name, self.packages[name]) for name in nodes)
+            for name in nodes:
+                graph.add_edges_from((name, self.names[v]) for v in self.adj[self.ids[name]])
+
+            # Store the subpkgs dict in the graph. It will be used later.
+            graph.subpkgs = dict(self.subpkgs)
+            self._graph = graph
+        return self._graph
+
+    def cycles(self):
+        """Return the cycles of the graph."""
+        if self._cycles is None:
+            self._cycles = self.graph().cycles()
+        return self._cycles
+
+
 class CycleDetector(object):
     """Class to detect cycles in Factory / 13.2."""
 
+    # Indexes shared by all the instances, so a run that checks many
+    # groups build every graph only once.
+    _indexes = {}
+
     def __init__(self, api):
         self.api = api
         # Store packages prevoiusly ignored. Don't pollute the screen.
@@ -162,71 +387,45 @@ class CycleDetector(object):
             print('ERROR in URL %s [%s]' % (url, e))
         return root
 
+    def _get_builddepinfo_index(self, project, repository, arch):
+        """Get the BuildDepIndex of a repository, updated with the last
+        _builddepinfo.
+
+        """
+        key = (self.api.apiurl, project, repository, arch)
+        filename = os.path.join(CACHEDIR, 'builddepinfo-%s.pickle' % hashlib.md5(repr(key)).hexdigest())
+        if key not in CycleDetector._indexes:
+            CycleDetector._indexes[key] = BuildDepIndex.load(filename)
+        index = CycleDetector._indexes[key]
+
+        xml = self._builddepinfo(project, repository, arch)
+        if xml and index.update(xml):
+            index.save(filename)
+        return index
+
     def _get_builddepinfo(self, project, repository, arch, package):
         """Get the builddep info for a single package"""
-        root = ET.fromstring(self._builddepinfo(project, repository, arch))
-        packages = [Package(element=e) for e in root.findall('package')]
-        package = [p for p in packages if p.pkg == package]
-        return package[0] if package else None
+        return self._get_builddepinfo_index(project, repository, arch).packages.get(package)
 
     def _get_builddepinfo_graph(self, project, repository, arch):
         """Generate the buildepinfo graph for a given architecture."""
 
-        _IGNORE_PREFIX = ('texlive-', 'master-boot-code')
-
         # Note, by default generate the graph for all Factory /
         # 13/2. If you only need the base packages you can use:
         #   project = 'Base:System'
         #   repository = 'openSUSE_Factory'
 
-        root = ET.fromstring(self._builddepinfo(project, repository, arch))
-        # Reset the subpackages dict here, so for every graph is a
-        # different object.
-        packages = [Package(element=e) for e in root.findall('package')]
-
-        # XXX - Ugly Exception. We need to ignore branding packages and
-        # packages that one of his dependencies do not exist. Also ignore
-        # preinstall images.
-        packages = [p for p in packages if not ('branding' in p.pkg or p.pkg.startswith('preinstallimage-'))]
-
-        graph = Graph()
-        graph.add_nodes_from((p.pkg, p) for p in packages)
-
-        subpkgs = {}    # Given a subpackage, recover the source package
-        for p in packages:
-            # Check for packages that provides the same subpackage
-            for subpkg in p.subs:
-                if subpkg in subpkgs:
-                    # print 'Subpackage duplication %s - %s (subpkg: %s)' % (p.pkg, subpkgs[subpkg], subpkg)
-                    pass
-                else:
-                    subpkgs[subpkg] = p.pkg
-
-        for p in packages:
-            # Calculate the missing deps
-            deps = [d for d in p.deps if 'branding' not in d]
-            missing = [d for d in deps if not d.startswith(_IGNORE_PREFIX) and d not in subpkgs]
-            if missing:
-                if p.pkg not in self._ignore_packages:
-                    # print 'Ignoring package. Missing dependencies %s -> (%s) %s...' % (p.pkg, len(missing), missing[:5])
-                    self._ignore_packages.add(p.pkg)
-                continue
-
-            # XXX - Ugly Hack. Subpagackes for texlive are not correctly
-            # generated. If the dependency starts with texlive- prefix,
-            # assume that the correct source package is texlive.
-            graph.add_edges_from((p.pkg, subpkgs[d] if not d.startswith('texlive-') else 'texlive')
-                                 for d in deps if not d.startswith('master-boot-code'))
-
-        # Store the subpkgs dict in the graph. It will be used later.
-        graph.subpkgs = subpkgs
-        return graph
+        index = self._get_builddepinfo_index(project, repository, arch)
+        # Packages that one of his dependencies do not exist are
+        # ignored.
+        self._ignore_packages.update(index.missing)
+        return index.graph()
 
     def _get_builddepinfo_cycles(self, package, repository, arch):
         """Generate the buildepinfo cycle list for a given architecture."""
-        root = ET.fromstring(self._builddepinfo(package, repository, arch))
+        xml = StringIO(self._builddepinfo(package, repository, arch))
         return frozenset(frozenset(e.text for e in cycle.findall('package'))
-                         for cycle in root.findall('cycle'))
+                         for cycle in iterchildren(xml, 'cycle'))
 
     def cycles(self, requests, project=None, repository='standard', arch='x86_64'):
         """Detect cycles in a specific repository."""
@@ -239,7 +438,7 @@ class CycleDetector(object):
 
         # Detect cycles - We create the full graph from _builddepinfo.
         project_graph = self._get_builddepinfo_graph(project, repository, arch)
-        project_cycles = project_graph.cycles()
+        project_cycles = self._get_builddepinfo_index(project, repository, arch).cycles()
 
         # This graph will be updated for every request
         current_graph = deepcopy(project_graph)
@@ -296,6 +495,8 @@ class CycleDetector(object):
         # check if the new cycle (also as a set of packages) is
         # included here.
         project_cycles_pkgs = [set(cycle) for cycle in project_cycles]
+        # All the cycles are reported, also the ones the updated packages
+        # can not reach anymore, like a part of a split project cycle.
         for cycle in current_graph.cycles():
             if cycle not in project_cycles:
                 project_edges = set((u, v) for u in cycle for v in project_graph.edges(u) if v in cycle)
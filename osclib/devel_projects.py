@@ -0,0 +1,89 @@
+# Copyright (C) 2017 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+from time import time
+import urllib2
+from xml.etree import cElementTree as ET
+
+from osc.core import http_GET
+from osc.core import makeurl
+
+from osclib.xmlstream import iterchildren
+
+
+class DevelProjects(object):
+    """Devel projects of the packages of a project.
+
+    The devel projects are resolved in bulk, with a /search/package query
+    for every CHUNK unknown packages, and kept in a map per project that
+    is dropped after ttl seconds.  The search does not return packages
+    that come from a linked project, those are looked up one by one in
+    the package meta.
+
+    """
+
+    TTL = 60 * 60
+    CHUNK = 50
+
+    def __init__(self, apiurl, ttl=None):
+        self.apiurl = apiurl
+        self.ttl = ttl if ttl is not None else self.TTL
+        # project -> (timestamp, {package: devel project})
+        self.projects = {}
+
+    def _devel(self, project):
+        timestamp, devel = self.projects.get(project, (0, None))
+        if devel is None or time() - timestamp > self.ttl:
+            devel = {}
+            self.projects[project] = (time(), devel)
+        return devel
+
+    def _search(self, project, packages):
+        names = ' or '.join("@name='{}'".format(package) for package in packages)
+        query = {'match': "[@project='{}' and ({})]".format(project, names)}
+        url = makeurl(self.apiurl, ['search', 'package'], query)
+        for package in iterchildren(http_GET(url), 'package'):
+            node = package.find('devel')
+            yield package.get('name'), node.get('project') if node is not None else None
+
+    def _meta(self, project, package):
+        url = makeurl(self.apiurl, ['source', project, package, '_meta'])
+        try:
+            root = ET.parse(http_GET(url)).getroot()
+        except urllib2.HTTPError, e:
+            if e.code != 404:
+                raise
+            return None
+        node = root.find('devel')
+        return node.get('project') if node is not None else None
+
+    def load(self, project, packages):
+        """Return a dictionary with the devel project (or None) of each
+        package, resolving the ones not already known."""
+        devel = self._devel(project)
+        missing = sorted(set(packages) - set(devel))
+        for i in range(0, len(missing), self.CHUNK):
+            chunk = missing[i:i + self.CHUNK]
+            found = dict(self._search(project, chunk))
+            for package in chunk:
+                if package not in found:
+                    found[package] = self._meta(project, package)
+            devel.update(found)
+        return dict((package, devel[package]) for package in packages)
+
+    def get(self, project, package):
+        """Return the devel project of a package, or None."""
+        return self.load(project, [package])[package]
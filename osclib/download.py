@@ -0,0 +1,103 @@
+# Copyright (C) 2017 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+from multiprocessing.pool import ThreadPool
+import os
+import time
+
+from osc.core import get_binary_file
+
+
+class BinaryDownloader(object):
+    """Download binary files from OBS into a PkgCache.
+
+    Files already in the cache are linked in place, the rest are fetched
+    by a bounded pool of worker threads that also add them to the cache.
+    An optional process function is called in the worker right after a
+    file is available, so per file work (like reading the DISTURL)
+    overlaps with the pending downloads.  It is called with the target
+    and the cache key of the file.
+
+    """
+
+    # Default number of concurrent downloads
+    WORKERS = 4
+
+    def __init__(self, apiurl, pkgcache, workers=None):
+        self.apiurl = apiurl
+        self.pkgcache = pkgcache
+        self.workers = workers if workers else self.WORKERS
+        self.stats = {}
+
+    def _fetch(self, item):
+        index, cached, (project, repository, arch, package, filename, target, mtime), process = item
+        key = (project, repository, arch, package, filename, mtime)
+        if not cached:
+            get_binary_file(self.apiurl, project, repository, arch,
+                            filename, package=package,
+                            target_filename=target)
+            self.pkgcache[key] = target
+        result = process(target, key) if process else None
+        return index, cached, os.path.getsize(target), result
+
+    def download(self, files, process=None):
+        """Download the files, a list of tuples like this:
+        (project, repository, arch, package, filename, target, mtime)
+
+        Return the list of results of process(target, key), in the same
+        order as the files.
+
+        """
+        start = time.time()
+        results = [None] * len(files)
+        self.stats = {'files': len(files), 'cached': 0, 'bytes': 0, 'seconds': 0.0}
+
+        items = []
+        for index, f in enumerate(files):
+            project, repository, arch, package, filename, target, mtime = f
+            key = (project, repository, arch, package, filename, mtime)
+            cached = key in self.pkgcache
+            if cached:
+                try:
+                    os.unlink(target)
+                except OSError:
+                    pass
+                self.pkgcache.linkto(key, target)
+            items.append((index, cached, f, process))
+
+        if items:
+            pool = ThreadPool(min(self.workers, len(items)))
+            try:
+                for index, cached, size, result in pool.imap_unordered(self._fetch, items):
+                    if cached:
+                        self.stats['cached'] += 1
+                    else:
+                        self.stats['bytes'] += size
+                    results[index] = result
+            finally:
+                pool.terminate()
+                pool.join()
+
+        self.stats['seconds'] = time.time() - start
+        return results
+
+    def format_stats(self):
+        """Summary of the last download() call."""
+        stats = self.stats
+        seconds = max(stats['seconds'], 0.001)
+        return '%d files (%d cached), %.1f MiB in %.1fs, %.2f MiB/s with %d workers' % (
+            stats['files'], stats['cached'], stats['bytes'] / 1048576.0, seconds,
+            stats['bytes'] / 1048576.0 / seconds, self.workers)
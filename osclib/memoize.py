@@ -14,11 +14,12 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
-from datetime import datetime
-import fcntl
+from cStringIO import StringIO
 from functools import wraps
 import os
-import shelve
+import sqlite3
+import threading
+import time
 try:
     import cPickle as pickle
 except:
@@ -40,60 +41,155 @@ except ImportError:
 CACHEDIR = save_cache_path('opensuse-repo-checker')
 
 
+class MemoStore(object):
+    """Persistent storage shared by all the memoized functions.
+
+    Every function gets its own namespace in a single SQLite database in WAL
+    mode, so readers never block and concurrent processes only serialize on
+    the actual writes. The number of slots per namespace is kept in a
+    separate table and the entries are indexed by access time, which makes
+    insertion and eviction independent of the size of the cache.
+
+    The least recently used entries are evicted first.  A hit refreshes
+    the access time of an entry at most every ATIME_RESOLUTION seconds,
+    so reading hot entries does not turn into a write every time.  The
+    timestamp returned with the value stays the time it was stored.
+
+    """
+
+    FILENAME = 'memoize.db'
+    ATIME_RESOLUTION = 60
+
+    _instance = None
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.RLock()
+        self._db = None
+        self._pid = None
+
+    @staticmethod
+    def instance():
+        """Return the store for this process."""
+        if MemoStore._instance is None:
+            MemoStore._instance = MemoStore(os.path.join(CACHEDIR, MemoStore.FILENAME))
+        return MemoStore._instance
+
+    @property
+    def db(self):
+        # Connections can not be shared with a forked child.
+        if self._db is None or self._pid != os.getpid():
+            self._db = sqlite3.connect(self.filename, timeout=60, check_same_thread=False)
+            self._db.text_factory = str
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS memo (
+                    name TEXT NOT NULL,
+                    key BLOB NOT NULL,
+                    timestamp REAL NOT NULL,
+                    value BLOB NOT NULL,
+                    atime REAL NOT NULL,
+                    PRIMARY KEY (name, key)
+                );
+                CREATE TABLE IF NOT EXISTS slots (
+                    name TEXT PRIMARY KEY,
+                    used INTEGER NOT NULL
+                );
+            """)
+            columns = [row[1] for row in self._db.execute('PRAGMA table_info(memo)')]
+            if 'atime' not in columns:
+                # stores created before the access time was tracked
+                with self._db as db:
+                    db.execute('ALTER TABLE memo ADD COLUMN atime REAL NOT NULL DEFAULT 0')
+                    db.execute('UPDATE memo SET atime = timestamp')
+                    db.execute('DROP INDEX IF EXISTS memo_timestamp')
+            self._db.execute('CREATE INDEX IF NOT EXISTS memo_atime ON memo (name, atime)')
+            self._pid = os.getpid()
+        return self._db
+
+    def get(self, name, key):
+        """Return (timestamp, value) for the key or None."""
+        key = sqlite3.Binary(key)
+        with self.lock:
+            row = self.db.execute('SELECT timestamp, value, atime FROM memo WHERE name = ? AND key = ?',
+                                  (name, key)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if now - row[2] >= self.ATIME_RESOLUTION:
+                with self.db as db:
+                    db.execute('UPDATE memo SET atime = ? WHERE name = ? AND key = ?', (now, name, key))
+        return row[0], pickle.loads(str(row[1]))
+
+    def set(self, name, key, timestamp, value, slots, nclean):
+        """Store a value and evict the least recently used entries when
+        there are no slots left.
+
+        """
+        key = sqlite3.Binary(key)
+        value = sqlite3.Binary(pickle.dumps(value, protocol=-1))
+        atime = time.time()
+        with self.lock, self.db as db:
+            if db.execute('UPDATE memo SET timestamp = ?, value = ?, atime = ? WHERE name = ? AND key = ?',
+                          (timestamp, value, atime, name, key)).rowcount:
+                return
+
+            db.execute('INSERT INTO memo (name, key, timestamp, value, atime) VALUES (?, ?, ?, ?, ?)',
+                       (name, key, timestamp, value, atime))
+            db.execute('INSERT OR IGNORE INTO slots VALUES (?, 0)', (name,))
+            db.execute('UPDATE slots SET used = used + 1 WHERE name = ?', (name,))
+
+            used = db.execute('SELECT used FROM slots WHERE name = ?', (name,)).fetchone()[0]
+            if used >= slots:
+                nclean = nclean + used - slots
+                removed = db.execute('DELETE FROM memo WHERE rowid IN '
+                                     '(SELECT rowid FROM memo WHERE name = ? ORDER BY atime LIMIT ?)',
+                                     (name, nclean)).rowcount
+                db.execute('UPDATE slots SET used = used - ? WHERE name = ?', (removed, name))
+
+    def delete(self, name, key):
+        with self.lock, self.db as db:
+            if db.execute('DELETE FROM memo WHERE name = ? AND key = ?',
+                          (name, sqlite3.Binary(key))).rowcount:
+                db.execute('UPDATE slots SET used = used - 1 WHERE name = ?', (name,))
+
+    def clear(self, name):
+        with self.lock, self.db as db:
+            db.execute('DELETE FROM memo WHERE name = ?', (name,))
+            db.execute('DELETE FROM slots WHERE name = ?', (name,))
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM memo').fetchone()[0]
+
+
 def memoize(ttl=None, session=False, add_invalidate=False):
     """Decorator function to implement a persistent cache.
 
     >>> @memoize()
-    ... def test_func(a):
+    ... def test_func(self, a):
     ...     return a
 
-    Internally, the memoized function has a cache:
+    Internally, the memoized functions share a MemoStore where the
+    function name is used as namespace:
 
-    >>> cache = [c.cell_contents for c in test_func.func_closure if 'sync' in dir(c.cell_contents)][0]
-    >>> 'sync' in dir(cache)
-    True
+    >>> store = MemoStore.instance()
+    >>> store.clear('test_func')
 
     There is a limit of the size of the cache
 
-    >>> for k in cache:
-    ...     del cache[k]
-    >>> len(cache)
-    0
-
     >>> for i in range(4095):
-    ...     test_func(i)
-    ... len(cache)
-    4095
-
-    >>> test_func(0)
-    0
-
-    >>> len(cache)
+    ...     _ = test_func(None, i)
+    >>> store.db.execute("SELECT used FROM slots WHERE name = 'test_func'").fetchone()[0]
     4095
 
-    >>> test_func(4095)
+    >>> test_func(None, 4095)
     4095
 
-    >>> len(cache)
+    >>> store.db.execute("SELECT used FROM slots WHERE name = 'test_func'").fetchone()[0]
     3072
 
-    >>> test_func(0)
-    0
-
-    >>> len(cache)
-    3073
-
-    >>> from datetime import timedelta
-    >>> k = [k for k in cache if cPickle.loads(k) == ((0,), {})][0]
-    >>> t, v = cache[k]
-    >>> t = t - timedelta(days=10)
-    >>> cache[k] = (t, v)
-    >>> test_func(0)
-    0
-    >>> t2, v = cache[k]
-    >>> t != t2
-    True
-
     """
 
     # Configuration variables
@@ -102,61 +198,47 @@ def memoize(ttl=None, session=False, add_invalidate=False):
     TIMEOUT = 60*60*2       # Time to live for every cache slot (seconds)
 
     def _memoize(fn):
-        # Implement a POSIX lock / unlock extension for shelves. Inspired
-        # on ActiveState Code recipe #576591
-        def _lock(filename):
-            lckfile = open(filename + '.lck', 'w')
-            fcntl.flock(lckfile.fileno(), fcntl.LOCK_EX)
-            return lckfile
-
-        def _unlock(lckfile):
-            fcntl.flock(lckfile.fileno(), fcntl.LOCK_UN)
-            lckfile.close()
-
-        def _open_cache(cache_name):
-            if not session:
-                lckfile = _lock(cache_name)
-                cache = shelve.open(cache_name, protocol=-1)
-                # Store a reference to the lckfile to avoid to be
-                # closed by gc
-                cache.lckfile = lckfile
-            else:
-                if not hasattr(fn, '_memoize_session_cache'):
-                    fn._memoize_session_cache = {}
-                cache = fn._memoize_session_cache
-            return cache
-
-        def _close_cache(cache):
-            if not session:
-                cache.close()
-                _unlock(cache.lckfile)
-
-        def _clean_cache(cache):
-            len_cache = len(cache)
-            if len_cache >= SLOTS:
-                nclean = NCLEAN + len_cache - SLOTS
-                keys_to_delete = sorted(cache, key=lambda k: cache[k][0])[:nclean]
-                for key in keys_to_delete:
-                    del cache[key]
+        name = fn.__name__
+        # The session cache is shared by all the threads.
+        lock = threading.Lock()
 
         def _key(obj):
             # Pickle doesn't guarantee that there is a single
-            # representation for every serialization.  We can try to
-            # picke / depickle twice to have a canonical
+            # representation for every serialization, as the memo
+            # references depend on object identity.  The fast mode
+            # disables the memo, so equal objects have a single
             # representation.
-            key = pickle.dumps(obj, protocol=-1)
-            key = pickle.dumps(pickle.loads(key), protocol=-1)
-            return key
+            f = StringIO()
+            pickler = pickle.Pickler(f, -1)
+            pickler.fast = True
+            try:
+                pickler.dump(obj)
+            except ValueError:
+                # Self-referencing objects need the memo, so fall back to
+                # pickle / depickle twice.
+                key = pickle.dumps(obj, protocol=-1)
+                return pickle.dumps(pickle.loads(key), protocol=-1)
+            return f.getvalue()
+
+        def _session_cache():
+            if not hasattr(fn, '_memoize_session_cache'):
+                fn._memoize_session_cache = {}
+            return fn._memoize_session_cache
 
         def _invalidate(*args, **kwargs):
             key = _key((args, kwargs))
-            cache = _open_cache(cache_name)
-            if key in cache:
-                del cache[key]
+            if session:
+                with lock:
+                    _session_cache().pop(key, None)
+            else:
+                MemoStore.instance().delete(name, key)
 
         def _invalidate_all():
-            cache = _open_cache(cache_name)
-            cache.clear()
+            if session:
+                with lock:
+                    _session_cache().clear()
+            else:
+                MemoStore.instance().clear(name)
 
         def _add_invalidate_method(_self):
             name = '_invalidate_%s' % fn.__name__
@@ -169,29 +251,34 @@ def memoize(ttl=None, session=False, add_invalidate=False):
 
         @wraps(fn)
         def _fn(*args, **kwargs):
-            def total_seconds(td):
-                return (td.microseconds + (td.seconds + td.days * 24 * 3600.) * 10**6) / 10**6
-            now = datetime.now()
+            now = time.time()
             if add_invalidate:
                 _self = args[0]
                 _add_invalidate_method(_self)
             key = _key((args[1:], kwargs))
-            updated = False
-            cache = _open_cache(cache_name)
-            if key in cache:
-                timestamp, value = cache[key]
-                updated = True if total_seconds(now-timestamp) < ttl else False
-            if not updated:
-                value = fn(*args, **kwargs)
-                cache[key] = (now, value)
-            _clean_cache(cache)
-            _close_cache(cache)
+
+            if session:
+                with lock:
+                    entry = _session_cache().get(key)
+            else:
+                entry = MemoStore.instance().get(name, key)
+
+            if entry and now - entry[0] < ttl:
+                return entry[1]
+
+            value = fn(*args, **kwargs)
+            if session:
+                with lock:
+                    cache = _session_cache()
+                    if len(cache) >= SLOTS:
+                        nclean = NCLEAN + len(cache) - SLOTS
+                        for k in sorted(cache, key=lambda k: cache[k][0])[:nclean]:
+                            del cache[k]
+                    cache[key] = (now, value)
+            else:
+                MemoStore.instance().set(name, key, now, value, SLOTS, NCLEAN)
             return value
 
-        cache_dir = os.path.expanduser(CACHEDIR)
-        if not os.path.exists(cache_dir):
-            os.makedirs(cache_dir)
-        cache_name = os.path.join(cache_dir, fn.__name__)
         return _fn
 
     ttl = ttl if ttl else TIMEOUT
@@ -14,24 +14,48 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
-import fcntl
-import glob
+from cStringIO import StringIO
+from contextlib import contextmanager
 import hashlib
 import os.path
 try:
     import cPickle as pickle
 except:
     import pickle
-import shelve
 import shutil
+import sqlite3
+import threading
 import time
 from UserDict import DictMixin
 
 
 class PkgCache(DictMixin):
-    def __init__(self, basecachedir, force_clean=False):
+    """Content addressed cache of binary files.
+
+    Files are stored once per md5 in the cache directory, hard linked
+    from the downloaded file.  The index is a SQLite database that maps
+    every key to the md5 of the content and keeps a reference count per
+    md5, so different keys can share the same file.  The cache can be
+    used from several threads.
+
+    """
+
+    # Size of the chunks read to compute the md5 of a file
+    CHUNK_SIZE = 1024 * 1024
+    # Default limit of the size of the cached files, in bytes
+    MAX_SIZE = 20 * 1024 * 1024 * 1024
+
+    def __init__(self, basecachedir, force_clean=False, ttl=14*24*60*60, max_size=None):
+        """The least recently used files are removed when the cache is
+        larger than max_size bytes, MAX_SIZE by default."""
+        max_size = max_size if max_size is not None else self.MAX_SIZE
         self.cachedir = os.path.join(basecachedir, 'pkgcache')
-        self.index_fn = os.path.join(self.cachedir, 'index.db')
+        self.index_fn = os.path.join(self.cachedir, 'index.sqlite')
+
+        # The previous shelve index used hard links as refcount and can
+        # not be migrated, so start from scratch.
+        if os.path.exists(os.path.join(self.cachedir, 'index.db')):
+            force_clean = True
 
         if force_clean:
             try:
@@ -42,160 +66,199 @@ class PkgCache(DictMixin):
         if not os.path.exists(self.cachedir):
             os.makedirs(self.cachedir)
 
-        self._clean_cache()
-
-    def _lock(self, filename):
-        """Get a lock for the index file."""
-        lckfile = open(filename + '.lck', 'w')
-        fcntl.flock(lckfile.fileno(), fcntl.LOCK_EX)
-        return lckfile
-
-    def _unlock(self, lckfile):
-        """Release the lock for the index file."""
-        fcntl.flock(lckfile.fileno(), fcntl.LOCK_UN)
-        lckfile.close()
-
-    def _open_index(self):
-        """Open the index file for the cache / container."""
-        lckfile = self._lock(self.index_fn)
-        index = shelve.open(self.index_fn, protocol=-1)
-        # Store a reference to the lckfile to avoid to be closed by gc
-        index.lckfile = lckfile
-        return index
-
-    def _close_index(self, index):
-        """Close the index file for the cache / container."""
-        index.close()
-        self._unlock(index.lckfile)
-
-    def _clean_cache(self, ttl=14*24*60*60, index=None):
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(self.index_fn, timeout=60, isolation_level=None,
+                                   check_same_thread=False)
+        self._db.text_factory = str
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS entry (
+                key BLOB PRIMARY KEY,
+                prefix BLOB NOT NULL,
+                mtime INTEGER NOT NULL,
+                md5 TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                atime REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entry_prefix ON entry (prefix, mtime);
+            CREATE INDEX IF NOT EXISTS entry_mtime ON entry (mtime);
+            CREATE INDEX IF NOT EXISTS entry_atime ON entry (atime);
+            CREATE TABLE IF NOT EXISTS blob (
+                md5 TEXT PRIMARY KEY,
+                refcount INTEGER NOT NULL,
+                size INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS tags (
+                md5 TEXT PRIMARY KEY,
+                tags BLOB NOT NULL
+            );
+        """)
+
+        self._clean_cache(ttl=ttl, max_size=max_size)
+
+    @contextmanager
+    def _transaction(self):
+        """Serialize the changes in the index and the container."""
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._db
+            except:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+
+    def _query(self, sql, *args):
+        with self._lock:
+            return self._db.execute(sql, args).fetchall()
+
+    @staticmethod
+    def _dumps(obj):
+        """Serialize always with the same representation."""
+        f = StringIO()
+        pickler = pickle.Pickler(f, -1)
+        pickler.fast = True
+        pickler.dump(obj)
+        return f.getvalue()
+
+    def _cache_fn(self, md5):
+        return os.path.join(self.cachedir, md5[:2], md5[2:])
+
+    def _md5(self, filename):
+        md5 = hashlib.md5()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.CHUNK_SIZE), ''):
+                md5.update(chunk)
+        return md5.hexdigest()
+
+    def _clean_cache(self, ttl=14*24*60*60, max_size=None):
         """Remove elements in the cache that share the same prefix of the key
         (all except the mtime), and keep the latest one.  Also remove
-        old entries based on the TTL.
+        old entries based on the TTL and, if max_size is given, the
+        least recently used entries until the files fit in max_size bytes.
 
         """
-        _i = self._open_index() if index is None else index
+        now = int(time.time())
+        with self._transaction() as db:
+            keys = db.execute("""
+                SELECT key FROM entry e WHERE mtime <= ? OR EXISTS
+                    (SELECT 1 FROM entry n WHERE n.prefix = e.prefix AND n.mtime > e.mtime)
+            """, (now - ttl,)).fetchall()
+            for key, in keys:
+                self._remove(db, key)
+
+            if max_size is not None:
+                size = db.execute('SELECT TOTAL(size) FROM blob').fetchone()[0]
+                while size > max_size:
+                    row = db.execute('SELECT key FROM entry ORDER BY atime LIMIT 1').fetchone()
+                    if not row:
+                        break
+                    size -= self._remove(db, row[0])
+
+    def _remove(self, db, key):
+        """Remove an entry from the index, and the file if it is the last
+        reference.  Return the number of bytes released.
 
-        # Ugly hack to assure that the key is serialized always with
-        # the same pickle format.  Pickle do not guarantee that the
-        # same object is serialized always in the same string.
-        skeys = {pickle.loads(key): key for key in _i}
-        keys = sorted(skeys)
+        """
+        row = db.execute('SELECT md5 FROM entry WHERE key = ?', (key,)).fetchone()
+        if not row:
+            raise KeyError(pickle.loads(key))
+        md5 = row[0]
+        db.execute('DELETE FROM entry WHERE key = ?', (key,))
+        db.execute('UPDATE blob SET refcount = refcount - 1 WHERE md5 = ?', (md5,))
+        refcount, size = db.execute('SELECT refcount, size FROM blob WHERE md5 = ?', (md5,)).fetchone()
+        if refcount > 0:
+            return 0
+
+        db.execute('DELETE FROM blob WHERE md5 = ?', (md5,))
+        db.execute('DELETE FROM tags WHERE md5 = ?', (md5,))
+
+        # Remove the file and the directory if it is empty
+        cache_fn = self._cache_fn(md5)
+        try:
+            os.unlink(cache_fn)
+        except OSError:
+            pass
 
-        now = int(time.time())
-        last = None
-        for key in keys:
-            if last and last[:-1] == key[:-1]:
-                self.__delitem__(key=skeys[last], skey=True, index=_i)
-                last = key
-            elif now - int(key[-1]) >= ttl:
-                self.__delitem__(key=skeys[key], skey=True, index=_i)
-            else:
-                last = key
-
-        if index is None:
-            self._close_index(_i)
-
-    def __getitem__(self, key, index=None):
+        dirname = os.path.dirname(cache_fn)
+        if os.path.exists(dirname) and not os.listdir(dirname):
+            os.rmdir(dirname)
+
+        return size
+
+    def __contains__(self, key):
+        return bool(self._query('SELECT 1 FROM entry WHERE key = ?', self._dumps(key)))
+
+    def __getitem__(self, key):
         """Get a element in the cache.
 
         For the container perspective, the key is a tuple like this:
         (project, repository, arch, package, filename, mtime)
 
         """
-        _i = self._open_index() if index is None else index
-
-        key = pickle.dumps(key, protocol=-1)
-        value = pickle.loads(_i[key])
-
-        if index is None:
-            self._close_index(_i)
-
-        return value
+        rows = self._query('SELECT md5, filename FROM entry WHERE key = ?', self._dumps(key))
+        if not rows:
+            raise KeyError(key)
+        return tuple(rows[0])
 
-    def __setitem__(self, key, value, index=None):
+    def __setitem__(self, key, value):
         """Add a new file in the cache. 'value' is expected to contains the
         path of file.
 
         """
-        _i = self._open_index() if index is None else index
-
-        key = pickle.dumps(key, protocol=-1)
-
-        original_value = value
-
-        md5 = hashlib.md5(open(value, 'rb').read()).hexdigest()
+        md5 = self._md5(value)
         filename = os.path.basename(value)
-        value = (md5, filename)
-        value = pickle.dumps(value, protocol=-1)
-        _i[key] = value
-
-        # Move the file into the container using a hard link
-        cache_fn = os.path.join(self.cachedir, md5[:2], md5[2:])
-        if os.path.exists(cache_fn):
-            # Manage collisions using hard links and refcount
-            collisions = sorted(glob.glob(cache_fn + '-*'))
-            next_refcount = 1
-            if collisions:
-                next_refcount = int(collisions[-1][-3:]) + 1
-            next_cache_fn = cache_fn + '-%03d' % next_refcount
-            os.link(cache_fn, next_cache_fn)
-        else:
-            dirname = os.path.dirname(cache_fn)
-            if not os.path.exists(dirname):
-                os.makedirs(dirname)
-            os.link(original_value, cache_fn)
-
-        if index is None:
-            self._close_index(_i)
-
-    def __delitem__(self, key, skey=False, index=None):
-        """Remove a file from the cache."""
-        _i = self._open_index() if index is None else index
+        skey = self._dumps(key)
 
-        key = pickle.dumps(key, protocol=-1) if not skey else key
-        value = pickle.loads(_i[key])
+        with self._transaction() as db:
+            if db.execute('SELECT 1 FROM entry WHERE key = ?', (skey,)).fetchone():
+                self._remove(db, skey)
 
-        md5, _ = value
+            db.execute('INSERT INTO entry VALUES (?, ?, ?, ?, ?, ?)',
+                       (skey, self._dumps(key[:-1]), int(key[-1]), md5, filename, time.time()))
+            if db.execute('UPDATE blob SET refcount = refcount + 1 WHERE md5 = ?', (md5,)).rowcount:
+                return
 
-        # Remove the file (taking care of collision) and the directory
-        # if it is empty
-        cache_fn = os.path.join(self.cachedir, md5[:2], md5[2:])
-        collisions = sorted(glob.glob(cache_fn + '-*'))
-        if collisions:
-            os.unlink(collisions[-1])
-        else:
-            os.unlink(cache_fn)
-
-        dirname = os.path.dirname(cache_fn)
-        if not os.listdir(dirname):
-            os.rmdir(dirname)
+            db.execute('INSERT INTO blob VALUES (?, 1, ?)', (md5, os.path.getsize(value)))
 
-        del _i[key]
+            # Move the file into the container using a hard link
+            cache_fn = self._cache_fn(md5)
+            if not os.path.exists(cache_fn):
+                dirname = os.path.dirname(cache_fn)
+                if not os.path.exists(dirname):
+                    os.makedirs(dirname)
+                os.link(value, cache_fn)
 
-        if index is None:
-            self._close_index(_i)
+    def __delitem__(self, key):
+        """Remove a file from the cache."""
+        with self._transaction() as db:
+            self._remove(db, self._dumps(key))
 
-    def keys(self, index=None):
-        _i = self._open_index() if index is None else index
+    def keys(self):
+        return [pickle.loads(key) for key, in self._query('SELECT key FROM entry')]
 
-        keys = [pickle.loads(key) for key in _i]
+    def get_tags(self, md5):
+        """Return the tags stored for a file with get_tags() or None."""
+        rows = self._query('SELECT tags FROM tags WHERE md5 = ?', md5)
+        return pickle.loads(str(rows[0][0])) if rows else None
 
-        if index is None:
-            self._close_index(_i)
+    def set_tags(self, md5, tags):
+        """Store a dictionary of metadata (like RPM header tags) that
+        is removed together with the file.
 
-        return keys
+        """
+        with self._transaction() as db:
+            if db.execute('SELECT 1 FROM blob WHERE md5 = ?', (md5,)).fetchone():
+                db.execute('INSERT OR REPLACE INTO tags VALUES (?, ?)',
+                           (md5, sqlite3.Binary(pickle.dumps(tags, protocol=-1))))
 
-    def linkto(self, key, target, index=None):
+    def linkto(self, key, target):
         """Create a link between the cached object and the target"""
-        _i = self._open_index() if index is None else index
-
-        md5, filename = self.__getitem__(key, index=_i)
+        md5, filename = self[key]
         if filename != target:
             pass
             # print 'Warning. The target name (%s) is different from the original name (%s)' % (target, filename)
-        cache_fn = os.path.join(self.cachedir, md5[:2], md5[2:])
-        os.link(cache_fn, target)
+        os.link(self._cache_fn(md5), target)
 
-        if index is None:
-            self._close_index(_i)
+        with self._transaction() as db:
+            db.execute('UPDATE entry SET atime = ? WHERE key = ?', (time.time(), self._dumps(key)))
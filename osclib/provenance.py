@@ -0,0 +1,229 @@
+# Copyright (C) 2017 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import sqlite3
+import threading
+import time
+import urllib2
+from xml.etree import cElementTree as ET
+
+from osc.core import http_GET
+from osc.core import makeurl
+
+from osclib.memoize import CACHEDIR
+
+
+ATOM = '{http://www.w3.org/2005/Atom}'
+
+
+class ProvenanceIndex(object):
+    """Persistent index of the verifymd5 of package revisions.
+
+    Revisions are read from the _history of a package and resolved to
+    their verifymd5 once, then answered locally.  The latest_commits feed
+    of a project, checked at most every TTL seconds, tells which packages
+    changed since they were indexed.  When a package is indexed for the
+    first time only the last HISTORY_LIMIT revisions are resolved, and
+    lookup() only matches those last revisions of the history, while
+    where() answers from every revision in the index.
+
+    """
+
+    FILENAME = 'provenance.db'
+    HISTORY_LIMIT = 5
+    TTL = 300
+
+    def __init__(self, apiurl, filename=None, history_limit=None, ttl=None):
+        self.apiurl = apiurl
+        self.filename = filename or os.path.join(CACHEDIR, self.FILENAME)
+        self.history_limit = history_limit if history_limit is not None else self.HISTORY_LIMIT
+        self.ttl = ttl if ttl is not None else self.TTL
+        self.lock = threading.RLock()
+        self.requests = 0
+        self._db = None
+        self._pid = None
+
+    @property
+    def db(self):
+        # Connections can not be shared with a forked child.
+        if self._db is None or self._pid != os.getpid():
+            self._db = sqlite3.connect(self.filename, timeout=60, check_same_thread=False)
+            self._db.text_factory = str
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS revision (
+                    apiurl TEXT NOT NULL,
+                    project TEXT NOT NULL,
+                    package TEXT NOT NULL,
+                    rev INTEGER NOT NULL,
+                    srcmd5 TEXT NOT NULL,
+                    verifymd5 TEXT NOT NULL,
+                    PRIMARY KEY (apiurl, project, package, rev)
+                );
+                CREATE INDEX IF NOT EXISTS revision_verifymd5 ON revision (apiurl, verifymd5);
+                CREATE TABLE IF NOT EXISTS package (
+                    apiurl TEXT NOT NULL,
+                    project TEXT NOT NULL,
+                    package TEXT NOT NULL,
+                    rev INTEGER NOT NULL,
+                    stale INTEGER NOT NULL,
+                    PRIMARY KEY (apiurl, project, package)
+                );
+                CREATE TABLE IF NOT EXISTS project (
+                    apiurl TEXT NOT NULL,
+                    project TEXT NOT NULL,
+                    checked REAL NOT NULL,
+                    updated TEXT,
+                    PRIMARY KEY (apiurl, project)
+                );
+            """)
+            self._pid = os.getpid()
+        return self._db
+
+    def _get(self, url):
+        with self.lock:
+            self.requests += 1
+        return ET.parse(http_GET(url)).getroot()
+
+    def _latest_commits(self, project):
+        """Return (updated, package) of the latest commits of a project."""
+        url = makeurl(self.apiurl, ['project', 'latest_commits', project])
+        root = self._get(url)
+        commits = []
+        for entry in root.findall(ATOM + 'entry'):
+            title = entry.find(ATOM + 'title').text or ''
+            updated = entry.find(ATOM + 'updated')
+            if title.startswith('In ') and updated is not None:
+                commits.append((updated.text, title[3:].split(' ')[0]))
+        return commits
+
+    def refresh(self, project, force=False):
+        """Mark the packages of the project that changed since the last
+        refresh as stale."""
+        with self.lock:
+            row = self.db.execute('SELECT checked, updated FROM project WHERE apiurl = ? AND project = ?',
+                                  (self.apiurl, project)).fetchone()
+        if row and not force and time.time() - row[0] < self.ttl:
+            return
+
+        try:
+            commits = self._latest_commits(project)
+        except urllib2.HTTPError:
+            commits = None
+        updated = max(c[0] for c in commits) if commits else None
+
+        with self.lock, self.db as db:
+            if row and row[1] and commits and min(c[0] for c in commits) <= row[1]:
+                db.executemany('UPDATE package SET stale = 1 WHERE apiurl = ? AND project = ? AND package = ?',
+                               [(self.apiurl, project, package) for u, package in commits if u > row[1]])
+            else:
+                # the feed does not reach back to the last refresh
+                db.execute('UPDATE package SET stale = 1 WHERE apiurl = ? AND project = ?', (self.apiurl, project))
+            db.execute('INSERT OR REPLACE INTO project VALUES (?, ?, ?, ?)',
+                       (self.apiurl, project, time.time(), updated if updated else (row[1] if row else None)))
+
+    def _verifymd5(self, project, package, srcmd5):
+        url = makeurl(self.apiurl, ['source', project, package], {'rev': srcmd5, 'view': 'info'})
+        return self._get(url).get('verifymd5')
+
+    def update(self, project, package):
+        """Index the new revisions of a package if it is not up to date.
+
+        Return False if the package does not exist.
+
+        """
+        with self.lock:
+            row = self.db.execute('SELECT rev, stale FROM package WHERE apiurl = ? AND project = ? AND package = ?',
+                                  (self.apiurl, project, package)).fetchone()
+        if row and not row[1]:
+            return row[0] >= 0
+
+        url = makeurl(self.apiurl, ['source', project, package, '_history'])
+        try:
+            root = self._get(url)
+        except urllib2.HTTPError, e:
+            if e.code != 404:
+                raise
+            with self.lock, self.db as db:
+                db.execute('INSERT OR REPLACE INTO package VALUES (?, ?, ?, -1, 0)',
+                           (self.apiurl, project, package))
+            return False
+
+        revisions = []
+        for revision in root.findall('revision'):
+            srcmd5 = revision.find('srcmd5')
+            if srcmd5 is not None:
+                revisions.append((int(revision.get('rev')), srcmd5.text))
+        last = max(row[0], 0) if row else 0
+        recreated = revisions and revisions[-1][0] < last
+        if recreated:
+            row = None
+            last = 0
+        new = [r for r in revisions if r[0] > last]
+        if not row or row[0] < 0:
+            new = new[-self.history_limit:] if self.history_limit else []
+
+        values = [(self.apiurl, project, package, rev, srcmd5,
+                   self._verifymd5(project, package, srcmd5))
+                  for rev, srcmd5 in new]
+        with self.lock, self.db as db:
+            if recreated:
+                # the package was deleted and created again
+                db.execute('DELETE FROM revision WHERE apiurl = ? AND project = ? AND package = ?',
+                           (self.apiurl, project, package))
+            db.executemany('INSERT OR REPLACE INTO revision VALUES (?, ?, ?, ?, ?, ?)',
+                           [v for v in values if v[5]])
+            db.execute('INSERT OR REPLACE INTO package VALUES (?, ?, ?, ?, 0)',
+                       (self.apiurl, project, package, max([last] + [r[0] for r in revisions])))
+        return True
+
+    def exists(self, project, package):
+        """Bring the package up to date, return False if it does not
+        exist."""
+        self.refresh(project)
+        return self.update(project, package)
+
+    def revisions(self, project, package, limit=None):
+        """Return the indexed (rev, srcmd5, verifymd5) of the package, the
+        latest first, only from the last limit revisions of its history
+        when a limit is given."""
+        if not self.exists(project, package):
+            return []
+        with self.lock:
+            latest = self.db.execute('SELECT rev FROM package WHERE apiurl = ? AND project = ? AND package = ?',
+                                     (self.apiurl, project, package)).fetchone()[0]
+            first = latest - limit + 1 if limit else 0
+            return self.db.execute('SELECT rev, srcmd5, verifymd5 FROM revision '
+                                   'WHERE apiurl = ? AND project = ? AND package = ? AND rev >= ? '
+                                   'ORDER BY rev DESC', (self.apiurl, project, package, first)).fetchall()
+
+    def lookup(self, project, package, verifymd5):
+        """Return (srcmd5, rev) of the latest revision of the package with
+        the verifymd5 among the last history_limit ones, or None."""
+        for rev, srcmd5, v in self.revisions(project, package, self.history_limit):
+            if v == verifymd5:
+                return srcmd5, str(rev)
+        return None
+
+    def where(self, verifymd5):
+        """Return the indexed (project, package, srcmd5, rev) with the
+        verifymd5, without any request."""
+        with self.lock:
+            return self.db.execute('SELECT project, package, srcmd5, rev FROM revision '
+                                   'WHERE apiurl = ? AND verifymd5 = ? ORDER BY rev DESC',
+                                   (self.apiurl, verifymd5)).fetchall()
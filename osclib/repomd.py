@@ -0,0 +1,100 @@
+# Copyright (C) 2017 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import json
+from multiprocessing.pool import ThreadPool
+import os
+import threading
+import urllib2
+from xml.etree import cElementTree as ET
+
+from osc.core import http_GET
+
+from osclib.memoize import CACHEDIR
+
+
+REPO_NS = '{http://linux.duke.edu/metadata/repo}'
+
+
+class RepoMDWatcher(object):
+    """Follow the primary checksum of repositories.
+
+    The ETag, Last-Modified and primary checksum of the repomd.xml of
+    every repository are kept on disk, so checking a repository that did
+    not change is a conditional request answered with 304.
+
+    """
+
+    FILENAME = 'repomd.json'
+    WORKERS = 4
+
+    def __init__(self, filename=None):
+        self.filename = filename or os.path.join(CACHEDIR, self.FILENAME)
+        self.lock = threading.Lock()
+        self.state = {}
+        if os.path.exists(self.filename):
+            try:
+                with open(self.filename) as f:
+                    self.state = json.load(f)
+            except ValueError:
+                pass
+
+    def save(self):
+        tmpfile = self.filename + '.tmp'
+        with open(tmpfile, 'w') as f:
+            json.dump(self.state, f)
+        os.rename(tmpfile, self.filename)
+
+    def _check(self, url):
+        """Return the primary checksum of a repository and if repomd.xml
+        was downloaded."""
+        entry = self.state.get(url, {})
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('modified'):
+            headers['If-Modified-Since'] = entry['modified']
+
+        try:
+            f = http_GET(url + '/repodata/repomd.xml', headers=headers)
+        except urllib2.HTTPError, e:
+            if e.code == 304 and 'checksum' in entry:
+                return entry['checksum'], False
+            raise
+
+        root = ET.parse(f).getroot()
+        checksum = root.find('.//{0}data[@type="primary"]/{0}checksum'.format(REPO_NS)).text
+        headers = getattr(f, 'headers', {})
+        with self.lock:
+            self.state[url] = {
+                'etag': headers.get('ETag'),
+                'modified': headers.get('Last-Modified'),
+                'checksum': checksum,
+            }
+        return checksum, True
+
+    def checksums(self, urls):
+        """Return the primary checksums of the repositories."""
+        pool = ThreadPool(min(self.WORKERS, len(urls)) or 1)
+        try:
+            results = pool.map(self._check, urls)
+        finally:
+            pool.close()
+            pool.join()
+
+        if any(fetched for _, fetched in results):
+            self.save()
+        return [checksum for checksum, _ in results]
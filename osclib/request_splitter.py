@@ -7,6 +7,9 @@ class RequestSplitter(object):
         self.in_ring = in_ring
         self.requests_ignored = self.api.get_ignored_requests()
         self.reset()
+        # the devel projects are only resolved once a filter or group
+        # needs them
+        self.devel_projects_loaded = False
 
     def reset(self):
         self.filters = []
@@ -68,9 +71,10 @@ class RequestSplitter(object):
         target = request.find('./action/target')
         target_project = target.get('project')
         target_package = target.get('package')
-        devel = self.devel_project_get(target_project, target_package)
-        if devel:
-            target.set('devel_project', devel)
+        if self.devel_projects_needed():
+            devel = self.devel_project_get(target_project, target_package)
+            if devel:
+                target.set('devel_project', devel)
 
         ring = self.ring_get(target_package)
         if ring:
@@ -96,7 +100,29 @@ class RequestSplitter(object):
             return self.api.project
         return None
 
+    def devel_projects_needed(self):
+        return any('devel_project' in xpath.path for xpath in self.filters + self.groups)
+
+    def devel_projects_load(self):
+        """Resolve the devel projects of all the requests in bulk."""
+        self.devel_projects_loaded = True
+        targets = {}
+        for request in self.requests:
+            target = request.find('./action/target')
+            if target is not None and target.get('package'):
+                targets.setdefault(target.get('project'), set()).add(target.get('package'))
+
+        missing = set()
+        for project, packages in targets.items():
+            devel = self.api.get_devel_projects(project, packages)
+            missing.update(package for package, devel_project in devel.items() if devel_project is None)
+
+        if missing and self.api.project.startswith('openSUSE:'):
+            self.api.get_devel_projects('openSUSE:Factory', missing)
+
     def devel_project_get(self, target_project, target_package):
+        if not self.devel_projects_loaded:
+            self.devel_projects_load()
         devel = self.api.get_devel_project(target_project, target_package)
         if devel is None and self.api.project.startswith('openSUSE:'):
             devel = self.api.get_devel_project('openSUSE:Factory', target_package)
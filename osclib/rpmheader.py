@@ -0,0 +1,107 @@
+# Copyright (C) 2017 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import struct
+import subprocess
+import threading
+
+try:
+    import rpm
+except ImportError:
+    rpm = None
+
+# Size of the lead of an RPM file, followed by the signature header
+RPM_LEAD_SIZE = 96
+RPM_HEADER_MAGIC = '\x8e\xad\xe8\x01'
+
+
+def _header_size(data, off):
+    magic, il, dl = struct.unpack_from('>4s4xII', data, off)
+    if magic != RPM_HEADER_MAGIC:
+        raise ValueError('no RPM header at offset %d' % off)
+    return 16 + il * 16 + dl
+
+
+def header_blob(data):
+    """Return the main header of an RPM file without its magic, the
+    format taken by rpm.hdr(), from a buffer that starts with the lead.
+
+    Slicing a memoryview does not copy data.
+
+    """
+    # the signature header is padded to 8 bytes
+    off = RPM_LEAD_SIZE + _header_size(data, RPM_LEAD_SIZE)
+    off += (8 - (off & 7)) & 7
+    return data[off + 8:off + _header_size(data, off)]
+
+
+class RPMHeaderReader(object):
+    """Read tags from the header of RPM files.
+
+    The header is read in-process with the rpm bindings when available,
+    otherwise a single rpm query is done per file.  When a PkgCache key
+    is given, the tags are stored with the cached file, so the same
+    binary is never read twice.
+
+    """
+
+    TAGS = ('name', 'version', 'release', 'arch', 'sourcerpm', 'disturl')
+
+    def __init__(self, pkgcache=None):
+        self.pkgcache = pkgcache
+        # A transaction set can not be shared between threads
+        self._local = threading.local()
+
+    def _ts(self):
+        if not hasattr(self._local, 'ts'):
+            self._local.ts = rpm.TransactionSet()
+            self._local.ts.setVSFlags(rpm._RPMVSF_NOSIGNATURES)
+        return self._local.ts
+
+    def _read(self, filename):
+        if rpm:
+            fd = os.open(filename, os.O_RDONLY)
+            try:
+                h = self._ts().hdrFromFdno(fd)
+            finally:
+                os.close(fd)
+            return dict((tag, h[tag] if h[tag] is not None else '') for tag in self.TAGS)
+
+        queryformat = '\\n'.join('%%{%s}' % tag.upper() for tag in self.TAGS)
+        output = subprocess.check_output(
+            ('rpm', '--nosignature', '--queryformat', queryformat, '-qp', filename),
+            close_fds=True)
+        values = [v if v != '(none)' else '' for v in output.split('\n')]
+        return dict(zip(self.TAGS, values))
+
+    def read(self, filename, key=None):
+        """Return a dictionary with the TAGS of the RPM file."""
+        md5 = None
+        if self.pkgcache is not None and key is not None and key in self.pkgcache:
+            md5, _ = self.pkgcache[key]
+            tags = self.pkgcache.get_tags(md5)
+            if tags is not None:
+                return tags
+
+        tags = self._read(filename)
+        if md5:
+            self.pkgcache.set_tags(md5, tags)
+        return tags
+
+    def disturl(self, filename, key=None):
+        """Return the DISTURL of the RPM file."""
+        return self.read(filename, key)['disturl']
@@ -0,0 +1,154 @@
+# Copyright (C) 2017 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+import threading
+import time
+import urllib2
+from urllib import quote_plus
+
+from osc.core import http_GET
+from osc.core import makeurl
+
+from osclib.memoize import MemoStore
+from osclib.xmlstream import iterchildren
+
+
+ATOM = '{http://www.w3.org/2005/Atom}'
+
+# Compact record of a <sourceinfo/>, linked is a tuple of (project, package)
+SourceInfo = namedtuple('SourceInfo', ('package', 'rev', 'vrev', 'srcmd5', 'lsrcmd5',
+                                       'verifymd5', 'linked', 'filenames'))
+
+
+# http://stackoverflow.com/questions/312443/how-do-you-split-a-list-into-evenly-sized-chunks-in-python
+def chunks(l, n):
+    """ Yield successive n-sized chunks from l.
+    """
+    for i in xrange(0, len(l), n):
+        yield l[i:i+n]
+
+
+def retried_GET(url, retries=5):
+    """GET an url, retrying on server errors."""
+    try:
+        return http_GET(url)
+    except urllib2.HTTPError, e:
+        if 500 <= e.code <= 599 and retries:
+            time.sleep(1)
+            return retried_GET(url, retries - 1)
+        raise
+
+
+def source_packages(apiurl, project, expand=False):
+    """Return the list of packages in a project."""
+    query = {'expand': 1} if expand else {}
+    f = retried_GET(makeurl(apiurl, ['source', project], query))
+    return [entry.get('name') for entry in iterchildren(f, 'entry')]
+
+
+class SourceInfoFetcher(object):
+    """Fetch the sourceinfo of many packages of a project.
+
+    The packages are requested CHUNK at a time by WORKERS threads, and
+    the responses are parsed as streams into SourceInfo records.  The
+    records are kept in the MemoStore together with the time of the
+    latest commit of the project, and reused while it does not change.
+    Packages with a link are always fetched again, as their expanded
+    sources follow the link target.
+
+    """
+
+    CHUNK = 50
+    WORKERS = 4
+
+    # Namespace and size of the records in the MemoStore
+    CACHE = 'sourceinfo'
+    CACHE_SLOTS = 64
+    CACHE_NCLEAN = 16
+
+    def __init__(self, apiurl, workers=None):
+        self.apiurl = apiurl
+        self.workers = workers if workers else self.WORKERS
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def _get(self, url):
+        with self.lock:
+            self.requests += 1
+        return retried_GET(url)
+
+    def _fetch(self, item):
+        project, packages = item
+        query = ['view=info']
+        query += ['package=%s' % quote_plus(p) for p in packages]
+        f = self._get(makeurl(self.apiurl, ['source', project], query))
+        records = []
+        for si in iterchildren(f, 'sourceinfo'):
+            if si.find('error') is not None:
+                continue
+            records.append(SourceInfo(
+                si.get('package'), si.get('rev'), si.get('vrev'), si.get('srcmd5'),
+                si.get('lsrcmd5'), si.get('verifymd5'),
+                tuple((l.get('project'), l.get('package')) for l in si.findall('linked')),
+                tuple(f.text for f in si.findall('filename'))))
+        return records
+
+    def fetch(self, project, packages):
+        """Return a dictionary with the SourceInfo of the packages,
+        without the ones that do not exist or have errors."""
+        items = [(project, chunk) for chunk in chunks(sorted(set(packages)), self.CHUNK)]
+        ret = {}
+        if not items:
+            return ret
+        pool = ThreadPool(min(self.workers, len(items)))
+        try:
+            for records in pool.imap_unordered(self._fetch, items):
+                for record in records:
+                    ret[record.package] = record
+        finally:
+            pool.terminate()
+            pool.join()
+        return ret
+
+    def latest_commit(self, project):
+        """Return the time of the latest commit in the project or None."""
+        try:
+            f = self._get(makeurl(self.apiurl, ['project', 'latest_commits', project]))
+        except urllib2.HTTPError:
+            return None
+        updated = [entry.findtext(ATOM + 'updated') for entry in iterchildren(f, ATOM + 'entry')]
+        return max(updated) if updated else None
+
+    def get(self, project, packages):
+        """Like fetch(), reusing the records of the last call for the
+        project when nothing was committed since."""
+        store = MemoStore.instance()
+        key = repr((self.apiurl, project))
+        stamp = self.latest_commit(project)
+        cached = {}
+        entry = store.get(self.CACHE, key)
+        if stamp and entry and entry[1][0] == stamp:
+            cached = entry[1][1]
+
+        ret = dict((p, cached[p]) for p in packages if p in cached and not cached[p].linked)
+        ret.update(self.fetch(project, [p for p in packages if p not in ret]))
+
+        if stamp:
+            cached.update(ret)
+            store.set(self.CACHE, key, time.time(), (stamp, cached), self.CACHE_SLOTS, self.CACHE_NCLEAN)
+        return ret
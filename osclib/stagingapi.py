@@ -25,7 +25,6 @@ import yaml
 
 from osc import conf
 from osc import oscerr
-from osc.core import show_package_meta
 from osc.core import change_review_state
 from osc.core import delete_package
 from osc.core import get_group
@@ -38,7 +37,9 @@ from osc.core import http_PUT
 
 from osclib.cache import Cache
 from osclib.comments import CommentAPI
+from osclib.devel_projects import DevelProjects
 from osclib.memoize import memoize
+from osclib.xmlstream import iterchildren
 
 
 class StagingAPI(object):
@@ -68,6 +69,7 @@ class StagingAPI(object):
         self._ring_packages_for_links = None
         self._packages_staged = None
         self._package_metas = dict()
+        self.devel_projects = DevelProjects(apiurl)
 
         # If the project support rings, inititialize some variables.
         if self.crings:
@@ -170,7 +172,7 @@ class StagingAPI(object):
             url = self.makeurl(['source', prj], query)
             root = http_GET(url)
 
-            for si in ET.parse(root).getroot().findall('sourceinfo'):
+            for si in iterchildren(root, 'sourceinfo'):
                 pkg = si.get('package')
                 # XXX TODO - Test-DVD-x86_64 is hardcoded here
                 if pkg in ret and not pkg.startswith('Test-DVD-'):
@@ -517,9 +519,8 @@ class StagingAPI(object):
             where, '+or+'.join(targets))
         url = self.makeurl(['search', 'request'], query)
         f = http_GET(url)
-        root = ET.parse(f).getroot()
 
-        for rq in root.findall('request'):
+        for rq in iterchildren(f, 'request'):
             requests.append(rq)
         return requests
 
@@ -1329,12 +1330,13 @@ class StagingAPI(object):
             return False
 
     def get_devel_project(self, project, package):
-        try:
-            m = show_package_meta(self.apiurl, project, package)
-            node = ET.fromstring(''.join(m)).find('devel')
-            if node is not None:
-                return node.get('project')
-        except urllib2.HTTPError, e:
-            if e.code == 404:
-                pass
-        return None
+        return self.devel_projects.get(project, package)
+
+    def get_devel_projects(self, project, packages):
+        """
+        Get the devel projects of many packages at once
+        :param project: project of the packages
+        :param packages: list of package names
+        :return dict of package names and devel projects (or None)
+        """
+        return self.devel_projects.load(project, packages)
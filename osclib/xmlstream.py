@@ -0,0 +1,57 @@
+# Copyright (C) 2017 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+from lxml import etree as ET
+
+
+def iterchildren(source, tag=None):
+    """Iterate over the children of the root element of an XML document
+    without building the whole tree.
+
+    source is a file name or a file object, like the one returned by
+    http_GET().  Only the children with this tag are returned when tag
+    is given.  Each child is detached from the document once the parser is
+    done with the next one, so the memory used is only the one of the
+    elements that the caller keeps.
+
+    """
+    root = None
+    depth = 0
+    for event, element in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = element
+            depth += 1
+            continue
+
+        depth -= 1
+        if depth == 1:
+            if tag is None or element.tag == tag:
+                yield element
+            # The parser can still add the tail to the current element,
+            # so only the previous ones are dropped.
+            while element.getprevious() is not None:
+                del root[0]
+
+
+def latest_updated(source):
+    """Iterate over the /statistics/latest_updated entries as tuples
+    (project, updated).  The entries are projects or packages.
+
+    """
+    for entity in iterchildren(source):
+        key = 'name' if entity.tag == 'project' else 'project'
+        yield entity.get(key), entity.get('updated')
@@ -0,0 +1,166 @@
+# Copyright (C) 2017 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import httpretty
+from mock import MagicMock
+import osc
+
+import osclib.cache
+from osclib.cache import BACKENDS
+from osclib.cache import Cache
+from osclib.cache import MemoryCache
+
+
+APIURL = 'http://localhost'
+URL_META = APIURL + '/source/openSUSE:Factory/_meta'
+URL_OTHER = APIURL + '/source/openSUSE:Factory:Staging:A/_meta'
+
+
+class TestCacheBackend(unittest.TestCase):
+    def setUp(self):
+        """Initialize the environment."""
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Clean the environment."""
+        shutil.rmtree(self.root)
+
+    def _backends(self):
+        for name in sorted(BACKENDS):
+            backend = BACKENDS[name](self.root)
+            yield backend
+            backend.close()
+
+    def test_put_get(self):
+        for backend in self._backends():
+            self.assertEqual(backend.mtime(URL_META, 'openSUSE:Factory'), None)
+            backend.put(URL_META, 'openSUSE:Factory', '<project/>')
+            self.assertNotEqual(backend.mtime(URL_META, 'openSUSE:Factory'), None)
+            self.assertNotEqual(backend.project_mtime(URL_META, 'openSUSE:Factory'), None)
+            self.assertEqual(backend.open(URL_META, 'openSUSE:Factory').read(), '<project/>')
+
+            self.assertTrue(backend.delete(URL_META, 'openSUSE:Factory'))
+            self.assertFalse(backend.delete(URL_META, 'openSUSE:Factory'))
+            self.assertEqual(backend.mtime(URL_META, 'openSUSE:Factory'), None)
+
+    def test_delete_project(self):
+        for backend in self._backends():
+            backend.put(URL_META, 'openSUSE:Factory', '<project/>')
+            backend.put(URL_OTHER, 'openSUSE:Factory:Staging:A', '<project/>')
+
+            self.assertTrue(backend.delete_project(APIURL, 'openSUSE:Factory'))
+            self.assertFalse(backend.delete_project(APIURL, 'openSUSE:Factory'))
+            self.assertEqual(backend.mtime(URL_META, 'openSUSE:Factory'), None)
+            self.assertEqual(backend.project_mtime(URL_META, 'openSUSE:Factory'), None)
+            self.assertNotEqual(backend.mtime(URL_OTHER, 'openSUSE:Factory:Staging:A'), None)
+            backend.delete_project(APIURL, 'openSUSE:Factory:Staging:A')
+
+    def test_validators(self):
+        for backend in self._backends():
+            backend.put(URL_META, 'openSUSE:Factory', '<project/>', {'etag': '"1"'})
+            self.assertEqual(backend.validators(URL_META, 'openSUSE:Factory')['etag'], '"1"')
+            backend.put(URL_META, 'openSUSE:Factory', '<project/>')
+            self.assertEqual(backend.validators(URL_META, 'openSUSE:Factory'), None)
+            backend.delete(URL_META, 'openSUSE:Factory')
+
+
+class TestMemoryCache(unittest.TestCase):
+    def test_lru(self):
+        memory = MemoryCache(10)
+        memory.put(URL_META, 'openSUSE:Factory', 1, '12345')
+        memory.put(URL_OTHER, 'openSUSE:Factory:Staging:A', 2, '12345')
+        self.assertEqual(memory.get(URL_META), (1, '12345'))
+
+        # URL_OTHER is the least recently used.
+        memory.put(APIURL + '/source', None, 3, '1')
+        self.assertEqual(memory.get(URL_OTHER), None)
+        self.assertEqual(memory.used, 6)
+
+        # Larger than the whole cache.
+        memory.put(URL_OTHER, 'openSUSE:Factory:Staging:A', 4, '12345678901')
+        self.assertEqual(memory.get(URL_OTHER), None)
+
+    def test_delete_project(self):
+        memory = MemoryCache(100)
+        memory.put(URL_META, 'openSUSE:Factory', 1, '12345')
+        memory.put(URL_OTHER, 'openSUSE:Factory:Staging:A', 2, '12345')
+        memory.delete_project(APIURL, 'openSUSE:Factory')
+        self.assertEqual(memory.get(URL_META), None)
+        self.assertEqual(memory.get(URL_OTHER), (2, '12345'))
+        self.assertEqual(memory.used, 5)
+
+
+class TestCacheRevalidate(unittest.TestCase):
+    def setUp(self):
+        """Initialize the environment."""
+        self.cache_dir = Cache.CACHE_DIR
+        self.time = osclib.cache.time
+        Cache.CACHE_DIR = tempfile.mkdtemp()
+        Cache.init()
+        Cache.last_updated[APIURL] = {'__oldest': '2016-12-18T11:49:37Z'}
+        for key in Cache.stats:
+            Cache.stats[key] = 0
+
+        oscrc = os.path.join(os.getcwd(), 'tests/fixtures/oscrc')
+        osc.core.conf.get_config(override_conffile=oscrc,
+                                 override_no_keyring=True,
+                                 override_no_gnome_keyring=True)
+        httpretty.reset()
+        httpretty.enable()
+
+    def tearDown(self):
+        """Clean the environment."""
+        httpretty.disable()
+        httpretty.reset()
+        osclib.cache.time = self.time
+        Cache.delete_all()
+        Cache.CACHE_DIR = self.cache_dir
+        Cache.init()
+
+    def test_revalidate(self):
+        def meta(request, uri, headers):
+            if request.headers.get('If-None-Match') == '"1"':
+                return (304, headers, '')
+            headers['ETag'] = '"1"'
+            return (200, headers, '<project/>')
+
+        httpretty.register_uri(httpretty.GET, URL_META, body=meta)
+
+        self.assertEqual(osc.core.http_GET(URL_META).read(), '<project/>')
+        self.assertEqual(osc.core.http_GET(URL_META).read(), '<project/>')
+        self.assertEqual((Cache.stats['fetch'], Cache.stats['hit']), (1, 1))
+        self.assertEqual(Cache.stats['memory_hit'], 1)
+
+        # Expire the entry so the next request is conditional.
+        now = self.time()
+        osclib.cache.time = MagicMock(return_value=now + Cache.TTL_LONG + 1)
+        self.assertEqual(osc.core.http_GET(URL_META).read(), '<project/>')
+        self.assertEqual(Cache.stats['revalidate'], 1)
+        self.assertEqual(Cache.stats['revalidate_bytes'], len('<project/>'))
+        self.assertEqual(Cache.stats['fetch'], 1)
+
+        # Revalidation refreshes the entry.
+        self.assertEqual(osc.core.http_GET(URL_META).read(), '<project/>')
+        self.assertEqual(Cache.stats['hit'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# Copyright (C) 2017 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import StringIO
+import unittest
+
+from osclib.cpio import Cpio, CpioError
+
+
+def entry(name, payload, mode=0100644):
+    """Return a "newc" cpio entry."""
+    fields = (1, mode, 0, 0, 1, 0, len(payload), 0, 0, 0, 0, len(name) + 1, 0)
+    header = '070701' + ''.join('%08X' % f for f in fields) + name + '\0'
+    header += '\0' * ((4 - len(header) % 4) % 4)
+    return header + payload + '\0' * ((4 - len(payload) % 4) % 4)
+
+
+def archive(files):
+    data = ''.join(entry(name, payload) for name, payload in files)
+    data += entry('TRAILER!!!', '', 0)
+    # archives are padded to full blocks
+    return data + '\0' * ((512 - len(data) % 512) % 512)
+
+
+FILES = [
+    ('./usr/lib64/libfoo.so.1', 'ELF' * 1000),
+    ('a', ''),
+    ('./usr/share/doc/packages/foo/README', 'foo\n'),
+    ('bc', 'xyz'),
+]
+
+
+class TestCpio(unittest.TestCase):
+    def setUp(self):
+        self.data = archive(FILES)
+
+    def test_buffer(self):
+        entries = list(Cpio(self.data))
+        self.assertEqual([(f.name, f.header().tobytes()) for f in entries], FILES)
+        self.assertEqual(entries[0].c_mode, 0100644)
+        self.assertEqual(entries[0].c_filesize, 3000)
+        self.assertTrue(isinstance(entries[0].header(), memoryview))
+
+    def test_stream(self):
+        result = []
+        for f in Cpio(StringIO.StringIO(self.data)):
+            result.append((f.name, f.header()))
+        self.assertEqual(result, FILES)
+
+    def test_stream_partial(self):
+        """Unread payloads are skipped."""
+        result = []
+        for f in Cpio(StringIO.StringIO(self.data)):
+            result.append((f.name, f.read(2)))
+        self.assertEqual(result, [(name, payload[:2]) for name, payload in FILES])
+
+    def test_copyto(self):
+        for f in Cpio(StringIO.StringIO(self.data)):
+            out = StringIO.StringIO()
+            f.copyto(out, bufsize=7)
+            self.assertEqual(out.getvalue(), dict(FILES)[f.name])
+
+    def test_resume(self):
+        offsets = [f.off for f in Cpio(self.data)]
+        self.assertEqual([f.name for f in Cpio(self.data, offsets[2])],
+                         [name for name, _ in FILES[2:]])
+
+    def test_truncated(self):
+        data = self.data[:len(entry(*FILES[0])) + 50]
+        for source in (data, StringIO.StringIO(data)):
+            self.assertRaises(CpioError, list, Cpio(source))
+
+    def test_invalid(self):
+        self.assertRaises(CpioError, list, Cpio('070702' + self.data[6:]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+# Copyright (C) 2017 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from osclib.cycle import BuildDepIndex
+from osclib.cycle import Graph
+
+
+def builddepinfo(packages):
+    """Generate a _builddepinfo document from (name, subpkgs, deps)."""
+    xml = ['<builddepinfo>']
+    for name, subs, deps in packages:
+        xml.append('<package name="%s"><source>%s</source>' % (name, name))
+        xml.extend('<subpkg>%s</subpkg>' % sub for sub in subs)
+        xml.extend('<pkgdep>%s</pkgdep>' % dep for dep in deps)
+        xml.append('</package>')
+    xml.append('</builddepinfo>')
+    return ''.join(xml)
+
+
+PACKAGES = [
+    ('gcc', ['gcc', 'libgcc'], ['glibc-devel']),
+    ('glibc', ['glibc', 'glibc-devel'], ['gcc']),
+    ('bash', ['bash'], ['glibc-devel', 'gcc', 'readline-devel']),
+    ('readline', ['readline-devel'], ['gcc', 'bash']),
+    ('branding-openSUSE', ['branding-openSUSE'], ['bash']),
+    ('orphan', ['orphan'], ['does-not-exist']),
+]
+
+
+def edges(graph):
+    return set((u, v) for u in graph for v in graph.edges(u))
+
+
+class TestGraph(unittest.TestCase):
+    def setUp(self):
+        self.graph = Graph()
+        self.graph.add_nodes_from((v, v) for v in 'abcdefg')
+        self.graph.add_edges_from([('a', 'b'), ('b', 'c'), ('c', 'a'), ('c', 'd'),
+                                   ('d', 'e'), ('e', 'd'), ('f', 'g'), ('g', 'f'),
+                                   ('g', 'missing'), ('g', 'g')])
+
+    def test_edges(self):
+        self.assertEqual(self.graph.edges('c'), ['a', 'd'])
+        self.assertEqual(self.graph.edges('missing'), ())
+        self.assertEqual(self.graph.edges_to('d'), ['c', 'e'])
+        self.assertEqual(self.graph.edges_to('missing'), ['g'])
+        self.graph.remove_edges_from([('c', 'd'), ('x', 'y')])
+        self.assertEqual(self.graph.edges('c'), ['a'])
+        self.assertEqual(self.graph.edges_to('d'), ['e'])
+        self.assertRaises(KeyError, self.graph.add_edge, 'missing', 'a')
+
+    def test_cycles(self):
+        self.assertEqual(self.graph.cycles(), frozenset([frozenset('abc'),
+                                                         frozenset('de'),
+                                                         frozenset('fg')]))
+        self.assertEqual(self.graph.cycles(sources=['d']), frozenset([frozenset('de')]))
+        self.assertEqual(self.graph.cycles(sources=['b', 'missing']),
+                         frozenset([frozenset('abc'), frozenset('de')]))
+
+    def test_long_path(self):
+        # Deeper than the recursion limit
+        graph = Graph()
+        graph.add_nodes_from((i, i) for i in range(5000))
+        graph.add_edges_from((i, i + 1) for i in range(4999))
+        graph.add_edge(4999, 0)
+        self.assertEqual(graph.cycles(), frozenset([frozenset(range(5000))]))
+
+
+class TestBuildDepIndex(unittest.TestCase):
+    def test_graph(self):
+        index = BuildDepIndex()
+        self.assertTrue(index.update(builddepinfo(PACKAGES)))
+        self.assertFalse(index.update(builddepinfo(PACKAGES)))
+
+        graph = index.graph()
+        self.assertEqual(sorted(graph), ['bash', 'gcc', 'glibc', 'orphan', 'readline'])
+        self.assertEqual(graph.edges('bash'), ['gcc', 'glibc', 'readline'])
+        self.assertEqual(graph.edges('orphan'), [])
+        self.assertEqual(index.missing, set(['orphan']))
+        self.assertEqual(index.cycles(), frozenset([frozenset(['gcc', 'glibc']),
+                                                    frozenset(['bash', 'readline'])]))
+        self.assertEqual(index.packages['branding-openSUSE'].deps, set(['bash']))
+
+    def test_incremental(self):
+        index = BuildDepIndex()
+        index.update(builddepinfo(PACKAGES))
+
+        # readline-devel moves to a new package and bash stops using gcc.
+        packages = [p for p in PACKAGES if p[0] not in ('readline', 'bash')]
+        packages.append(('bash', ['bash'], ['glibc-devel', 'readline-devel']))
+        packages.append(('libreadline', ['readline-devel'], ['bash']))
+        packages.append(('exists', ['does-not-exist'], []))
+        index.update(builddepinfo(packages))
+
+        fresh = BuildDepIndex()
+        fresh.update(builddepinfo(packages))
+        self.assertEqual(edges(index.graph()), edges(fresh.graph()))
+        self.assertEqual(sorted(index.graph()), sorted(fresh.graph()))
+        self.assertEqual(index.missing, fresh.missing)
+        self.assertEqual(index.cycles(), fresh.cycles())
+        self.assertFalse('readline' in index.packages)
+
+    def test_persist(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'index.pickle')
+            index = BuildDepIndex()
+            index.update(builddepinfo(PACKAGES))
+            index.cycles()
+            index.save(filename)
+
+            loaded = BuildDepIndex.load(filename)
+            self.assertFalse(loaded.update(builddepinfo(PACKAGES)))
+            self.assertEqual(edges(loaded.graph()), edges(index.graph()))
+            self.assertEqual(BuildDepIndex.load(os.path.join(tmpdir, 'missing')).digest, None)
+
+            # An index in another format is not loaded.
+            index.version = BuildDepIndex.VERSION - 1
+            index.save(filename)
+            self.assertEqual(BuildDepIndex.load(filename).digest, None)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
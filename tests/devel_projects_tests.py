@@ -0,0 +1,102 @@
+# Copyright (C) 2017 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+from StringIO import StringIO
+import unittest
+import urllib2
+import urlparse
+
+from mock import patch
+
+import osclib.devel_projects
+from osclib.devel_projects import DevelProjects
+
+APIURL = 'http://localhost'
+
+DEVEL = {
+    'gcc': 'devel:gcc',
+    'bash': 'Base:System',
+    'vim': None,
+}
+
+
+# Packages of a linked project, only found through their meta
+LINKED = {
+    'kernel': 'Kernel:stable',
+}
+
+
+def search(url):
+    """Answer a /search/package query with the packages in DEVEL, and
+    the _meta of the packages in LINKED."""
+    path = urlparse.urlsplit(url).path.split('/')
+    if path[-1] == '_meta':
+        if path[3] not in LINKED:
+            raise urllib2.HTTPError(url, 404, 'not found', {}, None)
+        return StringIO('<package name="{0}"><devel project="{1}" package="{0}"/></package>'.format(
+            path[3], LINKED[path[3]]))
+    match = urlparse.parse_qs(urlparse.urlsplit(url).query)['match'][0]
+    xml = ['<collection>']
+    for package in sorted(DEVEL):
+        if "@name='{}'".format(package) in match:
+            xml.append('<package name="{}" project="openSUSE:Factory">'.format(package))
+            if DEVEL[package]:
+                xml.append('<devel project="{}" package="{}"/>'.format(DEVEL[package], package))
+            xml.append('</package>')
+    xml.append('</collection>')
+    return StringIO(''.join(xml))
+
+
+class TestDevelProjects(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(osclib.devel_projects, 'http_GET', side_effect=search)
+        self.http_GET = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_load(self):
+        devel = DevelProjects(APIURL)
+        packages = ['gcc', 'bash', 'vim', 'kernel', 'missing']
+        self.assertEqual(devel.load('openSUSE:Factory', packages), {
+            'gcc': 'devel:gcc', 'bash': 'Base:System', 'vim': None,
+            'kernel': 'Kernel:stable', 'missing': None})
+        # One search, and the meta of the packages it did not return.
+        self.assertEqual(self.http_GET.call_count, 3)
+
+        # Known packages, including the missing ones, are not searched again.
+        self.assertEqual(devel.get('openSUSE:Factory', 'gcc'), 'devel:gcc')
+        self.assertEqual(devel.get('openSUSE:Factory', 'missing'), None)
+        self.assertEqual(self.http_GET.call_count, 3)
+
+    def test_chunk(self):
+        devel = DevelProjects(APIURL)
+        devel.CHUNK = 2
+        devel.load('openSUSE:Factory', ['gcc', 'bash', 'vim'])
+        self.assertEqual(self.http_GET.call_count, 2)
+
+    def test_ttl(self):
+        devel = DevelProjects(APIURL, ttl=60)
+        with patch.object(osclib.devel_projects, 'time', return_value=1000):
+            devel.get('openSUSE:Factory', 'gcc')
+        with patch.object(osclib.devel_projects, 'time', return_value=1030):
+            devel.get('openSUSE:Factory', 'gcc')
+        self.assertEqual(self.http_GET.call_count, 1)
+        with patch.object(osclib.devel_projects, 'time', return_value=1100):
+            devel.get('openSUSE:Factory', 'gcc')
+        self.assertEqual(self.http_GET.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
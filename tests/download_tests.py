@@ -0,0 +1,73 @@
+# Copyright (C) 2017 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import MagicMock
+
+import osclib.download
+from osclib.download import BinaryDownloader
+from osclib.pkgcache import PkgCache
+
+
+def get_binary_file(apiurl, project, repository, arch, filename, package, target_filename):
+    with open(target_filename, 'w') as f:
+        f.write(filename)
+
+
+class TestBinaryDownloader(unittest.TestCase):
+    def setUp(self):
+        """Initialize the environment."""
+        self.get_binary_file = osclib.download.get_binary_file
+        osclib.download.get_binary_file = MagicMock(side_effect=get_binary_file)
+        self.tmpdir = tempfile.mkdtemp()
+        self.pkgcache = PkgCache(self.tmpdir)
+        self.downloader = BinaryDownloader('http://localhost', self.pkgcache, workers=2)
+
+    def tearDown(self):
+        """Clean the environment."""
+        osclib.download.get_binary_file = self.get_binary_file
+        shutil.rmtree(self.tmpdir)
+
+    def _files(self):
+        return [('openSUSE:Factory', 'standard', 'x86_64', 'package', fn,
+                 os.path.join(self.tmpdir, fn), 1) for fn in ('a.rpm', 'b.rpm', 'c.rpm')]
+
+    def test_download(self):
+        results = self.downloader.download(self._files(), process=lambda t, key: open(t).read())
+        self.assertEqual(results, ['a.rpm', 'b.rpm', 'c.rpm'])
+        self.assertEqual(osclib.download.get_binary_file.call_count, 3)
+        self.assertEqual(self.downloader.stats['cached'], 0)
+        self.assertEqual(self.downloader.stats['bytes'], 15)
+        self.assertTrue(('openSUSE:Factory', 'standard', 'x86_64', 'package', 'b.rpm', 1) in self.pkgcache)
+
+    def test_cached(self):
+        self.downloader.download(self._files())
+        for f in self._files():
+            os.unlink(f[5])
+
+        results = self.downloader.download(self._files(), process=lambda t, key: open(t).read())
+        self.assertEqual(results, ['a.rpm', 'b.rpm', 'c.rpm'])
+        self.assertEqual(osclib.download.get_binary_file.call_count, 3)
+        self.assertEqual(self.downloader.stats['cached'], 3)
+        self.assertEqual(self.downloader.stats['bytes'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,8 +14,10 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import itertools
 import os
 import shutil
+import time
 import unittest
 
 from mock import MagicMock
@@ -27,6 +29,7 @@ from osclib.pkgcache import PkgCache
 class TestPkgCache(unittest.TestCase):
     def setUp(self):
         """Initialize the environment."""
+        self.time = time.time
         self.cache = PkgCache('/tmp/cache', force_clean=True)
         for fn in ('file_a', 'file_b', 'file_c'):
             with open(os.path.join('/tmp', fn), 'w') as f:
@@ -34,6 +37,7 @@ class TestPkgCache(unittest.TestCase):
 
     def tearDown(self):
         """Clean the environment."""
+        osclib.pkgcache.time.time = self.time
         shutil.rmtree('/tmp/cache')
         for fn in ('/tmp/file_a', '/tmp/file_b', '/tmp/file_c'):
             os.unlink(fn)
@@ -84,24 +88,18 @@ class TestPkgCache(unittest.TestCase):
         self.cache[('file_a', 1)] = '/tmp/file_a'
         self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a'))
         self.cache[('file_a', 2)] = '/tmp/file_a'
-        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-001'))
         self.cache[('file_a', 3)] = '/tmp/file_a'
-        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-002'))
+        self.assertEqual(os.listdir('/tmp/cache/pkgcache/c7'), ['f33375edf32d8fb62d4b505c74519a'])
 
         del self.cache[('file_a', 2)]
         self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a'))
-        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-001'))
-        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-002'))
 
         del self.cache[('file_a', 1)]
         self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a'))
-        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-001'))
-        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-002'))
 
         del self.cache[('file_a', 3)]
         self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a'))
-        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-001'))
-        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-002'))
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7'))
 
     def test_linkto(self):
         self.cache[('file_a', 1)] = '/tmp/file_a'
@@ -127,5 +125,32 @@ class TestPkgCache(unittest.TestCase):
         self.assertFalse(('file_b', 1) in self.cache)
         self.assertFalse(('file_c', 1) in self.cache)
 
+    def test_clean_size(self):
+        osclib.pkgcache.time.time = MagicMock(side_effect=itertools.count(1).next)
+        self.cache[('file_a', 1)] = '/tmp/file_a'
+        self.cache[('file_b', 1)] = '/tmp/file_b'
+        self.cache[('file_c', 1)] = '/tmp/file_c'
+        self.cache.linkto(('file_a', 1), '/tmp/file_a_')
+        os.unlink('/tmp/file_a_')
+
+        # Each file is 7 bytes, file_b is the least recently used.
+        self.cache._clean_cache(ttl=100, max_size=14)
+        self.assertTrue(('file_a', 1) in self.cache)
+        self.assertFalse(('file_b', 1) in self.cache)
+        self.assertTrue(('file_c', 1) in self.cache)
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/a7'))
+
+    def test_default_max_size(self):
+        mtime = int(time.time())
+        self.cache[('file_a', mtime)] = '/tmp/file_a'
+        self.cache[('file_b', mtime)] = '/tmp/file_b'
+        max_size = PkgCache.MAX_SIZE
+        PkgCache.MAX_SIZE = 7
+        try:
+            cache = PkgCache('/tmp/cache')
+        finally:
+            PkgCache.MAX_SIZE = max_size
+        self.assertEqual(len(cache.keys()), 1)
+
 if __name__ == '__main__':
     unittest.main()
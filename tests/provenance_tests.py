@@ -0,0 +1,131 @@
+# Copyright (C) 2017 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import shutil
+from StringIO import StringIO
+import tempfile
+import unittest
+import urllib2
+import urlparse
+
+from mock import patch
+
+import osclib.provenance
+from osclib.provenance import ProvenanceIndex
+
+APIURL = 'http://localhost'
+
+
+class OBS(object):
+    """Answer the requests of the index from a list of revisions."""
+
+    def __init__(self):
+        # package -> [(srcmd5, verifymd5)]
+        self.history = {'gcc': [('s1', 'v1'), ('s2', 'v2'), ('s3', 'v3')]}
+        # (updated, package)
+        self.commits = [('2017-01-01T00:00:00Z', 'gcc')]
+        self.urls = []
+
+    def __call__(self, url):
+        self.urls.append(url)
+        path = urlparse.urlsplit(url).path.split('/')
+        query = urlparse.parse_qs(urlparse.urlsplit(url).query)
+        if path[1] == 'project':
+            entries = ''.join('<entry><title>In {} some change</title><updated>{}</updated></entry>'.format(p, u)
+                              for u, p in self.commits)
+            return StringIO('<feed xmlns="http://www.w3.org/2005/Atom">{}</feed>'.format(entries))
+        package = path[3]
+        if package not in self.history:
+            raise urllib2.HTTPError(url, 404, 'not found', {}, None)
+        if path[-1] == '_history':
+            revisions = ''.join('<revision rev="{}"><srcmd5>{}</srcmd5></revision>'.format(i + 1, s)
+                                for i, (s, v) in enumerate(self.history[package]))
+            return StringIO('<revisionlist>{}</revisionlist>'.format(revisions))
+        verifymd5 = dict(self.history[package])[query['rev'][0]]
+        return StringIO('<sourceinfo package="{}" verifymd5="{}"/>'.format(package, verifymd5))
+
+
+class TestProvenanceIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.obs = OBS()
+        patcher = patch.object(osclib.provenance, 'http_GET', side_effect=self.obs)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.index = self.new_index()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def new_index(self, **kwargs):
+        return ProvenanceIndex(APIURL, os.path.join(self.tmpdir, 'provenance.db'), **kwargs)
+
+    def test_lookup(self):
+        self.assertEqual(self.index.lookup('openSUSE:Factory', 'gcc', 'v2'), ('s2', '2'))
+        self.assertEqual(self.index.lookup('openSUSE:Factory', 'gcc', 'v4'), None)
+        self.assertEqual(self.index.where('v3'), [('openSUSE:Factory', 'gcc', 's3', 3)])
+        # latest_commits, _history and one view=info per revision
+        self.assertEqual(len(self.obs.urls), 5)
+
+        # Answered from the database, also by a new instance.
+        self.assertEqual(self.new_index().lookup('openSUSE:Factory', 'gcc', 'v1'), ('s1', '1'))
+        self.assertEqual(len(self.obs.urls), 5)
+
+    def test_missing(self):
+        self.assertFalse(self.index.exists('openSUSE:Factory', 'missing'))
+        self.assertEqual(self.index.lookup('openSUSE:Factory', 'missing', 'v1'), None)
+        self.assertEqual(len(self.obs.urls), 2)
+
+    def test_history_limit(self):
+        index = self.new_index(history_limit=2)
+        self.assertEqual(index.lookup('openSUSE:Factory', 'gcc', 'v1'), None)
+        self.assertEqual(index.lookup('openSUSE:Factory', 'gcc', 'v2'), ('s2', '2'))
+
+        # Revisions that fall out of the limit are not matched anymore,
+        # but stay in the index.
+        self.obs.history['gcc'].append(('s4', 'v4'))
+        self.obs.commits.append(('2017-01-02T00:00:00Z', 'gcc'))
+        index.refresh('openSUSE:Factory', force=True)
+        self.assertEqual(index.lookup('openSUSE:Factory', 'gcc', 'v4'), ('s4', '4'))
+        self.assertEqual(index.lookup('openSUSE:Factory', 'gcc', 'v2'), None)
+        self.assertEqual(index.where('v2'), [('openSUSE:Factory', 'gcc', 's2', 2)])
+
+    def test_incremental(self):
+        self.index.lookup('openSUSE:Factory', 'gcc', 'v1')
+        self.obs.history['gcc'].append(('s4', 'v4'))
+        self.obs.commits.append(('2017-01-02T00:00:00Z', 'gcc'))
+
+        # Not seen before the latest_commits are checked again.
+        self.assertEqual(self.index.lookup('openSUSE:Factory', 'gcc', 'v4'), None)
+        self.index.refresh('openSUSE:Factory', force=True)
+        del self.obs.urls[:]
+        self.assertEqual(self.index.lookup('openSUSE:Factory', 'gcc', 'v4'), ('s4', '4'))
+        # Only the new revision is resolved.
+        self.assertEqual(len(self.obs.urls), 2)
+        self.assertEqual(self.index.lookup('openSUSE:Factory', 'gcc', 'v1'), ('s1', '1'))
+
+    def test_unchanged(self):
+        self.index.lookup('openSUSE:Factory', 'gcc', 'v1')
+        self.obs.commits.append(('2017-01-02T00:00:00Z', 'other'))
+        self.index.refresh('openSUSE:Factory', force=True)
+        del self.obs.urls[:]
+        self.index.lookup('openSUSE:Factory', 'gcc', 'v1')
+        self.assertEqual(self.obs.urls, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
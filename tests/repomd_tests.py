@@ -0,0 +1,80 @@
+# Copyright (C) 2017 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import httpretty
+import osc
+
+from osclib.repomd import RepoMDWatcher
+
+REPO = 'http://download.example.com/repositories/test'
+REPOMD = """<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo">
+  <data type="primary">
+    <checksum type="sha256">%s</checksum>
+  </data>
+</repomd>
+"""
+
+
+class TestRepoMDWatcher(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        oscrc = os.path.join(os.getcwd(), 'tests/fixtures/oscrc')
+        osc.core.conf.get_config(override_conffile=oscrc,
+                                 override_no_keyring=True,
+                                 override_no_gnome_keyring=True)
+        httpretty.reset()
+        httpretty.enable()
+
+        self.checksum = 'abc'
+        self.requests = []
+
+        def repomd(request, uri, headers):
+            self.requests.append(request.headers.get('If-None-Match'))
+            etag = '"%s"' % self.checksum
+            if request.headers.get('If-None-Match') == etag:
+                return (304, headers, '')
+            headers['ETag'] = etag
+            return (200, headers, REPOMD % self.checksum)
+
+        httpretty.register_uri(httpretty.GET, REPO + '/repodata/repomd.xml', body=repomd)
+
+    def tearDown(self):
+        httpretty.disable()
+        httpretty.reset()
+        shutil.rmtree(self.tmpdir)
+
+    def test_checksums(self):
+        filename = os.path.join(self.tmpdir, 'repomd.json')
+        self.assertEqual(RepoMDWatcher(filename).checksums([REPO]), ['abc'])
+
+        # The validators are kept on disk.
+        watcher = RepoMDWatcher(filename)
+        self.assertEqual(watcher.checksums([REPO]), ['abc'])
+        self.assertEqual(self.requests, [None, '"abc"'])
+
+        self.checksum = 'def'
+        self.assertEqual(watcher.checksums([REPO]), ['def'])
+        self.assertEqual(RepoMDWatcher(filename).state[REPO]['checksum'], 'def')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+# Copyright (C) 2017 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+import httpretty
+
+from osclib.request_events import FileEventSource
+from osclib.request_events import SocketEventSource
+from osclib.request_events import event_source
+from osclib.request_events import parse_event
+
+
+class TestRequestEvents(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        # Real sockets, even if a previous test left httpretty enabled.
+        httpretty.disable()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_parse_event(self):
+        self.assertEqual(parse_event('1234\n'), '1234')
+        self.assertEqual(parse_event('{"number": 1234, "state": "review"}'), '1234')
+        self.assertEqual(parse_event('{"project": "openSUSE:Factory"}'), None)
+        self.assertEqual(parse_event('garbage'), None)
+        self.assertEqual(parse_event(''), None)
+
+    def test_file(self):
+        filename = os.path.join(self.tmpdir, 'events')
+        with open(filename, 'w') as f:
+            f.write('1\n')
+
+        source = event_source('file://' + filename)
+        self.assertTrue(isinstance(source, FileEventSource))
+        # Only the events after the start are seen.
+        self.assertEqual(source.wait(0), set())
+
+        with open(filename, 'a') as f:
+            f.write('2\n{"number": 3}\n4')
+        self.assertEqual(source.wait(0), set(['2', '3']))
+
+        with open(filename, 'a') as f:
+            f.write('\n')
+        self.assertEqual(source.wait(0), set(['4']))
+
+    def test_socket(self):
+        address = os.path.join(self.tmpdir, 'socket')
+        source = event_source('unix://' + address)
+        self.assertTrue(isinstance(source, SocketEventSource))
+        try:
+            self.assertEqual(source.wait(0), set())
+
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(address)
+            client.sendall('1\n2\n3')
+            client.close()
+            self.assertEqual(source.wait(1), set(['1', '2', '3']))
+        finally:
+            source.close()
+        self.assertFalse(os.path.exists(address))
+
+
+if __name__ == '__main__':
+    unittest.main()
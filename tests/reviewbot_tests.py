@@ -0,0 +1,182 @@
+# Copyright (C) 2017 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import logging
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+import threading
+import time
+import unittest
+import urlparse
+
+from mock import patch
+
+from ReviewBot import ReviewBot
+from osclib.memoize import MemoStore
+
+APIURL = 'https://reviewbot.example.com'
+
+
+class Action(object):
+    def __init__(self, package):
+        self.type = 'submit'
+        self.src_project = 'home:user'
+        self.src_package = package
+        self.src_rev = None
+        self.tgt_project = 'openSUSE:Factory'
+        self.tgt_package = package
+
+
+class Request(object):
+    def __init__(self, reqid):
+        self.reqid = reqid
+        self.state = None
+        self.reviews = []
+        self.actions = [Action('package-%s' % reqid)]
+
+
+class RecordHandler(logging.Handler):
+    def __init__(self):
+        super(RecordHandler, self).__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class SlowBot(ReviewBot):
+    """Accept the even requests, the first ones are the slowest."""
+
+    def check_one_request(self, req):
+        time.sleep(0.01 * (10 - int(req.reqid)))
+        self.logger.info('%s in %s', req.reqid, threading.current_thread().name)
+        good = int(req.reqid) % 2 == 0
+        self.review_messages['accepted'] = 'ok %s' % req.reqid
+        self.review_messages['declined'] = 'failed %s' % req.reqid
+        return good
+
+    def _set_review(self, req, state):
+        self.reviews.append((req.reqid, state, self.review_messages[state]))
+
+
+class TestReviewBot(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('reviewbot-test')
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.handler = RecordHandler()
+        self.logger.addHandler(self.handler)
+
+        self.bot = SlowBot(apiurl=APIURL, logger=self.logger, user='bot')
+        self.bot.review_messages = ReviewBot.DEFAULT_REVIEW_MESSAGES.copy()
+        self.bot.reviews = []
+        self.bot.requests = [Request(str(i)) for i in range(10)]
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def check_requests(self, jobs):
+        self.bot.jobs = jobs
+        self.bot.check_requests()
+        return self.bot.reviews, [m.split(' in ')[0] for m in self.handler.messages]
+
+    def test_concurrent(self):
+        reviews, messages = self.check_requests(4)
+        self.assertEqual(reviews[0], ('0', 'accepted', 'ok 0'))
+        self.assertEqual(reviews[1], ('1', 'declined', 'failed 1'))
+        # The messages of the bot are not changed by the copies.
+        self.assertEqual(self.bot.review_messages, ReviewBot.DEFAULT_REVIEW_MESSAGES)
+
+        self.bot.reviews = []
+        self.handler.messages = []
+        self.assertEqual(self.check_requests(1), (reviews, messages))
+
+    def test_result_cache(self):
+        tmpdir = tempfile.mkdtemp()
+        store = MemoStore._instance
+        MemoStore._instance = MemoStore(os.path.join(tmpdir, MemoStore.FILENAME))
+        try:
+            sources = {}
+            self.bot._get_sourceinfo_md5 = lambda project, package, rev=None: sources.get((project, package))
+            self.bot.requests = self.bot.requests[:4]
+            self.bot.result_cache_ttl = 60
+            self.bot.jobs = 2
+
+            self.bot.check_requests()
+            self.assertEqual(self.bot.result_cache_stats, {'hit': 0, 'miss': 4})
+
+            # A new source in the target of a request.
+            sources[('openSUSE:Factory', 'package-1')] = ('abc', 'def')
+            self.bot.check_requests()
+            self.assertEqual(self.bot.result_cache_stats, {'hit': 3, 'miss': 5})
+            self.assertEqual(self.bot.reviews[:4], self.bot.reviews[4:])
+
+            self.bot.review_mode = 'accept'
+            self.bot.check_requests()
+            self.assertEqual(self.bot.result_cache_stats, {'hit': 3, 'miss': 9})
+        finally:
+            MemoStore._instance = store
+            shutil.rmtree(tmpdir)
+
+    def test_result_cache_undecided(self):
+        tmpdir = tempfile.mkdtemp()
+        store = MemoStore._instance
+        MemoStore._instance = MemoStore(os.path.join(tmpdir, MemoStore.FILENAME))
+        try:
+            checked = []
+            def check_one_request(req):
+                checked.append(req.reqid)
+                return None if req.reqid == '0' else True
+            self.bot.check_one_request = check_one_request
+            self.bot._get_sourceinfo_md5 = lambda project, package, rev=None: None
+            self.bot.requests = self.bot.requests[:2]
+            self.bot.result_cache_ttl = 60
+
+            # The undecided request is checked again, the accepted one not.
+            self.bot.check_requests()
+            self.bot.check_requests()
+            self.assertEqual(sorted(checked), ['0', '0', '1'])
+            self.assertEqual(self.bot.result_cache_stats, {'hit': 1, 'miss': 3})
+        finally:
+            MemoStore._instance = store
+            shutil.rmtree(tmpdir)
+
+    def test_search_ids(self):
+        matches = []
+        def http_GET(url):
+            matches.append(urlparse.parse_qs(urlparse.urlsplit(url).query)['match'][0])
+            return StringIO('<collection matches="0"/>')
+
+        self.bot.SEARCH_IDS_CHUNK = 2
+        with patch('osc.core.http_GET', side_effect=http_GET):
+            self.bot.set_request_ids_search_review(['3', '1', '2'])
+        self.assertEqual(matches, [
+            "(state/@name='review' and review[@by_user='bot' and @state='new']) and (@id='1' or @id='2')",
+            "(state/@name='review' and review[@by_user='bot' and @state='new']) and (@id='3')"])
+        self.assertEqual(self.bot.requests, [])
+
+    def test_exception(self):
+        def check_one_request(req):
+            raise ValueError(req.reqid)
+        self.bot.check_one_request = check_one_request
+        self.bot.jobs = 4
+        self.assertRaises(ValueError, self.bot.check_requests)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+# Copyright (C) 2017 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from mock import MagicMock
+
+from osclib.pkgcache import PkgCache
+from osclib.rpmheader import RPMHeaderReader
+from osclib.rpmheader import header_blob
+
+
+TAGS = {
+    'name': 'bash',
+    'version': '4.4',
+    'release': '1.1',
+    'arch': 'x86_64',
+    'sourcerpm': 'bash-4.4-1.1.src.rpm',
+    'disturl': 'obs://build.opensuse.org/openSUSE:Factory/standard/d41d8cd98f00b204e9800998ecf8427e-bash',
+}
+
+
+class TestRPMHeaderReader(unittest.TestCase):
+    def setUp(self):
+        """Initialize the environment."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.pkgcache = PkgCache(self.tmpdir)
+        self.filename = os.path.join(self.tmpdir, 'bash.rpm')
+        with open(self.filename, 'w') as f:
+            f.write('bash')
+        self.reader = RPMHeaderReader(self.pkgcache)
+        self.reader._read = MagicMock(return_value=TAGS)
+
+    def tearDown(self):
+        """Clean the environment."""
+        shutil.rmtree(self.tmpdir)
+
+    def test_cached_tags(self):
+        key = ('openSUSE:Factory', 'standard', 'x86_64', 'bash', 'bash.rpm', 1)
+        self.pkgcache[key] = self.filename
+
+        self.assertEqual(self.reader.disturl(self.filename, key), TAGS['disturl'])
+        self.assertEqual(self.reader.read(self.filename, key), TAGS)
+        self.assertEqual(self.reader._read.call_count, 1)
+
+        # The tags are gone with the file.
+        md5, _ = self.pkgcache[key]
+        self.assertEqual(self.pkgcache.get_tags(md5), TAGS)
+        del self.pkgcache[key]
+        self.assertEqual(self.pkgcache.get_tags(md5), None)
+
+    def test_uncached(self):
+        self.assertEqual(self.reader.disturl(self.filename), TAGS['disturl'])
+        self.assertEqual(self.reader.disturl(self.filename), TAGS['disturl'])
+        self.assertEqual(self.reader._read.call_count, 2)
+
+
+def rpm_header(il, dl):
+    """Return an RPM header structure with il index entries."""
+    return struct.pack('>4s4xII', '\x8e\xad\xe8\x01', il, dl) + 'i' * (il * 16) + 'd' * dl
+
+
+class TestHeaderBlob(unittest.TestCase):
+    def test_header_blob(self):
+        signature = rpm_header(2, 13)
+        header = rpm_header(3, 40)
+        data = 'l' * 96 + signature + '\0' * 3 + header + 'payload'
+        self.assertEqual(header_blob(data), header[8:])
+        blob = header_blob(memoryview(data))
+        self.assertTrue(isinstance(blob, memoryview))
+        self.assertEqual(blob.tobytes(), header[8:])
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, header_blob, 'l' * 96 + '\0' * 16)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+# Copyright (C) 2017 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import os
+import shutil
+from StringIO import StringIO
+import tempfile
+import threading
+import unittest
+import urllib2
+import urlparse
+
+from mock import patch
+
+import osclib.sourceinfo
+from osclib.memoize import MemoStore
+from osclib.sourceinfo import SourceInfoFetcher
+
+APIURL = 'http://localhost'
+
+
+class OBS(object):
+    """Answer the sourceinfo and latest_commits requests of a project."""
+
+    def __init__(self):
+        self.packages = dict(('p%03d' % i, None) for i in range(120))
+        self.packages['linked'] = ('openSUSE:Factory', 'linked')
+        self.updated = '2017-01-01T00:00:00Z'
+        self.lock = threading.Lock()
+        self.urls = []
+
+    def __call__(self, url):
+        with self.lock:
+            self.urls.append(url)
+        split = urlparse.urlsplit(url)
+        path = split.path.split('/')
+        if path[1] == 'project':
+            if self.updated is None:
+                raise urllib2.HTTPError(url, 404, 'not found', {}, None)
+            return StringIO('<feed xmlns="http://www.w3.org/2005/Atom">'
+                            '<entry><updated>{}</updated></entry></feed>'.format(self.updated))
+        entries = []
+        for package in urlparse.parse_qs(split.query)['package']:
+            if package not in self.packages:
+                entries.append('<sourceinfo package="{}"><error>unknown package</error></sourceinfo>'.format(package))
+                continue
+            linked = ''
+            if self.packages[package]:
+                linked = '<linked project="{}" package="{}"/>'.format(*self.packages[package])
+            entries.append('<sourceinfo package="{0}" rev="1" vrev="1" srcmd5="s-{0}" verifymd5="v-{0}">'
+                           '<filename>{0}.spec</filename>{1}</sourceinfo>'.format(package, linked))
+        return StringIO('<sourcelist>{}</sourcelist>'.format(''.join(entries)))
+
+    def sourceinfo_requests(self):
+        return len([url for url in self.urls if '/source/' in url])
+
+
+class TestSourceInfoFetcher(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = MemoStore._instance
+        MemoStore._instance = MemoStore(os.path.join(self.tmpdir, MemoStore.FILENAME))
+        self.obs = OBS()
+        patcher = patch.object(osclib.sourceinfo, 'http_GET', side_effect=self.obs)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.fetcher = SourceInfoFetcher(APIURL, workers=3)
+
+    def tearDown(self):
+        MemoStore._instance = self.store
+        shutil.rmtree(self.tmpdir)
+
+    def test_fetch(self):
+        packages = sorted(self.obs.packages) + ['missing']
+        infos = self.fetcher.fetch('openSUSE:Leap:42.3', packages)
+        self.assertEqual(sorted(infos), sorted(self.obs.packages))
+        self.assertEqual(self.obs.sourceinfo_requests(), 3)
+        self.assertEqual(self.fetcher.requests, 3)
+
+        info = infos['p001']
+        self.assertEqual((info.srcmd5, info.verifymd5, info.linked, info.filenames),
+                         ('s-p001', 'v-p001', (), ('p001.spec',)))
+        self.assertEqual(infos['linked'].linked, (('openSUSE:Factory', 'linked'),))
+
+    def test_cache(self):
+        packages = ['p001', 'p002', 'linked']
+        infos = self.fetcher.get('openSUSE:Leap:42.3', packages)
+        self.assertEqual(self.obs.sourceinfo_requests(), 1)
+
+        # Only the linked package is fetched again.
+        self.obs.urls = []
+        self.assertEqual(self.fetcher.get('openSUSE:Leap:42.3', packages), infos)
+        self.assertEqual(self.obs.sourceinfo_requests(), 1)
+        self.assertEqual(urlparse.parse_qs(urlparse.urlsplit(self.obs.urls[-1]).query)['package'], ['linked'])
+
+        # Nothing is reused after a new commit.
+        self.obs.urls = []
+        self.obs.updated = '2017-01-02T00:00:00Z'
+        self.fetcher.get('openSUSE:Leap:42.3', packages)
+        self.assertEqual(urlparse.parse_qs(urlparse.urlsplit(self.obs.urls[-1]).query)['package'], sorted(packages))
+
+    def test_no_latest_commits(self):
+        self.obs.updated = None
+        self.fetcher.get('openSUSE:Leap:42.3', ['p001'])
+        self.fetcher.get('openSUSE:Leap:42.3', ['p001'])
+        self.assertEqual(self.obs.sourceinfo_requests(), 2)
@@ -0,0 +1,49 @@
+# Copyright (C) 2017 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+from StringIO import StringIO
+import unittest
+
+from osclib.xmlstream import iterchildren
+from osclib.xmlstream import latest_updated
+
+FIXTURES = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fixtures')
+
+
+class TestXMLStream(unittest.TestCase):
+    def test_iterchildren(self):
+        xml = ('<collection><request id="1"><action type="submit"/></request>'
+               '<other/><request id="2"><review state="new"/></request></collection>')
+        requests = list(iterchildren(StringIO(xml), 'request'))
+        self.assertEqual([rq.get('id') for rq in requests], ['1', '2'])
+        # The elements kept by the caller are complete.
+        self.assertEqual(requests[0].find('action').get('type'), 'submit')
+        self.assertEqual(requests[1].xpath('./review/@state'), ['new'])
+        self.assertEqual(len(list(iterchildren(StringIO(xml)))), 3)
+
+    def test_sourceinfo(self):
+        filename = os.path.join(FIXTURES, 'source', 'openSUSE:Factory:Rings:0-Bootstrap')
+        packages = [si.get('package') for si in iterchildren(filename, 'sourceinfo')]
+        self.assertEqual(packages[:2], ['elem-ring-0', 'elem-ring-mini'])
+
+    def test_latest_updated(self):
+        filename = os.path.join(FIXTURES, 'statistics', 'latest_updated')
+        self.assertEqual(list(latest_updated(filename)), [('notreal', '2016-12-18T11:49:37Z')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,6 +8,7 @@
 # Distribute under GPLv2 or GPLv3
 
 import cmdln
+from collections import namedtuple
 import datetime
 import json
 import os
@@ -17,7 +18,9 @@ import urllib2
 import logging
 import signal
 import time
+import urllib
 
+from multiprocessing.pool import ThreadPool
 from xml.etree import cElementTree as ET
 
 import osc
@@ -28,6 +31,7 @@ logger = logging.getLogger()
 PLUGINDIR = os.path.expanduser(os.path.dirname(os.path.realpath(__file__)))
 sys.path.append(PLUGINDIR)
 from osclib.conf import Config
+from osclib.memoize import CACHEDIR
 from osclib.stagingapi import StagingAPI
 from osc.core import makeurl
 
@@ -37,6 +41,228 @@ QA_INPROGRESS = 1
 QA_FAILED = 2
 QA_PASSED = 3
 
+OPENQA = 'https://openqa.opensuse.org'
+
+# A reason that keeps a project from being snapshotted, package is None
+# when the whole repository is not done yet
+NotReady = namedtuple('NotReady', ('project', 'package', 'repository', 'arch', 'reason'))
+
+
+class ReadinessReport(object):
+    """Result of a ReadinessEvaluator run"""
+
+    def __init__(self):
+        self.checked = []
+        self.problems = []
+        # products without a status, they do not block a snapshot
+        self.missing = []
+        self.requests = 0
+        self.seconds = 0.0
+
+    @property
+    def ready(self):
+        return not self.problems
+
+    def __nonzero__(self):
+        return self.ready
+
+    def log(self):
+        for p in self.problems:
+            line = ' '.join(x for x in (p.project, p.package, p.repository, p.arch) if x)
+            if p.reason.startswith('too large'):
+                logger.error('%s: %s' % (line, p.reason))
+            else:
+                logger.info('%s -> %s' % (line, p.reason))
+        for project, package, repository, arch in self.missing:
+            logger.warning('%s %s %s %s -> no build status' % (project, package, repository, arch))
+        logger.debug('checked %d products with %d requests in %.1fs: %s',
+                     len(self.checked), self.requests, self.seconds,
+                     'ready' if self.ready else '%d problems' % len(self.problems))
+
+
+class ReadinessEvaluator(object):
+    """Check if the products of a ToTest instance are ready for a snapshot.
+
+    The build results of each project are fetched with a single _result
+    request, which gives both the state of every repository and the
+    status of the products. The binary lists needed to check the size of
+    the media are the only other requests, and are done concurrently for
+    the products that succeeded, only when nothing else is in the way.
+
+    """
+
+    WORKERS = 4
+
+    def __init__(self, totest, workers=None):
+        self.totest = totest
+        self.api = totest.api
+        self.workers = workers if workers else self.WORKERS
+
+    def project_status(self, project, packages):
+        """Return the repository state, indexed by (repository, arch) with
+        (code, dirty) values, and the package status, indexed by
+        (package, repository, arch) with the code as value.
+
+        """
+        query = urllib.urlencode([('package', package) for package in packages])
+        url = self.api.makeurl(['build', project, '_result'], query)
+        root = ET.parse(self.api.retried_GET(url)).getroot()
+
+        repos = {}
+        status = {}
+        for result in root.findall('result'):
+            repository = result.get('repository')
+            arch = result.get('arch')
+            repos[(repository, arch)] = (result.get('code'), result.get('dirty', '') == 'true')
+            for s in result.findall('status'):
+                status[(s.get('package'), repository, arch)] = s.get('code')
+        return repos, status
+
+    def _iso_sizes(self, item):
+        project, package, repository, arch = item
+        url = self.api.makeurl(['build', project, repository, arch, package])
+        root = ET.parse(self.api.retried_GET(url)).getroot()
+        return item, [int(binary.get('size', 0)) for binary in root.findall('binary')
+                      if binary.get('filename', '').endswith('.iso')]
+
+    def evaluate(self, products):
+        """Evaluate a dictionary that maps each project to the list of
+        (package, repository, arch) products that have to be ready.
+
+        """
+        start = time.time()
+        report = ReadinessReport()
+        sizes = []
+        for project in sorted(products):
+            checks = products[project]
+            repos, status = self.project_status(project, sorted(set(c[0] for c in checks)))
+            report.requests += 1
+
+            for (repository, arch), (code, dirty) in sorted(repos.items()):
+                if self.totest.repo_ignored(repository, arch):
+                    continue
+                if dirty:
+                    report.problems.append(NotReady(project, None, repository, arch, 'dirty'))
+                if code not in self.totest.REPO_DONE_CODES:
+                    report.problems.append(NotReady(project, None, repository, arch, code))
+
+            for package, repository, arch in checks:
+                report.checked.append((project, package, repository, arch))
+                code = status.get((package, repository, arch))
+                if code is None:
+                    # no status is not a failed build, it does not block a snapshot
+                    report.missing.append((project, package, repository, arch))
+                elif code != 'succeeded':
+                    report.problems.append(NotReady(project, package, repository, arch, code))
+                    continue
+                if self.totest.maxsize_for_package(package):
+                    sizes.append((project, package, repository, arch))
+
+        # the media sizes only matter once everything else is ready
+        if sizes and report.ready:
+            pool = ThreadPool(min(self.workers, len(sizes)))
+            try:
+                for item, isosizes in pool.imap(self._iso_sizes, sizes):
+                    report.requests += 1
+                    maxsize = self.totest.maxsize_for_package(item[1])
+                    for isosize in isosizes:
+                        if isosize > maxsize:
+                            report.problems.append(NotReady(*(item + ('too large by %s bytes' % (isosize - maxsize),))))
+                            break
+            finally:
+                pool.terminate()
+                pool.join()
+
+        report.seconds = time.time() - start
+        return report
+
+
+class OpenQAJobStore(object):
+    """Keep the openQA jobs of the current snapshot on disk.
+
+    Once the job list of a snapshot is known, only the jobs that can
+    still change are queried again.  Failed jobs are polled as well, as
+    a restart clones them, and the clone is then followed by id.  The
+    whole job list is fetched again while there are less jobs than
+    expected and every REFRESH seconds, to notice jobs scheduled later.
+
+    """
+
+    # Results that can not change anymore
+    FINAL_RESULTS = ('passed', 'softfailed', 'obsoleted')
+    REFRESH = 3600
+    # Jobs per ids query
+    CHUNK = 50
+
+    def __init__(self, api, group, jobs_num, filename):
+        self.api = api
+        self.group = group
+        self.jobs_num = jobs_num
+        self.filename = filename
+        self.state = {}
+        self.requests = 0
+        if os.path.exists(self.filename):
+            try:
+                with open(self.filename) as f:
+                    self.state = json.load(f)
+            except ValueError:
+                pass
+
+    def save(self):
+        tmpfile = self.filename + '.tmp'
+        with open(tmpfile, 'w') as f:
+            json.dump(self.state, f)
+        os.rename(tmpfile, self.filename)
+
+    def _fetch(self, query, snapshot):
+        url = makeurl(OPENQA, ['api', 'v1', 'jobs'], query)
+        self.requests += 1
+        jobs = {}
+        for job in json.load(self.api.retried_GET(url))['jobs']:
+            jobs[str(job['id'])] = {
+                'id': job['id'],
+                'name': job['name'].replace(snapshot, ''),
+                'state': job['state'],
+                'result': job['result'],
+                'clone_id': job['clone_id'],
+                'machine': job['settings']['MACHINE'],
+                # only the failed modules are needed to explain a failure
+                'modules': [m for m in job.get('modules', []) if m['result'] == 'failed'],
+            }
+        return jobs
+
+    def is_final(self, job):
+        return bool(job['clone_id']) or job['result'] in self.FINAL_RESULTS
+
+    def current(self):
+        return sorted((job for job in self.state['jobs'].values()
+                       if not job['clone_id'] and job['result'] != 'obsoleted'),
+                      key=lambda job: job['id'])
+
+    def jobs(self, snapshot):
+        """Return the current jobs of the snapshot, without the cloned and
+        obsoleted ones
+
+        """
+        if self.state.get('snapshot') != snapshot:
+            self.state = {'snapshot': snapshot, 'refreshed': 0, 'jobs': {}}
+        jobs = self.state['jobs']
+
+        if time.time() - self.state['refreshed'] > self.REFRESH or len(self.current()) < self.jobs_num:
+            jobs.update(self._fetch({'group': self.group, 'build': snapshot}, snapshot))
+            self.state['refreshed'] = time.time()
+        else:
+            ids = set(key for key, job in jobs.items() if not self.is_final(job))
+            ids.update(str(job['clone_id']) for job in jobs.values()
+                       if job['clone_id'] and str(job['clone_id']) not in jobs)
+            ids = sorted(ids, key=int)
+            for i in range(0, len(ids), self.CHUNK):
+                jobs.update(self._fetch({'ids': ','.join(ids[i:i + self.CHUNK])}, snapshot))
+
+        logger.debug('%d openQA jobs of %s known, %d requests', len(jobs), snapshot, self.requests)
+        self.save()
+        return self.current()
+
 
 class ToTestBase(object):
     """Base class to store the basic interface"""
@@ -119,15 +345,9 @@ class ToTestBase(object):
 
         """
 
-        url = makeurl('https://openqa.opensuse.org', ['api', 'v1', 'jobs'], { 'group': self.openqa_group(), 'build': snapshot } )
-        f = self.api.retried_GET(url)
-        jobs = []
-        for job in json.load(f)['jobs']:
-            if job['clone_id'] or job['result'] == 'obsoleted':
-                continue
-            job['name'] = job['name'].replace(snapshot, '')
-            jobs.append(job)
-        return jobs
+        filename = os.path.join(CACHEDIR, 'totest-openqa-%s.json' % self.project.replace(':', '-'))
+        store = OpenQAJobStore(self.api, self.openqa_group(), self.jobs_num(), filename)
+        return store.jobs(snapshot)
 
     def _result2str(self, result):
         if result == QA_INPROGRESS:
@@ -162,21 +382,20 @@ class ToTestBase(object):
 
         number_of_fails = 0
         in_progress = False
-        machines = []
+        machines = set()
+        failing_known = set()
+        known_failures = set(self.known_failures)
         for job in jobs:
-            machines.append(job['settings']['MACHINE'])
-            # print json.dumps(job, sort_keys=True, indent=4)
+            machines.add(job['machine'])
             if job['result'] in ('failed', 'incomplete', 'skipped', 'user_cancelled', 'obsoleted'):
                 jobname = job['name']
-                # Record machines we have tests for
-                if jobname in self.known_failures:
+                if jobname in known_failures:
                     logger.debug("known failure %s ignored", jobname)
-                    self.known_failures.remove(jobname)
+                    failing_known.add(jobname)
                     continue
                 number_of_fails += 1
-                # print json.dumps(job, sort_keys=True, indent=4), jobname
                 failedmodule = self.find_failed_module(job['modules'])
-                url = 'https://openqa.opensuse.org/tests/%s' % job['id']
+                url = '%s/tests/%s' % (OPENQA, job['id'])
                 logger.info("job %s failed %s, see %s", jobname, 'early' if failedmodule is None else failedmodule, url)
                 # if number_of_fails < 3: continue
             elif job['result'] == 'passed' or job['result'] == 'softfailed':
@@ -193,34 +412,37 @@ class ToTestBase(object):
         if in_progress:
             return QA_INPROGRESS
 
-        machines = list(set(machines))
-        for item in machines:
-            for item2 in self.known_failures:
-                if item2.split('@')[1] == item:
-                    logger.info('now passing %s'%item2)
+        for item in sorted(known_failures - failing_known):
+            if item.split('@')[1] in machines:
+                logger.info('now passing %s'%item)
         return QA_PASSED
 
+    # coolo's experience says that 'finished' won't be
+    # sufficient here, so don't try to add it :-)
+    REPO_DONE_CODES = ('published', 'unpublished')
+
+    def repo_ignored(self, repository, arch):
+        # ignore ports. 'factory' is used by arm for repos that are not
+        # meant to use the totest manager.
+        if repository in ('ports', 'factory', 'images_staging'):
+            return True
+        # ignore 32bit for now. We're only interesed in aarch64 here
+        return arch in ('armv6l', 'armv7l')
+
     def all_repos_done(self, project, codes=None):
         """Check the build result of the project and only return True if all
         repos of that project are either published or unpublished
 
         """
 
-        # coolo's experience says that 'finished' won't be
-        # sufficient here, so don't try to add it :-)
-        codes = ['published', 'unpublished'] if not codes else codes
+        codes = self.REPO_DONE_CODES if not codes else codes
 
         url = self.api.makeurl(['build', project, '_result'], {'code': 'failed'})
         f = self.api.retried_GET(url)
         root = ET.parse(f).getroot()
         ready = True
         for repo in root.findall('result'):
-            # ignore ports. 'factory' is used by arm for repos that are not
-            # meant to use the totest manager.
-            if repo.get('repository') in ('ports', 'factory', 'images_staging'):
-                continue
-            # ignore 32bit for now. We're only interesed in aarch64 here
-            if repo.get('arch') in ('armv6l', 'armv7l'):
+            if self.repo_ignored(repo.get('repository'), repo.get('arch')):
                 continue
             if repo.get('dirty', '') == 'true':
                 logger.info('%s %s %s -> %s'%(repo.get('project'), repo.get('repository'), repo.get('arch'), 'dirty'))
@@ -254,62 +476,31 @@ class ToTestBase(object):
 
         raise Exception('No maxsize for {}'.format(package))
 
-    def package_ok(self, project, package, repository, arch):
-        """Checks one package in a project and returns True if it's succeeded
+    def snapshot_products(self):
+        """Return the products that have to be ready for a snapshot, as
+        a dictionary of project to (package, repository, arch) tuples
 
         """
 
-        query = {'package': package, 'repository': repository, 'arch': arch}
-
-        url = self.api.makeurl(['build', project, '_result'], query)
-        f = self.api.retried_GET(url)
-        root = ET.parse(f).getroot()
-        for repo in root.findall('result'):
-            status = repo.find('status')
-            if status.get('code') != 'succeeded':
-                logger.info('%s %s %s %s -> %s'%(project, package, repository, arch, status.get('code')))
-                return False
-
-        maxsize = self.maxsize_for_package(package)
-        if not maxsize:
-            return True
+        products = {'openSUSE:%s' % self.project:
+                    [(product, 'images', 'local') for product in self.ftp_products + self.main_products]}
 
-        url = self.api.makeurl(['build', project, repository, arch, package])
-        f = self.api.retried_GET(url)
-        root = ET.parse(f).getroot()
-        for binary in root.findall('binary'):
-            if not binary.get('filename', '').endswith('.iso'):
-                continue
-            isosize = int(binary.get('size', 0))
-            if isosize > maxsize:
-                logger.error('%s %s %s %s: %s'%(project, package, repository, arch, 'too large by %s bytes' % (isosize-maxsize)))
-                return False
+        if len(self.livecd_products):
+            products['openSUSE:%s:Live' % self.project] = [
+                (product, 'standard', arch)
+                for arch in ['i586', 'x86_64']
+                for product in self.livecd_products]
 
-        return True
+        return products
 
     def is_snapshottable(self):
         """Check various conditions required for factory to be snapshotable
 
         """
 
-        if not self.all_repos_done('openSUSE:%s' % self.project):
-            return False
-
-        for product in self.ftp_products + self.main_products:
-            if not self.package_ok('openSUSE:%s' % self.project, product, 'images', 'local'):
-                return False
-
-            if len(self.livecd_products):
-
-                if not self.all_repos_done('openSUSE:%s:Live' % self.project):
-                    return False
-
-                for arch in ['i586', 'x86_64' ]:
-                    for product in self.livecd_products:
-                        if not self.package_ok('openSUSE:%s:Live' % self.project, product, 'standard', arch):
-                            return False
-
-        return True
+        report = ReadinessEvaluator(self).evaluate(self.snapshot_products())
+        report.log()
+        return report.ready
 
     def release_package(self, project, package, set_release=None):
         query = {'cmd': 'release'}
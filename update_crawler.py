@@ -34,9 +34,9 @@ import osc.core
 import rpm
 import yaml
 import re
-from urllib import quote_plus
 
 from osclib.memoize import memoize
+from osclib.sourceinfo import SourceInfoFetcher
 
 OPENSUSE = 'openSUSE:Leap:42.3'
 FACTORY = 'openSUSE:Factory'
@@ -45,13 +45,6 @@ SLE = 'SUSE:SLE-12-SP2:Update'
 makeurl = osc.core.makeurl
 http_GET = osc.core.http_GET
 
-# http://stackoverflow.com/questions/312443/how-do-you-split-a-list-into-evenly-sized-chunks-in-python
-def chunks(l, n):
-    """ Yield successive n-sized chunks from l.
-    """
-    for i in xrange(0, len(l), n):
-        yield l[i:i+n]
-
 class UpdateCrawler(object):
     def __init__(self, from_prj, to_prj):
         self.from_prj = from_prj
@@ -63,6 +56,9 @@ class UpdateCrawler(object):
         self.dryrun = False
         self.skipped = {}
         self.submit_new = {}
+        self.sourceinfo = SourceInfoFetcher(self.apiurl)
+        # (src_project, src_package, dst_package) -> [(reqid, src_rev)]
+        self.requests = None
 
         self.parse_lookup()
 
@@ -120,24 +116,10 @@ class UpdateCrawler(object):
         root = ET.fromstring(self._meta_get_packagelist(prj, deleted, expand))
         return [ node.get('name') for node in root.findall('entry') if not node.get('name') == '_product' and not node.get('name').startswith('_product:') and not node.get('name').startswith('patchinfo.') ]
 
-    def _get_source_infos(self, project, packages):
-        query = [ 'view=info' ]
-        if packages:
-            query += [ 'package=%s'%quote_plus(p) for p in packages ]
-
-        return self.cached_GET(makeurl(self.apiurl,
-                                ['source', project],
-                                query))
-
     def get_source_infos(self, project, packages):
-        ret = dict()
-        for pkg_chunks in chunks(sorted(packages), 50):
-            root = ET.fromstring(self._get_source_infos(project, pkg_chunks))
-            for package in root.findall('sourceinfo'):
-                if package.findall('error'):
-                    continue
-                ret[package.get('package')] = package
-        return ret
+        if self.caching:
+            return self.sourceinfo.get(project, packages)
+        return self.sourceinfo.fetch(project, packages)
 
     def _get_source_package(self, project, package, revision):
         opts = { 'view': 'info' }
@@ -146,29 +128,39 @@ class UpdateCrawler(object):
         return self.cached_GET(makeurl(self.apiurl,
                                 ['source', project, package], opts))
 
+    def load_requests(self):
+        """Index the submit requests to the target project that are not
+        accepted yet, all of them fetched with a single search."""
+        states = ['new', 'review', 'declined', 'revoked']
+        xpath = "({}) and action[@type='submit' and target/@project='{}']".format(
+            ' or '.join("state/@name='{}'".format(state) for state in states), self.to_prj)
+        root = ET.parse(self.retried_GET(makeurl(self.apiurl, ['search', 'request'],
+                                                 {'match': xpath}))).getroot()
+        self.requests = {}
+        for node in root.findall('request'):
+            r = osc.core.Request()
+            r.read(node)
+            for a in r.actions:
+                if a.type != 'submit' or a.tgt_project != self.to_prj:
+                    continue
+                key = (a.src_project, a.src_package, a.tgt_package)
+                self.requests.setdefault(key, []).append((r.reqid, a.src_rev))
+
     def _find_existing_request(self, src_project, src_package, rev, dst_project,
                        dst_package):
-        """Create a submit request."""
-        states = ['new', 'review', 'declined', 'revoked']
-        reqs = osc.core.get_exact_request_list(self.apiurl,
-                                               src_project,
-                                               dst_project,
-                                               src_package,
-                                               dst_package,
-                                               req_type='submit',
-                                               req_state=states)
+        """Check for a request of the same sources."""
+        if self.requests is None:
+            self.load_requests()
         foundrev = False
-        for r in reqs:
-            for a in r.actions:
-                srcrev = a.src_rev
-                # sometimes requests only contain the decimal revision
-                if re.match(r'^\d+$', srcrev) is not None:
-                    xml = ET.fromstring(self._get_source_package(src_project,src_package, srcrev))
-                    srcrev = xml.get('verifymd5')
-                logging.debug('rev {}'.format(srcrev))
-                if srcrev == rev:
-                    logging.debug('{}: found existing request {}'.format(dst_package, r.reqid))
-                    foundrev = True
+        for reqid, srcrev in self.requests.get((src_project, src_package, dst_package), []):
+            # sometimes requests only contain the decimal revision
+            if re.match(r'^\d+$', srcrev) is not None:
+                xml = ET.fromstring(self._get_source_package(src_project,src_package, srcrev))
+                srcrev = xml.get('verifymd5')
+            logging.debug('rev {}'.format(srcrev))
+            if srcrev == rev:
+                logging.debug('{}: found existing request {}'.format(dst_package, reqid))
+                foundrev = True
         return foundrev
 
     def _submitrequest(self, src_project, src_package, rev, dst_project,
@@ -194,7 +186,11 @@ class UpdateCrawler(object):
                                    dst_package, msg)
         return 0
 
-    def is_source_innerlink(self, project, package):
+    def is_source_innerlink(self, project, package, sourceinfo=None):
+        # only a link to the same project can be an inner link, so
+        # the _link is not fetched for the rest
+        if sourceinfo is not None and (project not in [p for p, _ in sourceinfo.linked[:1]]):
+            return False
         try:
             root = ET.fromstring(
                 self.cached_GET(makeurl(self.apiurl,
@@ -216,23 +212,46 @@ class UpdateCrawler(object):
         return self.cached_GET(makeurl(self.apiurl,
                                 ['source', prj, '00Meta', 'lookup.yml']))
 
-    def follow_link(self, project, package, rev, verifymd5):
-        #print "follow", project, package, rev
-        # verify it's still the same package
-        xml = ET.fromstring(self._get_source_package(project, package, rev))
-        if xml.get('verifymd5') != verifymd5:
-            return None
-        xml = ET.fromstring(self.cached_GET(makeurl(self.apiurl,
-                                             ['source', project, package],
-                                             {
-                                                 'rev': rev
-                                             })))
-        linkinfo =  xml.find('linkinfo')
-        if not linkinfo is None:
-            ret = self.follow_link(linkinfo.get('project'), linkinfo.get('package'), linkinfo.get('srcmd5'), verifymd5)
-            if ret:
-                project, package, rev = ret
-        return (project, package, rev)
+    def resolve_links(self, project, sources):
+        """Find the origin of the packages by following their links.
+
+        Return a dictionary with the (project, package, rev) to submit
+        each package from.  The sourceinfo of the link targets is fetched
+        with one chunked request per project, and the chain of a package
+        is followed as long as the target has the same verifymd5.
+
+        The head of the link targets is compared, not the revision a
+        link is pinned to.  A package with a pinned link (rev= in the
+        _link) is therefore only submitted from its target when the head
+        of the target still has the same sources, otherwise it is
+        submitted from where the link stops.
+
+        """
+        targets = {}
+        for sourceinfo in sources.values():
+            for link in sourceinfo.linked:
+                targets.setdefault(link[0], set()).add(link[1])
+
+        linked = {}
+        for target, packages in targets.items():
+            try:
+                infos = self.get_source_infos(target, packages)
+            except urllib2.HTTPError, e:
+                logging.warn('Failed to get the link targets in {}: {}'.format(target, e))
+                continue
+            for package, sourceinfo in infos.items():
+                linked[(target, package)] = sourceinfo
+
+        ret = {}
+        for package, sourceinfo in sources.items():
+            origin = (project, package, sourceinfo.srcmd5)
+            for link in sourceinfo.linked:
+                target = linked.get(link)
+                if target is None or target.verifymd5 != sourceinfo.verifymd5:
+                    break
+                origin = link + (target.srcmd5,)
+            ret[package] = origin
+        return ret
 
     def update_targets(self, targets, sources):
 
@@ -244,12 +263,13 @@ class UpdateCrawler(object):
             for package, sourceinfo in sources.items():
                 if package.startswith('patchinfo.'):
                     continue
-                files = set([node.text for node in sourceinfo.findall('filename')])
+                files = set(sourceinfo.filenames)
                 if '{}.spec'.format(package) in files:
                     mainpacks.add(package)
 
             sources = { package: sourceinfo for package, sourceinfo in sources.iteritems() if package in mainpacks }
 
+        updates = []
         for package, sourceinfo in sources.items():
 
             origin = self.lookup.get(package, '')
@@ -263,7 +283,7 @@ class UpdateCrawler(object):
                     logging.info('Package %s not found in targets' % (package))
                     continue
 
-                if self.is_source_innerlink(self.from_prj, package):
+                if self.is_source_innerlink(self.from_prj, package, sourceinfo):
                     logging.debug('Package %s is sub package' % (package))
                     continue
 
@@ -274,13 +294,13 @@ class UpdateCrawler(object):
                 #    continue
 
                 # Compare verifymd5
-                md5_from = sourceinfo.get('verifymd5')
-                md5_to = targetinfo.get('verifymd5')
+                md5_from = sourceinfo.verifymd5
+                md5_to = targetinfo.verifymd5
                 if md5_from == md5_to:
                     #logging.info('Package %s not marked for update' % package)
                     continue
 
-                if self.is_source_innerlink(self.to_prj, package):
+                if self.is_source_innerlink(self.to_prj, package, targetinfo):
                     logging.debug('Package %s is sub package' % (package))
                     continue
 
@@ -291,10 +311,19 @@ class UpdateCrawler(object):
 #                originproject = sourceinfo.find('originproject').text
 #                logging.warn('changed originproject for {} to {}'.format(package, originproject))
 
-            src_project, src_package, src_rev = self.follow_link(self.from_prj, package,
-                                                                 sourceinfo.get('srcmd5'),
-                                                                 sourceinfo.get('verifymd5'))
+            updates.append((package, origin))
+
+        if not updates:
+            return
+
+        # resolve the links and find the existing requests in bulk
+        # instead of per package
+        links = self.resolve_links(self.from_prj, dict((package, sources[package])
+                                                       for package, _ in updates))
+        self.load_requests()
 
+        for package, origin in updates:
+            src_project, src_package, src_rev = links[package]
             res = self.submitrequest(src_project, src_package, src_rev, package, origin)
             if res:
                 logging.info('Created request %s for %s' % (res, package))